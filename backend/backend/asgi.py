@@ -12,6 +12,7 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import mqtt_app.routing
+from mqtt_app.lifespan import MQTTLifespanMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
@@ -19,12 +20,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
-application = ProtocolTypeRouter({
+# The lifespan middleware runs the asyncio MQTT engine (MQTT_ENGINE=asyncio)
+# inside the server's event loop
+application = MQTTLifespanMiddleware(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             mqtt_app.routing.websocket_urlpatterns
         )
     ),
-})
+}))
 
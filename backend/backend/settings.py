@@ -4,6 +4,7 @@ Django settings for backend project.
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -106,11 +107,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
+    # JSON through the codec selected by MQTT_JSON_CODEC
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'mqtt_app.renderers.CodecJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'mqtt_app.parsers.CodecJSONParser',
     ],
 }
 
@@ -141,6 +143,97 @@ MQTT_KEEPALIVE = int(os.getenv('MQTT_KEEPALIVE', 60))
 MQTT_USE_TLS = os.getenv('MQTT_USE_TLS', 'False').lower() == 'true'
 MQTT_TLS_INSECURE = os.getenv('MQTT_TLS_INSECURE', 'False').lower() == 'true'  # For development only
 
+# Sessions and reconnects: a stable client ID with a persistent session and QoS 1 subscriptions lets the
+# broker queue messages while we are disconnected. Default client ID: mqtt-websocket-<hostname>
+MQTT_CLIENT_ID = os.getenv('MQTT_CLIENT_ID', '')
+MQTT_CLEAN_SESSION = os.getenv('MQTT_CLEAN_SESSION', 'False').lower() == 'true'  # True = forget the session on disconnect
+MQTT_SUBSCRIBE_QOS = int(os.getenv('MQTT_SUBSCRIBE_QOS', 1))  # 0 = no redelivery, 1 = at least once
+MQTT_SESSION_EXPIRY = int(os.getenv('MQTT_SESSION_EXPIRY', 3600))  # Seconds the broker keeps an MQTT v5 session
+MQTT_RECONNECT_MIN_DELAY = float(os.getenv('MQTT_RECONNECT_MIN_DELAY', 0.5))  # First reconnect delay (seconds)
+MQTT_RECONNECT_MAX_DELAY = float(os.getenv('MQTT_RECONNECT_MAX_DELAY', 30))  # Cap of the jittered exponential backoff
+MQTT_DEDUP_WINDOW = int(os.getenv('MQTT_DEDUP_WINDOW', 10000))  # Recent QoS 1 messages remembered to drop redeliveries
+
+MQTT_DB_BATCH_SIZE = int(os.getenv('MQTT_DB_BATCH_SIZE', 200))  # Flush when this many messages are buffered
+MQTT_DB_FLUSH_INTERVAL = float(os.getenv('MQTT_DB_FLUSH_INTERVAL', 1.0))  # ...or after this many seconds
+MQTT_DB_MAX_PENDING = int(os.getenv('MQTT_DB_MAX_PENDING', 100000))  # Max messages waiting to be written
+MQTT_DB_OVERFLOW = os.getenv('MQTT_DB_OVERFLOW', 'drop_oldest')  # block, drop_oldest or drop_newest
+MQTT_DB_MAX_RETRIES = int(os.getenv('MQTT_DB_MAX_RETRIES', 3))  # Retries of a failed batch before it is dropped
+
+# Stored payload compression: 'zlib' (with trained per-topic dictionaries when available) or 'none'
+MQTT_PAYLOAD_COMPRESSION = os.getenv('MQTT_PAYLOAD_COMPRESSION', 'zlib')
+MQTT_PAYLOAD_COMPRESSION_LEVEL = int(os.getenv('MQTT_PAYLOAD_COMPRESSION_LEVEL', 6))  # 1 (fastest) - 9 (smallest)
+MQTT_PAYLOAD_DICTIONARY_REFRESH = float(os.getenv('MQTT_PAYLOAD_DICTIONARY_REFRESH', 60))  # Seconds between dictionary reloads
+
+# Brokers come from active MQTTConfig rows (API/admin) and fall back to the MQTT_BROKER_* settings above
+MQTT_CONFIG_RELOAD_INTERVAL = float(os.getenv('MQTT_CONFIG_RELOAD_INTERVAL', 10))  # Seconds between config re-reads
+
+# Start ingest inside the web server; set to False when running `manage.py mqtt_ingest` separately
+MQTT_AUTOSTART = os.getenv('MQTT_AUTOSTART', 'True').lower() == 'true'
+MQTT_INGEST_PROCESSES = int(os.getenv('MQTT_INGEST_PROCESSES', 2))  # Worker processes of manage.py mqtt_ingest
+
+# Several server worker processes: 'single' (every process ingests - use with one worker),
+# 'shared' (MQTT v5 shared subscriptions, the broker splits messages between processes)
+# or 'leader' (one process on this host ingests, elected through a lock file)
+MQTT_INGEST_MODE = os.getenv('MQTT_INGEST_MODE', 'single')
+MQTT_SHARED_GROUP = os.getenv('MQTT_SHARED_GROUP', 'mqtt-websocket')  # Shared subscription group name
+MQTT_LEADER_LOCK_FILE = os.getenv('MQTT_LEADER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'mqtt-ingest.lock'))
+MQTT_SHARED_SLOT_LOCK = os.getenv('MQTT_SHARED_SLOT_LOCK', os.path.join(tempfile.gettempdir(), 'mqtt-ingest-slot'))  # Slot lock files: <prefix>-<n>.lock
+MQTT_LEADER_RETRY_INTERVAL = float(os.getenv('MQTT_LEADER_RETRY_INTERVAL', 5))  # Seconds between takeover attempts
+
+# Ingest engine: 'thread' (paho network thread + worker pool) or 'asyncio' (inside the ASGI server's event loop)
+MQTT_ENGINE = os.getenv('MQTT_ENGINE', 'thread')
+MQTT_WORKERS = int(os.getenv('MQTT_WORKERS', 2))  # Threads processing received messages
+MQTT_QUEUE_SIZE = int(os.getenv('MQTT_QUEUE_SIZE', 10000))  # Max messages waiting for a worker
+MQTT_QUEUE_OVERFLOW = os.getenv('MQTT_QUEUE_OVERFLOW', 'block')  # block, drop_oldest or drop_newest
+MQTT_BROADCAST_BATCHING = os.getenv('MQTT_BROADCAST_BATCHING', 'False').lower() == 'true'  # Send mqtt_batch frames
+MQTT_BROADCAST_WINDOW_MS = int(os.getenv('MQTT_BROADCAST_WINDOW_MS', 25))  # Max time a message waits for its batch
+MQTT_BROADCAST_BATCH_SIZE = int(os.getenv('MQTT_BROADCAST_BATCH_SIZE', 100))  # Max messages per batch
+MQTT_LAST_VALUE_MAX_TOPICS = int(os.getenv('MQTT_LAST_VALUE_MAX_TOPICS', 10000))  # Topics kept in the last-value cache
+MQTT_LAST_VALUE_MAX_BYTES = int(os.getenv('MQTT_LAST_VALUE_MAX_BYTES', 16 * 1024 * 1024))  # Memory cap of that cache
+MQTT_LAST_VALUE_SNAPSHOT = os.getenv('MQTT_LAST_VALUE_SNAPSHOT', 'True').lower() == 'true'  # Send snapshot on connect
+MQTT_REPLAY_BUFFER_SIZE = int(os.getenv('MQTT_REPLAY_BUFFER_SIZE', 10000))  # Messages kept for reconnecting clients
+
+# Slow WebSocket clients: conflate (latest value per topic), drop_oldest or disconnect
+MQTT_WS_SLOW_CONSUMER_POLICY = os.getenv('MQTT_WS_SLOW_CONSUMER_POLICY', 'conflate')
+MQTT_WS_SEND_QUEUE_SIZE = int(os.getenv('MQTT_WS_SEND_QUEUE_SIZE', 1000))  # Frames queued per connection
+MQTT_WS_MAX_LAG = float(os.getenv('MQTT_WS_MAX_LAG', 30))  # Seconds behind before 'disconnect' drops a client
+MQTT_WS_CONFLATE_DEPTH = int(os.getenv('MQTT_WS_CONFLATE_DEPTH', 100))  # Frames queued before 'conflate' replaces any
+MQTT_WS_CONFLATE_LAG = float(os.getenv('MQTT_WS_CONFLATE_LAG', 1.0))  # Or seconds behind before it does
+
+# Binary WebSocket frames (mqtt.msgpack / mqtt.cbor subprotocols) of at least this many bytes are zlib compressed
+MQTT_WS_COMPRESS_MIN_BYTES = int(os.getenv('MQTT_WS_COMPRESS_MIN_BYTES', 1024))  # 0 = never compress
+MQTT_WS_COMPRESS_LEVEL = int(os.getenv('MQTT_WS_COMPRESS_LEVEL', 6))  # 1 (fastest) - 9 (smallest)
+
+# Message history retention (0 = unlimited)
+MQTT_RETENTION_MAX_AGE = int(os.getenv('MQTT_RETENTION_MAX_AGE', 0))  # Seconds to keep messages
+MQTT_RETENTION_MAX_ROWS = int(os.getenv('MQTT_RETENTION_MAX_ROWS', 0))  # Max messages to keep
+# Per-topic rules, first match wins, e.g. [{"topic": "flash/sirens/+/status", "max_age": 86400, "max_rows": 100000}]
+MQTT_RETENTION_RULES = os.getenv('MQTT_RETENTION_RULES', '[]')
+MQTT_RETENTION_INTERVAL = int(os.getenv('MQTT_RETENTION_INTERVAL', 300))  # Seconds between retention runs
+MQTT_RETENTION_BATCH_SIZE = int(os.getenv('MQTT_RETENTION_BATCH_SIZE', 1000))  # Rows deleted per batch
+MQTT_RETENTION_BATCH_PAUSE = float(os.getenv('MQTT_RETENTION_BATCH_PAUSE', 0.05))  # Seconds between batches
+
+# JSON library for ingest, WebSocket frames and the REST API: auto (fastest installed), orjson, ujson or json
+MQTT_JSON_CODEC = os.getenv('MQTT_JSON_CODEC', 'auto')
+
+# Streaming history export
+MQTT_EXPORT_CHUNK_SIZE = int(os.getenv('MQTT_EXPORT_CHUNK_SIZE', 2000))  # Rows fetched per query when streaming exports
+
+# Time-bucket rollups of numeric payload fields (1s/1m/1h min/max/avg/count/last)
+# JSON map of topic filter -> dot-separated field paths, e.g. {"flash/sirens/+/status": ["battery", "sensors.temp"]}
+MQTT_ROLLUP_FIELDS = os.getenv('MQTT_ROLLUP_FIELDS', '{}')
+MQTT_ROLLUP_FLUSH_INTERVAL = float(os.getenv('MQTT_ROLLUP_FLUSH_INTERVAL', 1.0))  # Seconds between rollup writes
+# Seconds to keep rollups per resolution (0 = unlimited)
+MQTT_ROLLUP_RETENTION = os.getenv('MQTT_ROLLUP_RETENTION', '{"1s": 86400, "1m": 2592000, "1h": 0}')
+
+# Payload fields indexed for history filters (?payload.status=alert)
+# JSON map of topic filter -> dot-separated field paths, e.g. {"flash/sirens/+/status": ["clientID", "status", "vin"]}
+MQTT_PAYLOAD_INDEX_FIELDS = os.getenv('MQTT_PAYLOAD_INDEX_FIELDS', '{}')
+
+# Prometheus metrics at /metrics
+MQTT_METRICS_TOPIC_LEVELS = int(os.getenv('MQTT_METRICS_TOPIC_LEVELS', 1))  # Topic levels in the per-prefix ingest counter
+MQTT_METRICS_MAX_PREFIXES = int(os.getenv('MQTT_METRICS_MAX_PREFIXES', 100))  # Further prefixes are counted as _other
+
 # Swagger/OpenAPI settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
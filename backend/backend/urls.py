@@ -6,6 +6,7 @@ from django.urls import path, include
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from mqtt_app.views import prometheus_metrics
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -23,6 +24,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('mqtt_app.urls')),
+    path('metrics', prometheus_metrics, name='metrics'),
     
     # Swagger URLs
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
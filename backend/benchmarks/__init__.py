@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the MQTT ingest and WebSocket paths
+
+Run from the backend directory, e.g. ``python -m benchmarks.bench_fanout``.
+"""
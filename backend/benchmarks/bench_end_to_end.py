@@ -0,0 +1,293 @@
+"""
+End-to-end throughput and latency from MQTT publish to WebSocket frame
+
+Starts the local broker stand-in (benchmarks/broker.py), the real ingest
+engine (MQTTClient or AsyncMQTTClient) and MQTTConsumer WebSocket clients
+on an in-memory channel layer and a throwaway database, then publishes at
+a fixed rate (0 = as fast as possible) with the given payload size spread
+over the given number of topics. Every payload carries its publish time,
+so each frame a client receives is one latency sample. One run is made
+for every combination of the comma-separated options.
+
+Results can be saved with --output and compared with an earlier file
+with --baseline.
+
+Usage:
+    python -m benchmarks.bench_end_to_end [--engines thread,asyncio] [--messages 2000]
+        [--rates 0,1000] [--payload-sizes 256] [--topics 10] [--clients 1]
+        [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import platform
+import time
+from datetime import datetime, timezone
+from .common import setup_django, setup_test_database, print_table, LOOP_SAFE_CHANNEL_LAYERS
+
+setup_django()
+setup_test_database()
+
+import paho.mqtt.client as mqtt  # noqa: E402
+from channels.testing.websocket import WebsocketCommunicator  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from mqtt_app.async_client import AsyncMQTTClient  # noqa: E402
+from mqtt_app.consumers import MQTTConsumer  # noqa: E402
+from mqtt_app.json_codec import codec  # noqa: E402
+from mqtt_app.mqtt_client import MQTTClient  # noqa: E402
+from .broker import LocalBroker  # noqa: E402
+
+ENGINES = {'thread': MQTTClient, 'asyncio': AsyncMQTTClient}
+TOPIC_PREFIX = 'bench'
+RUN_KEYS = ('engine', 'rate', 'payload_size', 'topics', 'clients')
+# '{"sent":<19 digits>,"pad":""}' around the padding
+PAYLOAD_OVERHEAD = 37
+
+
+def publish(port, messages, rate, topics, payload_size, qos):
+    """Publish the benchmark messages from a separate paho client; blocks until all are sent"""
+    client = mqtt.Client()
+    client.connect('127.0.0.1', port)
+    client.loop_start()
+    pad = 'x' * max(0, payload_size - PAYLOAD_OVERHEAD)
+    started = time.perf_counter()
+    info = None
+    for index in range(messages):
+        if rate:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        info = client.publish(
+            f'{TOPIC_PREFIX}/{index % topics}', '{"sent":%d,"pad":"%s"}' % (time.perf_counter_ns(), pad), qos=qos
+        )
+    if info is not None:
+        info.wait_for_publish()
+    elapsed = time.perf_counter() - started
+    client.disconnect()
+    client.loop_stop()
+    return elapsed
+
+
+def publish_warmup(port):
+    client = mqtt.Client()
+    client.connect('127.0.0.1', port)
+    client.loop_start()
+    client.publish(f'{TOPIC_PREFIX}/warmup', '{}').wait_for_publish()
+    client.disconnect()
+    client.loop_stop()
+
+
+async def drain(communicator):
+    """Discard frames already received (welcome, snapshot, warm-up)"""
+    while not await communicator.receive_nothing(timeout=0.1):
+        await communicator.receive_from()
+
+
+async def warm_up(communicators, port, timeout=10):
+    """Publish until the first client receives a message, i.e. ingest is subscribed"""
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + timeout
+    for communicator in communicators:
+        await drain(communicator)
+    while time.monotonic() < deadline:
+        await loop.run_in_executor(None, publish_warmup, port)
+        if not await communicators[0].receive_nothing(timeout=0.5):
+            break
+    else:
+        raise RuntimeError('Ingest engine did not subscribe to the broker stand-in')
+    for communicator in communicators:
+        await drain(communicator)
+
+
+async def collect(communicator, expected, latencies, idle_timeout):
+    """Read frames until expected messages arrived or none came for idle_timeout; return (count, last arrival)"""
+    received, last = 0, None
+    while received < expected:
+        if await communicator.receive_nothing(timeout=idle_timeout):
+            break
+        frame = codec.loads(await communicator.receive_from())
+        now = time.perf_counter_ns()
+        if frame.get('type') == 'mqtt_message':
+            items = [frame['data']]
+        elif frame.get('type') == 'mqtt_batch':
+            items = frame['data']
+        else:
+            continue
+        for data in items:
+            payload = data.get('payload')
+            if isinstance(payload, dict) and 'sent' in payload:
+                latencies.append(now - payload['sent'])
+                received += 1
+                last = now
+    return received, last
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+async def run(broker, engine_name, rate, payload_size, topics, clients, messages, qos, idle_timeout):
+    engine = ENGINES[engine_name]()
+    loop = asyncio.get_running_loop()
+    if engine_name == 'asyncio':
+        await engine.start()
+    else:
+        engine.connect()
+
+    application = MQTTConsumer.as_asgi()
+    communicators = [WebsocketCommunicator(application, '/ws/mqtt/') for _ in range(clients)]
+    for communicator in communicators:
+        await communicator.connect()
+    await warm_up(communicators, broker.port)
+
+    latencies = []
+    started = time.perf_counter_ns()
+    collectors = [
+        asyncio.ensure_future(collect(communicator, messages, latencies, idle_timeout))
+        for communicator in communicators
+    ]
+    publish_seconds = await loop.run_in_executor(
+        None, publish, broker.port, messages, rate, topics, payload_size, qos
+    )
+    results = await asyncio.gather(*collectors)
+
+    for communicator in communicators:
+        await communicator.disconnect()
+    if engine_name == 'asyncio':
+        await engine.stop()
+    else:
+        # Workers may be waiting on this loop for a channel layer send
+        await loop.run_in_executor(None, engine.disconnect)
+
+    received = sum(count for count, _ in results) / clients
+    arrivals = [last for _, last in results if last is not None]
+    elapsed = (max(arrivals) - started) / 1e9 if arrivals else None
+    ordered = sorted(latencies)
+    to_ms = lambda value: round(value / 1e6, 3) if value is not None else None  # noqa: E731
+    return {
+        'engine': engine_name,
+        'rate': rate,
+        'payload_size': payload_size,
+        'topics': topics,
+        'clients': clients,
+        'messages': messages,
+        'qos': qos,
+        'received': received,
+        'lost': messages - received,
+        'publish_rate': round(messages / publish_seconds, 1),
+        'msgs_per_sec': round(received / elapsed, 1) if elapsed else 0,
+        'latency_ms': {
+            'p50': to_ms(percentile(ordered, 50)),
+            'p90': to_ms(percentile(ordered, 90)),
+            'p99': to_ms(percentile(ordered, 99)),
+            'max': to_ms(ordered[-1] if ordered else None),
+        },
+    }
+
+
+async def run_all(args):
+    broker = LocalBroker().start()
+    runs = []
+    try:
+        with override_settings(
+            CHANNEL_LAYERS=LOOP_SAFE_CHANNEL_LAYERS,
+            MQTT_BROKER_HOST='127.0.0.1',
+            MQTT_BROKER_PORT=broker.port,
+            MQTT_USERNAME='',
+            MQTT_PASSWORD='',
+            MQTT_USE_TLS=False,
+            MQTT_TOPICS=[f'{TOPIC_PREFIX}/#'],
+            MQTT_INGEST_MODE='single',
+            MQTT_CLEAN_SESSION=True,
+        ):
+            for engine_name, rate, payload_size, topics, clients in itertools.product(
+                args.engines.split(','), parse_ints(args.rates), parse_ints(args.payload_sizes),
+                parse_ints(args.topics), parse_ints(args.clients),
+            ):
+                runs.append(await run(
+                    broker, engine_name, rate, payload_size, topics, clients,
+                    args.messages, args.qos, args.idle_timeout,
+                ))
+    finally:
+        broker.stop()
+    return runs
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(',')]
+
+
+def run_key(run):
+    return tuple(run[key] for key in RUN_KEYS)
+
+
+def change(value, base):
+    if value is None or not base:
+        return ''
+    return f'{(value - base) / base * 100:+.0f}%'
+
+
+def print_results(runs, baseline=None):
+    base_runs = {run_key(run): run for run in (baseline or {}).get('runs', [])}
+    headers = ['engine', 'rate', 'bytes', 'topics', 'clients', 'lost', 'msg/s', 'p50 ms', 'p99 ms']
+    if base_runs:
+        headers += ['msg/s vs base', 'p99 vs base']
+    rows = []
+    for run in runs:
+        row = [
+            run['engine'], run['rate'] or 'max', run['payload_size'], run['topics'], run['clients'],
+            f"{run['lost']:g}", f"{run['msgs_per_sec']:.0f}",
+            run['latency_ms']['p50'], run['latency_ms']['p99'],
+        ]
+        if base_runs:
+            base = base_runs.get(run_key(run))
+            row += [
+                change(run['msgs_per_sec'], base['msgs_per_sec']) if base else 'n/a',
+                change(run['latency_ms']['p99'], base['latency_ms']['p99']) if base else 'n/a',
+            ]
+        rows.append(row)
+    print_table(headers, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--engines', default='thread,asyncio')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rates', default='0', help='Messages per second, 0 = as fast as possible')
+    parser.add_argument('--payload-sizes', default='256', help='Payload bytes')
+    parser.add_argument('--topics', default='10', help='Distinct topics the messages are spread over')
+    parser.add_argument('--clients', default='1', help='WebSocket clients')
+    parser.add_argument('--qos', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--idle-timeout', type=float, default=5.0, help='Seconds without frames before counting the rest as lost')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results saved by an earlier --output')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    runs = asyncio.run(run_all(args))
+    print_results(runs, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'benchmark': 'end_to_end',
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'json_codec': codec.name,
+                'runs': runs,
+            }, f, indent=2)
+        print(f'Saved results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Ingest-to-broadcast cost per MQTT message for the thread and asyncio engines
+
+Feeds received messages straight into each engine's on_message callback (no
+broker needed) and measures wall and CPU time until every message has been
+decoded and sent to the channel layer group, whose members stand for the
+relays of that many server processes. The thread engine hops to a worker
+thread and through async_to_sync for each send; the asyncio engine awaits
+the channel layer on the loop that received the message.
+Database writes are not started in either case.
+
+Usage:
+    python -m benchmarks.bench_engines [--messages 5000] [--processes 1,50]
+"""
+import argparse
+import asyncio
+import time
+from .common import setup_django, cpu_timer, print_table, SAMPLE_PAYLOAD, IN_MEMORY_CHANNEL_LAYERS
+
+setup_django()
+
+from django.test import override_settings  # noqa: E402
+from paho.mqtt.client import MQTTMessage  # noqa: E402
+from mqtt_app.async_client import AsyncMQTTClient  # noqa: E402
+from mqtt_app.broadcast import GROUP_NAME  # noqa: E402
+from mqtt_app.mqtt_client import MQTTClient  # noqa: E402
+
+
+class ThreadEngine(MQTTClient):
+    def start_services(self):
+        pass
+
+
+class AsyncEngine(AsyncMQTTClient):
+    def start_services(self):
+        pass
+
+    async def _manage_brokers(self):
+        await asyncio.Event().wait()
+
+
+def make_messages(count):
+    messages = []
+    for index in range(count):
+        msg = MQTTMessage(topic=f'flash/sirens/{index % 10}/status'.encode())
+        msg.payload = SAMPLE_PAYLOAD.encode()
+        messages.append(msg)
+    return messages
+
+
+async def add_relays(engine, processes):
+    for _ in range(processes):
+        channel = await engine.channel_layer.new_channel()
+        await engine.channel_layer.group_add(GROUP_NAME, channel)
+
+
+def run_thread(processes, messages):
+    engine = ThreadEngine()
+    asyncio.run(add_relays(engine, processes))
+    engine.pipeline.start()
+    wall, cpu = time.perf_counter(), cpu_timer()
+    for msg in messages:
+        engine.on_message(None, None, msg)
+    while engine.pipeline.get_stats()['processed'] < len(messages):
+        time.sleep(0.001)
+    result = time.perf_counter() - wall, cpu()
+    engine.pipeline.stop()
+    return result
+
+
+async def run_asyncio(processes, messages):
+    engine = AsyncEngine()
+    await add_relays(engine, processes)
+    await engine.start()
+    wall, cpu = time.perf_counter(), cpu_timer()
+    for msg in messages:
+        engine.on_message(None, None, msg)
+    while engine.processed_count < len(messages):
+        await asyncio.sleep(0.001)
+    result = time.perf_counter() - wall, cpu()
+    await engine.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--processes', default='1,50')
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    rows = []
+    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+        for processes in [int(p) for p in args.processes.split(',')]:
+            for name, (wall, cpu) in (
+                ('thread', run_thread(processes, messages)),
+                ('asyncio', asyncio.run(run_asyncio(processes, messages))),
+            ):
+                rows.append((
+                    name,
+                    processes,
+                    f'{wall / len(messages) * 1e6:.0f}',
+                    f'{cpu / len(messages) * 1e6:.0f}',
+                    f'{len(messages) / wall:.0f}',
+                ))
+    print_table(('engine', 'processes', 'wall us/msg', 'cpu us/msg', 'msg/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+CPU cost per MQTT message against the number of connected WebSocket clients
+
+Each message is broadcast once to the server process's relay, which fans it
+out to its consumers. Compares clients receiving every topic with clients
+subscribed to one of ten topics, which the relay matches against its
+subscription registry so each message only reaches a tenth of them.
+
+Usage:
+    python -m benchmarks.bench_fanout [--messages 200] [--clients 1,10,100,500]
+"""
+import argparse
+import asyncio
+import json
+from .common import setup_django, cpu_timer, print_table, SAMPLE_PAYLOAD, IN_MEMORY_CHANNEL_LAYERS
+
+setup_django()
+
+from django.test import override_settings  # noqa: E402
+from channels.layers import get_channel_layer  # noqa: E402
+from channels.testing.websocket import WebsocketCommunicator  # noqa: E402
+from mqtt_app.broadcast import GROUP_NAME, encode_message_data  # noqa: E402
+from mqtt_app.consumers import MQTTConsumer  # noqa: E402
+from mqtt_app.relay import relay  # noqa: E402
+
+TOPICS = 10
+
+
+def make_event(topic, payload):
+    payload_json = json.loads(payload)
+    data = encode_message_data(topic, payload, 0, payload_is_json=isinstance(payload_json, dict))
+    return {'type': 'mqtt.broadcast', 'messages': [(topic, data, None)]}
+
+
+async def run(clients, messages, filtered):
+    layer = get_channel_layer()
+    application = MQTTConsumer.as_asgi()
+    communicators = []
+    for index in range(clients):
+        path = f'/ws/mqtt/?topics=flash/sirens/{index % TOPICS}/%23' if filtered else '/ws/mqtt/'
+        communicator = WebsocketCommunicator(application, path)
+        await communicator.connect()
+        await communicator.receive_from()  # welcome message
+        communicators.append(communicator)
+
+    elapsed = cpu_timer()
+    for index in range(messages):
+        await layer.group_send(GROUP_NAME, make_event(f'flash/sirens/{index % TOPICS}/status', SAMPLE_PAYLOAD))
+        for number, communicator in enumerate(communicators):
+            if not filtered or number % TOPICS == index % TOPICS:
+                await communicator.receive_from()
+    cpu = elapsed()
+
+    for communicator in communicators:
+        await communicator.disconnect()
+    await relay.stop()
+    return cpu / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--clients', default='1,10,100,500')
+    args = parser.parse_args()
+
+    rows = []
+    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, MQTT_LAST_VALUE_SNAPSHOT=False):
+        for clients in [int(c) for c in args.clients.split(',')]:
+            everything = asyncio.run(run(clients, args.messages, False))
+            filtered = asyncio.run(run(clients, args.messages, True))
+            rows.append((
+                clients,
+                f'{everything * 1e6:.0f}',
+                f'{filtered * 1e6:.0f}',
+            ))
+    print_table(('clients', 'all topics us/msg', f'1 of {TOPICS} topics us/msg'), rows)
+
+
+if __name__ == '__main__':
+    main()
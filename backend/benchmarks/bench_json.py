@@ -0,0 +1,71 @@
+"""
+Encode/decode time of the available JSON codecs on real payload shapes
+
+Covers an incoming ControlByWeb payload (ingest), WebSocket control frames,
+and a page of message history plus the status response (REST).
+
+Usage:
+    python -m benchmarks.bench_json [--repeat 20000]
+"""
+import argparse
+import time
+from .common import setup_django, print_table, SAMPLE_PAYLOAD
+
+setup_django()
+
+from mqtt_app.json_codec import available_codecs, get_codec  # noqa: E402
+
+SUBSCRIBED_FRAME = {'type': 'subscribed', 'topics': ['flash/sirens/+/status', 'flash/strobes/#']}
+CLIENT_FRAME = '{"type":"subscribe","topics":["flash/sirens/+/status"]}'
+HISTORY_PAGE = {
+    'next': 'http://localhost:8000/api/mqtt/messages/?cursor=MjAyNS0wMS0wMVQwMDowMDowMHwxMjM%3D',
+    'results': [
+        {'id': i, 'topic': f'flash/sirens/{i % 50:04d}/status', 'payload': SAMPLE_PAYLOAD,
+         'payload_encoding': None, 'qos': 0, 'timestamp': '2025-01-01T00:00:00.123456Z'}
+        for i in range(100)
+    ],
+}
+STATUS = {
+    'connected': True, 'broker_host': 'broker.example.com', 'broker_port': 8883,
+    'topics': ['flash/sirens/+/status'], 'db_pending': 12, 'db_flushed': 123456,
+    'queue_depth': 3, 'queue_capacity': 10000, 'queue_overflow': 'block',
+    'replay_epoch': '3f2a9c0d1b4e', 'replay_last_seq': 987654, 'retention_last_run': None,
+}
+
+CASES = [
+    ('ingest payload', 'loads', SAMPLE_PAYLOAD.encode()),
+    ('client frame', 'loads', CLIENT_FRAME),
+    ('control frame', 'dumps', SUBSCRIBED_FRAME),
+    ('history page (100)', 'dumpb', HISTORY_PAGE),
+    ('status', 'dumpb', STATUS),
+]
+
+
+def measure(function, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(value)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    names = available_codecs()
+    codecs = [get_codec(name) for name in names]
+    rows = []
+    for label, operation, value in CASES:
+        # History pages are much larger, so run fewer iterations
+        repeat = max(1, args.repeat // 50) if label.startswith('history') else args.repeat
+        timings = [measure(getattr(codec, operation), value, repeat) for codec in codecs]
+        baseline = timings[names.index('json')]
+        rows.append([f'{label} ({operation})'] + [
+            f'{timing:.2f} us ({baseline / timing:.1f}x)' for timing in timings
+        ])
+    print_table(['case'] + names, rows)
+
+
+if __name__ == '__main__':
+    main()
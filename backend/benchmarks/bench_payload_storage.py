@@ -0,0 +1,98 @@
+"""
+Stored bytes per row and insert/read throughput of message payloads
+
+Compares payloads stored verbatim, zlib-compressed, and zlib-compressed with
+a dictionary trained on earlier payloads of the same topics. Runs against a
+throwaway test database.
+
+Usage:
+    python -m benchmarks.bench_payload_storage [--messages 20000] [--batch-size 200]
+"""
+import argparse
+import json
+import random
+import time
+from .common import setup_django, setup_test_database, print_table
+
+setup_django()
+setup_test_database()
+
+from mqtt_app.models import MQTTMessage, MQTTPayloadDictionary, MQTTTopic  # noqa: E402
+from mqtt_app.payloads import PayloadCodec, train_dictionary  # noqa: E402
+
+STATUSES = ['alert', 'clear', 'test', 'fault']
+
+
+def make_payloads(count, devices=50):
+    """ControlByWeb-style status messages spread over a few device topics"""
+    rng = random.Random(42)
+    messages = []
+    for _ in range(count):
+        device = rng.randrange(devices)
+        messages.append((f'flash/sirens/{device:04d}/status', json.dumps({
+            "clientID": f"000CC806{device:04X}",
+            "status": rng.choice(STATUSES),
+            "vin": f"VIN{device:09d}",
+            "battery": round(rng.uniform(11.5, 13.8), 2),
+            "uptime": rng.randrange(10 ** 6),
+        }).encode()))
+    return messages
+
+
+def run(label, codec, messages, batch_size):
+    MQTTMessage.objects.all().delete()
+    topic_ids = MQTTTopic.objects.get_ids(topic for topic, _ in messages)
+
+    start = time.perf_counter()
+    for offset in range(0, len(messages), batch_size):
+        rows = []
+        for topic, payload in messages[offset:offset + batch_size]:
+            data, compression, dictionary_id = codec.encode(topic, payload)
+            rows.append(MQTTMessage(
+                topic_id=topic_ids[topic], payload_data=data,
+                compression=compression, dictionary_id=dictionary_id,
+            ))
+        MQTTMessage.objects.bulk_create(rows)
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = MQTTMessage.objects.values_list('payload_data', 'compression', 'dictionary_id')
+    read = sum(len(codec.decode(*row)) for row in rows.iterator(chunk_size=2000))
+    read_time = time.perf_counter() - start
+    assert read == sum(len(payload) for _, payload in messages)
+
+    stored = sum(len(data) for data in MQTTMessage.objects.values_list('payload_data', flat=True))
+    return [
+        label,
+        f'{stored / len(messages):.1f}',
+        f'{codec.raw_bytes / max(codec.stored_bytes, 1):.2f}x',
+        f'{len(messages) / insert_time:,.0f}',
+        f'{len(messages) / read_time:,.0f}',
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+
+    training = make_payloads(2000)
+    messages = make_payloads(args.messages)[::-1]
+
+    rows = [
+        run('raw', PayloadCodec(compression='none'), messages, args.batch_size),
+        run('zlib', PayloadCodec(compression='zlib'), messages, args.batch_size),
+    ]
+    MQTTPayloadDictionary.objects.create(
+        topic_filter='flash/sirens/+/status',
+        data=train_dictionary(payload for _, payload in training),
+        sample_count=len(training),
+    )
+    rows.append(run('zlib + dictionary', PayloadCodec(compression='zlib'), messages, args.batch_size))
+    print(f'{args.messages} messages, raw payload {sum(len(p) for _, p in messages) / len(messages):.1f} bytes on average')
+    print_table(['storage', 'bytes/row', 'ratio', 'insert msg/s', 'read msg/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
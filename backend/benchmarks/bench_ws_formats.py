@@ -0,0 +1,138 @@
+"""
+Bytes on the wire and encode/decode time per WebSocket frame format
+
+Compares JSON text (plain, and zlib compressed as permessage-deflate would
+without context takeover) with the binary mqtt.msgpack and mqtt.cbor
+subprotocols, compressed above MQTT_WS_COMPRESS_MIN_BYTES, on a single live
+message, a coalesced batch, a snapshot and a message with a binary payload.
+Live messages and batches are encoded as the relay delivers them, from
+LiveMessages (the broadcast data text, plus the raw bytes of a binary
+payload) packed for the first client; snapshots from their JSON text.
+Decoding is what a client does with the received frame (Python decoders
+standing in for the browser's).
+
+Usage:
+    python -m benchmarks.bench_ws_formats [--repeat 2000] [--compress-min-bytes 1024]
+"""
+import argparse
+import base64
+import os
+import time
+import zlib
+from datetime import datetime, timezone
+from .common import setup_django, print_table, SAMPLE_PAYLOAD
+
+setup_django()
+
+from mqtt_app.broadcast import encode_message_data, MESSAGE_FRAME, BATCH_FRAME, SNAPSHOT_FRAME  # noqa: E402
+from mqtt_app.frames import BinaryFrameEncoder, FLAG_ZLIB, LiveFrame, LiveMessage, _FORMATS  # noqa: E402
+from mqtt_app.json_codec import codec  # noqa: E402
+
+TIMESTAMP = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def message(index, payload=SAMPLE_PAYLOAD, payload_is_json=True, payload_encoding=None):
+    return encode_message_data(
+        f'flash/sirens/{index % 1000:04d}/status', payload, 0, payload_is_json=payload_is_json,
+        timestamp=TIMESTAMP, seq=index, payload_encoding=payload_encoding,
+    )
+
+
+def binary_message():
+    raw = os.urandom(512)
+    return message(0, base64.b64encode(raw).decode('ascii'), False, 'base64'), raw
+
+
+def live(messages, batch=False):
+    """A function building the LiveFrame the relay delivers for (data, raw) messages"""
+    return lambda: LiveFrame([LiveMessage('', data, raw) for data, raw in messages], batch)
+
+
+BINARY = binary_message()
+
+# (label, JSON text frame, LiveFrame factory or None)
+CASES = [
+    ('message', MESSAGE_FRAME % message(0), live([(message(0), None)])),
+    (
+        'batch (100)', BATCH_FRAME % ','.join(message(i) for i in range(100)),
+        live([(message(i), None) for i in range(100)], batch=True),
+    ),
+    ('snapshot (1000)', SNAPSHOT_FRAME % ','.join(message(i) for i in range(1000)), None),
+    ('binary payload (512 B)', MESSAGE_FRAME % BINARY[0], live([BINARY])),
+]
+
+
+def decoders():
+    """Format name -> function decoding a received frame"""
+    result = {'json': codec.loads}
+    try:
+        import msgpack
+        result['msgpack'] = lambda frame: msgpack.unpackb(unwrap(frame))
+    except ImportError:
+        pass
+    try:
+        import cbor2
+        result['cbor'] = lambda frame: cbor2.loads(unwrap(frame))
+    except ImportError:
+        pass
+    return result
+
+
+def unwrap(frame):
+    """A binary frame's body, decompressed if needed"""
+    return zlib.decompress(frame[1:]) if frame[0] == FLAG_ZLIB else frame[1:]
+
+
+def measure(function, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(value)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--compress-min-bytes', type=int, default=1024, help='0 = never compress')
+    parser.add_argument('--compress-level', type=int, default=6)
+    args = parser.parse_args()
+
+    decode = decoders()
+    encoders = {}
+    for subprotocol, (name, _, factory) in _FORMATS.items():
+        if name in decode:
+            encoders[name] = BinaryFrameEncoder(
+                name, subprotocol, factory(), args.compress_min_bytes, args.compress_level
+            )
+
+    rows = []
+    for label, text, build in CASES:
+        # Snapshots are much larger, so run fewer iterations
+        repeat = max(1, args.repeat // 20) if label.startswith('snapshot') else args.repeat
+        raw = text.encode('utf-8')
+        deflated = zlib.compress(raw, args.compress_level)
+        rows.append([
+            label, 'json', len(raw), '', f"{measure(decode['json'], text, repeat):.1f}",
+        ])
+        rows.append([
+            '', 'json+deflate', len(deflated),
+            f"{measure(lambda value: zlib.compress(value, args.compress_level), raw, repeat):.1f}",
+            f"{measure(lambda value: codec.loads(zlib.decompress(value)), deflated, repeat):.1f}",
+        ])
+        for name, encoder in encoders.items():
+            if build is None:
+                encode, value = encoder.encode, text
+            else:
+                # A new LiveFrame each time: the cost for the first client, the others reuse its encoding
+                encode, value = (lambda make: encoder.encode(make())), build
+            frame = encode(value)
+            rows.append([
+                '', name + (' (zlib)' if frame[0] == FLAG_ZLIB else ''), len(frame),
+                f"{measure(encode, value, repeat):.1f}",
+                f"{measure(decode[name], frame, repeat):.1f}",
+            ])
+    print_table(['frame', 'format', 'bytes', 'encode us', 'decode us'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Minimal local MQTT 3.1.1 broker stand-in for offline benchmarks
+
+Speaks just enough of the protocol for paho clients: CONNECT, SUBSCRIBE
+with + / # filters, PUBLISH at QoS 0 or 1 (acknowledged, then forwarded to
+matching subscribers at QoS 0), PINGREQ and DISCONNECT. No sessions,
+retained messages, authentication or TLS.
+
+Usage:
+    python -m benchmarks.broker [--port 1883]
+"""
+import argparse
+import asyncio
+import struct
+import threading
+
+CONNECT, PUBLISH, PUBACK, SUBSCRIBE, PINGREQ, DISCONNECT = 1, 3, 4, 8, 12, 14
+
+
+def topic_matches(topic_filter, topic):
+    """Whether an MQTT topic filter matches a topic name"""
+    filter_levels, topic_levels = topic_filter.split('/'), topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        digit, length = length % 128, length // 128
+        encoded.append(digit | (128 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def packet(header, body=b''):
+    return bytes([header]) + encode_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """Return (fixed header byte, body) of the next packet"""
+    header = (await reader.readexactly(1))[0]
+    multiplier, length = 1, 0
+    while True:
+        digit = (await reader.readexactly(1))[0]
+        length += (digit & 127) * multiplier
+        multiplier *= 128
+        if not digit & 128:
+            break
+    return header, (await reader.readexactly(length) if length else b'')
+
+
+class LocalBroker:
+    """Broker running on its own event loop thread, so it never competes with the code being measured"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.subscriptions = {}  # writer -> topic filters
+        self.published = 0
+        self.delivered = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    async def handle(self, reader, writer):
+        """Serve one client connection"""
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header >> 4
+                if kind == CONNECT:
+                    writer.write(packet(0x20, b'\x00\x00'))
+                elif kind == SUBSCRIBE:
+                    packet_id, filters, offset = body[:2], [], 2
+                    while offset < len(body):
+                        length = struct.unpack('!H', body[offset:offset + 2])[0]
+                        filters.append(body[offset + 2:offset + 2 + length].decode())
+                        offset += 3 + length  # Filter and its requested QoS byte
+                    self.subscriptions[writer] = self.subscriptions.get(writer, []) + filters
+                    # Every subscription is granted at QoS 0
+                    writer.write(packet(0x90, packet_id + bytes(len(filters))))
+                elif kind == PUBLISH:
+                    self.publish(writer, header, body)
+                elif kind == PINGREQ:
+                    writer.write(packet(0xD0))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+    def publish(self, sender, header, body):
+        """Acknowledge a PUBLISH and forward it to matching subscribers"""
+        self.published += 1
+        length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + length].decode()
+        rest = body[2 + length:]
+        if (header >> 1) & 3:
+            packet_id, rest = rest[:2], rest[2:]
+            sender.write(packet(PUBACK << 4, packet_id))
+        forwarded = packet(PUBLISH << 4, body[:2 + length] + rest)
+        for writer, filters in list(self.subscriptions.items()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in filters):
+                writer.write(forwarded)
+                self.delivered += 1
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self):
+        """Start serving on a background thread; returns once the port is bound"""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='mqtt-local-broker', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        """Close the listener and every client connection"""
+        if self._server is None:
+            return
+
+        def close():
+            for writer in list(self.subscriptions):
+                writer.close()
+            self._server.close()
+            for task in asyncio.all_tasks():
+                task.cancel()
+
+        self._loop.call_soon_threadsafe(close)
+        self._thread.join()
+        self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = LocalBroker(args.host, args.port).start()
+    print(f'Broker stand-in listening on {args.host}:{broker.port} (Ctrl+C to stop)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Shared helpers for benchmarks
+"""
+import asyncio
+import os
+import sys
+import time
+import json
+from channels.layers import InMemoryChannelLayer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ControlByWeb status payload, the most common message shape
+SAMPLE_PAYLOAD = json.dumps({"clientID": "000CC80630E0", "status": "alert", "vin": "VIN123456789"})
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 100000},
+    },
+}
+
+# Same, but the thread engine's workers may send to consumers on another event loop
+LOOP_SAFE_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'benchmarks.common.LoopSafeInMemoryChannelLayer',
+        'CONFIG': {'capacity': 100000},
+    },
+}
+
+
+class LoopSafeInMemoryChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory channel layer that other threads' event loops may send to.
+
+    Its queues belong to the loop the consumers receive on. Sends made on
+    any other loop (async_to_sync on the thread engine's workers) are
+    handed over to that loop, much like the network hop to Redis would be.
+    """
+    loop = None
+
+    async def receive(self, channel):
+        self.loop = asyncio.get_running_loop()
+        return await super().receive(channel)
+
+    async def send(self, channel, message):
+        if self.loop is None or self.loop is asyncio.get_running_loop():
+            return await super().send(channel, message)
+        sent = asyncio.run_coroutine_threadsafe(super().send(channel, message), self.loop)
+        return await asyncio.wrap_future(sent)
+
+
+def setup_django():
+    """Configure Django with the project settings"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+def setup_test_database():
+    """Switch to a throwaway test database holding the mqtt_app tables"""
+    from django.apps import apps
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    # mqtt_app ships without migrations, so create any missing tables directly
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config('mqtt_app').get_models():
+            if model._meta.db_table not in existing:
+                editor.create_model(model)
+
+
+def cpu_timer():
+    """Return a function giving CPU seconds elapsed since the call"""
+    start = time.process_time()
+    return lambda: time.process_time() - start
+
+
+def print_table(headers, rows):
+    """Print rows as an aligned text table"""
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print('  '.join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(str(c).rjust(w) for c, w in zip(row, widths)))
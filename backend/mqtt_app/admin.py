@@ -1,21 +1,68 @@
 from django.contrib import admin
-from .models import MQTTMessage, MQTTConfig
+from .models import MQTTMessage, MQTTConfig, MQTTTopic, MQTTRollup, MQTTPayloadDictionary, MQTTPayloadField
+from .payload_index import PARAM_PREFIX
+
+
+@admin.register(MQTTTopic)
+class MQTTTopicAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
 
 
 @admin.register(MQTTMessage)
 class MQTTMessageAdmin(admin.ModelAdmin):
     list_display = ['topic', 'payload_preview', 'qos', 'timestamp']
     list_filter = ['topic', 'qos', 'timestamp']
-    search_fields = ['topic', 'payload']
-    readonly_fields = ['timestamp']
+    list_select_related = ['topic']
+    # Payloads are stored compressed, so only topics are searchable, plus indexed
+    # payload fields as payload.<key>=<value>
+    search_fields = ['topic__name']
+    search_help_text = "Topic, or payload.<key>=<value> for fields in MQTT_PAYLOAD_INDEX_FIELDS"
+    fields = ['topic', 'payload', 'payload_encoding', 'compression', 'dictionary', 'qos', 'timestamp']
+    readonly_fields = ['payload', 'payload_encoding', 'compression', 'dictionary', 'timestamp']
     
     def payload_preview(self, obj):
         return obj.payload[:100] + '...' if len(obj.payload) > 100 else obj.payload
     payload_preview.short_description = 'Payload'
+    
+    def get_search_results(self, request, queryset, search_term):
+        key, separator, value = search_term.partition('=')
+        if search_term.startswith(PARAM_PREFIX) and separator:
+            fields = MQTTPayloadField.objects.filter(key=key[len(PARAM_PREFIX):], value=value)
+            return queryset.filter(id__in=fields.values('message_id')), False
+        return super().get_search_results(request, queryset, search_term)
+    
+    def delete_model(self, request, obj):
+        MQTTPayloadField.objects.filter(message=obj).delete()
+        super().delete_model(request, obj)
+    
+    def delete_queryset(self, request, queryset):
+        MQTTPayloadField.objects.filter(message__in=queryset).delete()
+        super().delete_queryset(request, queryset)
+
+
+@admin.register(MQTTPayloadDictionary)
+class MQTTPayloadDictionaryAdmin(admin.ModelAdmin):
+    list_display = ['topic_filter', 'dictionary_size', 'sample_count', 'created_at']
+    search_fields = ['topic_filter']
+    readonly_fields = ['topic_filter', 'sample_count', 'created_at']
+    exclude = ['data']
+    
+    def dictionary_size(self, obj):
+        return len(obj.data)
+    dictionary_size.short_description = 'Size (bytes)'
+
+
+@admin.register(MQTTRollup)
+class MQTTRollupAdmin(admin.ModelAdmin):
+    list_display = ['topic', 'field', 'resolution', 'bucket', 'count', 'min', 'max', 'last']
+    list_filter = ['resolution', 'field']
+    list_select_related = ['topic']
+    search_fields = ['topic__name', 'field']
 
 
 @admin.register(MQTTConfig)
 class MQTTConfigAdmin(admin.ModelAdmin):
-    list_display = ['broker_host', 'broker_port', 'is_active', 'updated_at']
+    list_display = ['broker_host', 'broker_port', 'use_tls', 'is_active', 'updated_at']
     list_filter = ['is_active', 'updated_at']
 
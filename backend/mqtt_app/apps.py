@@ -7,9 +7,16 @@ class MqttAppConfig(AppConfig):
     name = 'mqtt_app'
     
     def ready(self):
+        # Apply MQTTConfig changes to running broker connections
+        from . import signals  # noqa: F401
+        
         # Start MQTT client when Django starts (only if not in migration)
         if os.environ.get('RUN_MAIN') != 'true':
             return
+        # Ingest runs separately (manage.py mqtt_ingest)
+        from django.conf import settings
+        if not getattr(settings, 'MQTT_AUTOSTART', True):
+            return
         try:
             import mqtt_app.mqtt_client
             mqtt_app.mqtt_client.start_mqtt_client()
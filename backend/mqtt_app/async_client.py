@@ -0,0 +1,352 @@
+"""
+Asyncio MQTT ingest engine running inside the ASGI server's event loop
+"""
+import asyncio
+import collections
+import logging
+import paho.mqtt.client as mqtt
+from django.conf import settings
+from django.db import close_old_connections
+from .brokers import BrokerConnection
+from .mqtt_client import MQTTClient
+from .pipeline import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_POLICIES
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBrokerConnection(BrokerConnection):
+    """
+    One broker connection served by the engine's event loop.
+
+    paho's socket callbacks register the broker socket with the loop, so
+    reads, writes and keepalives happen on the loop instead of a network
+    thread. Only the blocking TCP/TLS connect runs in an executor.
+    """
+
+    def __init__(self, engine, broker):
+        super().__init__(engine, broker)
+        self.loop = engine.loop
+        self._reading_paused = False
+        self._misc_task = None
+        self._supervisor = None
+        self._disconnected = asyncio.Event()
+        self._stopping = False
+
+    # paho external loop integration
+
+    def _on_loop(self, callback, *args):
+        """Run callback now when on the event loop's thread, otherwise schedule it there"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        """Watch a new broker connection (may be called from the connect executor)"""
+        self._on_loop(self._watch_socket, sock)
+
+    def _watch_socket(self, sock):
+        if sock.fileno() == -1:
+            # Closed again before the loop got to it (failed connect)
+            return
+        self._reading_paused = False
+        self.loop.add_reader(sock, self._on_readable)
+        if self.engine.reading_paused:
+            self.pause_reading()
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        """Stop watching a broker connection that is about to be closed"""
+        # paho closes sockets from loop_read/loop_misc, i.e. on the loop's thread,
+        # so the descriptor is unregistered before it is closed
+        self._on_loop(self._unwatch_socket, sock.fileno())
+
+    def _unwatch_socket(self, fd):
+        self.loop.remove_writer(fd)
+        self.loop.remove_reader(fd)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock.fileno())
+
+    def _on_readable(self):
+        self.client.loop_read()
+        # TLS may have decrypted data buffered that the socket no longer signals
+        sock = self.client.socket()
+        while sock is not None and not self._reading_paused and getattr(sock, 'pending', lambda: 0)():
+            self.client.loop_read()
+            sock = self.client.socket()
+
+    async def _misc_loop(self):
+        """Keepalive pings and retries, which paho's own loop would do every second"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def pause_reading(self):
+        """Stop reading from the broker (backpressure)"""
+        sock = self.client.socket() if self.client else None
+        if sock is not None and not self._reading_paused:
+            self.loop.remove_reader(sock)
+            self._reading_paused = True
+
+    def resume_reading(self):
+        """Read from the broker again"""
+        sock = self.client.socket() if self.client else None
+        if self._reading_paused and sock is not None:
+            self.loop.add_reader(sock, self._on_readable)
+        self._reading_paused = False
+
+    def on_disconnect(self, client, userdata, rc):
+        """Callback when MQTT client disconnects - wake the connection supervisor"""
+        super().on_disconnect(client, userdata, rc)
+        self._disconnected.set()
+
+    async def _supervise(self):
+        """Connect, and reconnect with jittered backoff whenever the connection drops"""
+        broker = self.broker
+        logger.info(f"Connecting to MQTT broker: {broker.host}:{broker.port} (TLS: {broker.tls}, asyncio)")
+        while not self._stopping:
+            self._disconnected.clear()
+            try:
+                await self.loop.run_in_executor(None, self.connect_client)
+            except Exception as e:
+                await asyncio.sleep(self.connect_failed(e))
+                continue
+            await self._disconnected.wait()
+            if not self._stopping:
+                await asyncio.sleep(self.backoff.next())
+
+    def start(self):
+        """Start connecting (on the event loop)"""
+        self.client = self.create_client()
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self._supervisor = self.loop.create_task(self._supervise())
+
+    async def stop(self):
+        """Disconnect and stop supervising"""
+        self._stopping = True
+        if self.client:
+            self.client.disconnect()
+            self.is_connected = False
+        self._disconnected.set()
+        tasks = [task for task in (self._supervisor, self._misc_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class AsyncMQTTClient(MQTTClient):
+    """
+    Ingest engine driving paho's protocol handling from asyncio.
+
+    Every broker connection is served by the event loop (see
+    AsyncBrokerConnection). Received messages go through a bounded queue to
+    one processing task that awaits the channel layer directly; database
+    writes stay on the write-behind threads.
+    """
+    engine = 'asyncio'
+    connection_class = AsyncBrokerConnection
+
+    def __init__(self):
+        super().__init__()
+        self.max_size = max(1, int(getattr(settings, 'MQTT_QUEUE_SIZE', 10000)))
+        self.overflow = getattr(settings, 'MQTT_QUEUE_OVERFLOW', OVERFLOW_BLOCK)
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy '{self.overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}"
+            )
+        self.loop = None
+        self._queue = collections.deque()
+        self._ready = None
+        self._reload = None
+        self.reading_paused = False
+        self._tasks = []
+        self._flush_handle = None
+        self._stopping = False
+        self._follow_task = None
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    # Message flow
+
+    def _pause_reading(self):
+        self.reading_paused = True
+        for conn in list(self.brokers.connections.values()):
+            conn.pause_reading()
+
+    def _resume_reading(self):
+        self.reading_paused = False
+        for conn in list(self.brokers.connections.values()):
+            conn.resume_reading()
+
+    def on_message(self, client, userdata, msg):
+        """Callback when MQTT message is received (on the event loop) - queue it for processing"""
+        if len(self._queue) >= self.max_size:
+            if self.overflow == OVERFLOW_BLOCK:
+                # Backpressure: stop reading from the brokers until the queue drains
+                self._pause_reading()
+            elif self.overflow == OVERFLOW_DROP_OLDEST:
+                self._queue.popleft()
+                self.dropped_count += 1
+            else:
+                self.dropped_count += 1
+                return
+        self._queue.append(msg)
+        self._ready.set()
+
+    async def _process_loop(self):
+        """Ingest queued messages and broadcast them, awaiting the channel layer directly"""
+        while True:
+            if not self._queue:
+                if self._stopping:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            msg = self._queue.popleft()
+            try:
+                topic, data, raw = self.ingest(msg)
+                if self.broadcaster.batching:
+                    self.broadcaster.publish(topic, data, raw)
+                    if self.broadcaster.pending >= self.broadcaster.batch_size:
+                        await self.broadcaster.aflush()
+                    elif self._flush_handle is None:
+                        self._flush_handle = self.loop.call_later(self.broadcaster.window, self._flush_batch)
+                else:
+                    await self.broadcaster.apublish(topic, data, raw)
+            except Exception as e:
+                self.failed_count += 1
+                logger.error(f"Error processing MQTT message: {e}")
+            else:
+                self.processed_count += 1
+            if self.reading_paused and len(self._queue) <= self.max_size // 2:
+                self._resume_reading()
+
+    def _flush_batch(self):
+        self._flush_handle = None
+        self._tasks.append(self.loop.create_task(self.broadcaster.aflush()))
+        self._tasks = [task for task in self._tasks if not task.done()]
+
+    # Broker connections
+
+    async def _sync_brokers(self):
+        """Re-read the configurations and reconnect what changed"""
+        def load():
+            close_old_connections()
+            return self.brokers.load()
+
+        wanted = await self.loop.run_in_executor(None, load)
+        if wanted is None or self._stopping:
+            return
+        stopped, started = self.brokers.update(wanted)
+        await asyncio.gather(*(conn.stop() for conn in stopped))
+        for conn in started:
+            conn.start()
+
+    async def _manage_brokers(self):
+        """Connect to the configured brokers and keep the connections in sync with MQTTConfig"""
+        while not self._stopping:
+            try:
+                await self._sync_brokers()
+            except Exception as e:
+                logger.error(f"Error applying MQTT configurations: {e}")
+            try:
+                await asyncio.wait_for(self._reload.wait(), self.brokers.reload_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._reload.clear()
+
+    def request_broker_reload(self):
+        """Re-read the broker configurations (called when they change, from any thread)"""
+        if self.loop is not None and self._reload is not None:
+            self.loop.call_soon_threadsafe(self._reload.set)
+
+    async def _follow(self):
+        """Wait for the leader to go away, then take over"""
+        while not self.leader_lock.acquire():
+            await asyncio.sleep(self.leader_retry_interval)
+        self._follow_task = None
+        await self.start()
+
+    # Engine interface
+
+    async def start(self):
+        """Start ingesting on the running event loop (called from the ASGI lifespan)"""
+        if self._tasks or self._follow_task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        if not self.acquire_leadership():
+            self._follow_task = self.loop.create_task(self._follow())
+            return
+        self._ready = asyncio.Event()
+        self._reload = asyncio.Event()
+        self._stopping = False
+        self.acquire_shared_slot()
+        self.start_services()
+        self._tasks = [
+            self.loop.create_task(self._process_loop()),
+            self.loop.create_task(self._manage_brokers()),
+        ]
+
+    async def stop(self):
+        """Disconnect, drain the queue and flush everything still buffered"""
+        if self._follow_task is not None:
+            self._follow_task.cancel()
+            self._follow_task = None
+        if not self._tasks:
+            return
+        self._stopping = True
+        process_task, manage_task, *others = self._tasks
+        manage_task.cancel()
+        await asyncio.gather(manage_task, return_exceptions=True)
+        await asyncio.gather(*(conn.stop() for conn in self.brokers.close()))
+        logger.info("MQTT Client disconnected")
+        self._ready.set()
+        await process_task
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await asyncio.gather(*others, return_exceptions=True)
+        await self.broadcaster.aflush()
+        self._tasks = []
+        await self.loop.run_in_executor(None, self.stop_services)
+        self.release_shared_slot()
+        if self.leader_lock is not None:
+            self.leader_lock.release()
+
+    def connect(self):
+        """Start ingesting when called on the event loop's thread; otherwise the ASGI lifespan starts it"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.info("asyncio MQTT engine will start with the ASGI server")
+            return
+        loop.create_task(self.start())
+
+    def disconnect(self):
+        """Stop ingesting (schedules stop() on the event loop)"""
+        if self.loop is not None and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.stop(), self.loop)
+
+    def get_engine_stats(self):
+        """Queue statistics of the ingest engine"""
+        return {
+            'queue_depth': len(self._queue),
+            'queue_capacity': self.max_size,
+            'queue_overflow': self.overflow,
+            'workers': 1,
+            'processed': self.processed_count,
+            'dropped': self.dropped_count,
+            'failed': self.failed_count,
+        }
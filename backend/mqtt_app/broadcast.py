@@ -0,0 +1,183 @@
+"""
+Broadcasting of MQTT messages to every server process through the channel layer
+"""
+import threading
+import time
+import logging
+from asgiref.sync import async_to_sync
+from .json_codec import codec
+from .metrics import metrics, STAGE_GROUP_SEND
+
+logger = logging.getLogger(__name__)
+
+GROUP_NAME = 'mqtt_messages'
+
+MESSAGE_FRAME = '{"type":"mqtt_message","data":%s}'
+BATCH_FRAME = '{"type":"mqtt_batch","data":[%s]}'
+SNAPSHOT_FRAME = '{"type":"snapshot","data":[%s]}'
+REPLAY_FRAME = '{"type":"replay","data":[%s]}'
+
+
+def encode_message_data(topic, payload, qos, payload_is_json=False, timestamp=None, seq=None, payload_encoding=None):
+    """
+    Encode the ``data`` object of a WebSocket frame.
+
+    A payload that is already JSON text is embedded as-is instead of being
+    parsed and dumped again. Binary payloads are passed base64 encoded with
+    payload_encoding='base64'.
+    """
+    return '{%s"topic":%s,"payload":%s,%s"qos":%d,"timestamp":%s}' % (
+        '"seq":%d,' % seq if seq is not None else '',
+        codec.dumps(topic),
+        payload if payload_is_json else codec.dumps(payload),
+        '"payload_encoding":%s,' % codec.dumps(payload_encoding) if payload_encoding else '',
+        qos,
+        '"%s"' % timestamp.isoformat() if timestamp is not None else 'null',
+    )
+
+
+def sequenced(data, seq):
+    """Add the sequence number to data encoded without one"""
+    return '{"seq":%d,%s' % (seq, data[1:])
+
+
+class Broadcaster:
+    """
+    Sends messages to every server process, optionally coalesced into batches.
+
+    Events go to the GROUP_NAME group, which holds one MessageRelay channel
+    per server process; the relays deliver them to their own WebSocket
+    clients. Messages travel as (topic, data, raw) triples: data is the
+    ``data`` object of the WebSocket frame encoded once here, so neither
+    the relays nor the consumers encode it again, and raw the bytes of a
+    binary payload (None otherwise), so binary frames need not decode its
+    base64 text.
+    """
+
+    def __init__(self, channel_layer, batching=False, window=0.025, batch_size=100):
+        self.channel_layer = channel_layer
+        self.batching = batching
+        self.window = float(window)
+        self.batch_size = max(1, int(batch_size))
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._running = False
+        self.sent_events = 0
+        self.sent_messages = 0
+
+    def start(self):
+        """Start the batch flush thread (no-op unless batching is enabled)"""
+        if not self.batching:
+            return
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='mqtt-broadcast', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and send the last batch"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._wakeup.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def publish(self, topic, data, raw=None):
+        """Broadcast a message (encoded data object) now, or queue it for the next batch"""
+        if not self.batching:
+            self._send({'type': 'mqtt.broadcast', 'messages': [(topic, data, raw)]}, 1)
+            return
+        with self._lock:
+            self._pending.append((topic, data, raw))
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    async def apublish(self, topic, data, raw=None):
+        """Like publish(), but awaited from an event loop instead of crossing into one"""
+        if self.batching:
+            self.publish(topic, data, raw)
+            return
+        await self._asend({'type': 'mqtt.broadcast', 'messages': [(topic, data, raw)]}, 1)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Send everything pending as batch events of at most batch_size messages"""
+        for event in self._take_batches():
+            self._send(event, len(event['messages']))
+
+    async def aflush(self):
+        """Like flush(), awaited from an event loop"""
+        for event in self._take_batches():
+            await self._asend(event, len(event['messages']))
+
+    def _take_batches(self):
+        """Remove everything pending and split it into batch events"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return [
+            {'type': 'mqtt.broadcast', 'messages': pending[start:start + self.batch_size], 'batch': True}
+            for start in range(0, len(pending), self.batch_size)
+        ]
+
+    def _send(self, event, count):
+        """Send event to the relay of every server process"""
+        started = time.perf_counter()
+        try:
+            async_to_sync(self.channel_layer.group_send)(GROUP_NAME, event)
+        except Exception as e:
+            logger.error(f"Error broadcasting MQTT message: {e}")
+            return
+        metrics.observe(STAGE_GROUP_SEND, time.perf_counter() - started)
+        self.sent_events += 1
+        self.sent_messages += count
+
+    async def _asend(self, event, count):
+        started = time.perf_counter()
+        try:
+            await self.channel_layer.group_send(GROUP_NAME, event)
+        except Exception as e:
+            logger.error(f"Error broadcasting MQTT message: {e}")
+            return
+        metrics.observe(STAGE_GROUP_SEND, time.perf_counter() - started)
+        self.sent_events += 1
+        self.sent_messages += count
+
+    def _run(self):
+        """Flush loop: a batch is sent window seconds after its first message, or when full"""
+        while True:
+            with self._lock:
+                while self._running and not self._pending:
+                    self._wakeup.wait()
+                deadline = time.monotonic() + self.window
+                while self._running and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                running = self._running
+            self.flush()
+            if not running:
+                break
+
+    def get_stats(self):
+        """Get broadcast statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'broadcast_batching': self.batching,
+            'broadcast_pending': pending,
+            'broadcast_events': self.sent_events,
+            'broadcast_messages': self.sent_messages,
+        }
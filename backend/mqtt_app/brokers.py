@@ -0,0 +1,460 @@
+"""
+Broker connections of the ingest engine, one per active MQTTConfig
+"""
+import os
+import random
+import socket
+import ssl
+import threading
+import time
+import zlib
+import logging
+from collections import OrderedDict, namedtuple
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from .coordination import INGEST_SHARED, shared_topic
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Key of the broker configured through settings.MQTT_*, used while no MQTTConfig is active
+SETTINGS_KEY = 'settings'
+
+
+def default_client_id(key):
+    """Stable client ID for a broker: MQTT_CLIENT_ID (or one derived from the host name) plus the config ID"""
+    base = getattr(settings, 'MQTT_CLIENT_ID', '') or f'mqtt-websocket-{socket.gethostname()}'
+    return base if key == SETTINGS_KEY else f'{base}-{key}'
+
+
+def split_topics(topics):
+    """Topic filters of a comma-separated list"""
+    return tuple(topic.strip() for topic in topics if topic.strip())
+
+
+class BrokerSettings(namedtuple('BrokerSettings', [
+    'key', 'host', 'port', 'username', 'password', 'topics', 'use_tls', 'tls_insecure', 'keepalive',
+    'client_id', 'clean_session', 'qos',
+])):
+    """Everything needed to connect to one broker; a connection is replaced when this changes"""
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            key=SETTINGS_KEY,
+            host=getattr(settings, 'MQTT_BROKER_HOST', 'localhost'),
+            port=getattr(settings, 'MQTT_BROKER_PORT', 1883),
+            username=getattr(settings, 'MQTT_USERNAME', ''),
+            password=getattr(settings, 'MQTT_PASSWORD', ''),
+            topics=split_topics(getattr(settings, 'MQTT_TOPICS', ['#'])),
+            use_tls=getattr(settings, 'MQTT_USE_TLS', False),
+            tls_insecure=getattr(settings, 'MQTT_TLS_INSECURE', False),
+            keepalive=getattr(settings, 'MQTT_KEEPALIVE', 60),
+            client_id=default_client_id(SETTINGS_KEY),
+            clean_session=getattr(settings, 'MQTT_CLEAN_SESSION', False),
+            qos=getattr(settings, 'MQTT_SUBSCRIBE_QOS', 1),
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            key=config.pk,
+            host=config.broker_host,
+            port=config.broker_port,
+            username=config.username,
+            password=config.password,
+            topics=split_topics(config.topics.split(',')),
+            use_tls=config.use_tls,
+            tls_insecure=config.tls_insecure,
+            keepalive=getattr(settings, 'MQTT_KEEPALIVE', 60),
+            client_id=config.client_id or default_client_id(config.pk),
+            clean_session=getattr(settings, 'MQTT_CLEAN_SESSION', False),
+            qos=getattr(settings, 'MQTT_SUBSCRIBE_QOS', 1),
+        )
+
+    @property
+    def tls(self):
+        # Port 8883 is the standard TLS port
+        return self.use_tls or self.port == 8883
+
+
+class Backoff:
+    """Exponential reconnect delays with full jitter, so clients do not reconnect in lockstep"""
+
+    def __init__(self, initial=0.5, maximum=30):
+        self.initial = float(initial)
+        self.maximum = float(maximum)
+        self.attempts = 0
+
+    def next(self):
+        """Delay before the next attempt"""
+        ceiling = min(self.maximum, self.initial * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return random.uniform(self.initial, max(self.initial, ceiling))
+
+    def reset(self):
+        self.attempts = 0
+
+
+class RedeliveryFilter:
+    """
+    Recognizes QoS 1 messages the broker sends again after a reconnect.
+
+    The broker sets the DUP flag on a redelivery and keeps its packet ID, so
+    a DUP message whose packet ID, topic and payload match one of the last
+    max_size messages is a duplicate.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max(1, int(max_size))
+        self._seen = OrderedDict()
+
+    def is_duplicate(self, msg):
+        """Record a QoS 1/2 message and return whether it was already received"""
+        key = (msg.mid, msg.topic, zlib.crc32(msg.payload))
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return bool(msg.dup)
+        self._seen[key] = None
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
+
+
+class BrokerConnection:
+    """
+    One broker connection; paho's network loop runs on its own thread.
+
+    Connections use a stable client ID and (unless MQTT_CLEAN_SESSION) a
+    persistent session subscribed at QoS 1, so messages published while
+    disconnected are delivered after reconnecting. Redeliveries of messages
+    already received are dropped. Lost connections are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, engine, broker):
+        self.engine = engine
+        self.broker = broker
+        self.client = None
+        self.is_connected = False
+        self.backoff = Backoff(
+            getattr(settings, 'MQTT_RECONNECT_MIN_DELAY', 0.5),
+            getattr(settings, 'MQTT_RECONNECT_MAX_DELAY', 30),
+        )
+        self.redeliveries = RedeliveryFilter(getattr(settings, 'MQTT_DEDUP_WINDOW', 10000))
+        self._stop = threading.Event()
+        self._thread = None
+        self._disconnected_at = None
+        self.received_count = 0
+        self.connect_count = 0
+        self.disconnect_count = 0
+        self.duplicate_count = 0
+        self.session_present = False
+        self.last_recovery_seconds = None
+        self.last_error = None
+
+    @property
+    def client_id(self):
+        if self.engine.ingest_mode == INGEST_SHARED:
+            # Every process is its own member of the shared subscription group. Its slot
+            # number outlives restarts, so a replacement resumes the session it left behind
+            if self.engine.shared_slot is not None:
+                return f'{self.broker.client_id}-{self.engine.shared_slot}'
+            return f'{self.broker.client_id}-{os.getpid()}'
+        return self.broker.client_id
+
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback when MQTT client connects"""
+        if rc == 0:
+            now = time.monotonic()
+            self.is_connected = True
+            self.connect_count += 1
+            self.last_error = None
+            self.backoff.reset()
+            self.session_present = bool(flags.get('session present'))
+            if self._disconnected_at is not None:
+                self.last_recovery_seconds = now - self._disconnected_at
+                self._disconnected_at = None
+                metrics.broker_recovery.observe(self.last_recovery_seconds)
+            logger.info(
+                f"MQTT Client connected successfully to {self.broker.host}:{self.broker.port} "
+                f"(client ID {self.client_id}, session {'resumed' if self.session_present else 'new'})"
+            )
+
+            # Subscribe to topics
+            for topic in self.broker.topics:
+                if self.engine.ingest_mode == INGEST_SHARED:
+                    # The broker hands each message to one member of the group
+                    topic = shared_topic(topic, self.engine.shared_group)
+                client.subscribe(topic, qos=self.broker.qos)
+                logger.info(f"Subscribed to topic: {topic} (QoS {self.broker.qos})")
+        else:
+            self.is_connected = False
+            self.last_error = f"Connection refused: {mqtt.connack_string(rc) if isinstance(rc, int) else rc}"
+            logger.error(f"MQTT Connection failed with code {rc}")
+
+    def on_disconnect(self, client, userdata, rc):
+        """Callback when MQTT client disconnects"""
+        if self.is_connected and rc != 0:
+            self.disconnect_count += 1
+            self._disconnected_at = time.monotonic()
+        self.is_connected = False
+        logger.warning(f"MQTT Client disconnected from {self.broker.host}:{self.broker.port}")
+
+    def on_connect_v5(self, client, userdata, flags, reason_code, properties=None):
+        """MQTT v5 connect callback (shared subscriptions)"""
+        self.on_connect(client, userdata, flags, reason_code)
+
+    def on_disconnect_v5(self, client, userdata, reason_code, properties=None):
+        """MQTT v5 disconnect callback (shared subscriptions)"""
+        self.on_disconnect(client, userdata, reason_code)
+
+    def on_message(self, client, userdata, msg):
+        """Callback when MQTT message is received - hand off to the engine"""
+        if msg.qos and self.redeliveries.is_duplicate(msg):
+            self.duplicate_count += 1
+            return
+        self.received_count += 1
+        self.engine.on_message(client, userdata, msg)
+
+    def on_log(self, client, userdata, level, buf):
+        """Callback for MQTT logging"""
+        logger.debug(f"MQTT Log: {buf}")
+
+    def create_client(self):
+        """Create a paho client with callbacks, credentials and TLS configured"""
+        # Shared subscriptions are an MQTT v5 feature
+        # Reconnecting is done by run() with jittered backoff, not by paho
+        if self.engine.ingest_mode == INGEST_SHARED:
+            client = mqtt.Client(self.client_id, protocol=mqtt.MQTTv5, reconnect_on_failure=False)
+            client.on_connect = self.on_connect_v5
+            client.on_disconnect = self.on_disconnect_v5
+        else:
+            client = mqtt.Client(
+                self.client_id, clean_session=self.broker.clean_session, reconnect_on_failure=False
+            )
+            client.on_connect = self.on_connect
+            client.on_disconnect = self.on_disconnect
+
+        # Set callbacks
+        client.on_message = self.on_message
+        client.on_log = self.on_log
+
+        # Set credentials if provided
+        if self.broker.username:
+            client.username_pw_set(self.broker.username, self.broker.password)
+
+        if self.broker.tls:
+            logger.info(f"Configuring TLS for MQTT connection")
+            # Configure TLS
+            # For HiveMQ Cloud and most cloud MQTT brokers
+            if self.broker.tls_insecure:
+                # Development mode: disable certificate verification
+                client.tls_set()
+                client.tls_insecure_set(True)
+                logger.warning("TLS certificate verification is disabled (development mode)")
+            else:
+                # Production mode: use default CA certificates
+                client.tls_set_context(ssl.create_default_context(ssl.Purpose.SERVER_AUTH))
+                logger.info("TLS with certificate verification enabled")
+        return client
+
+    def connect_client(self):
+        """Open the network connection (blocking)"""
+        broker = self.broker
+        if self.engine.ingest_mode == INGEST_SHARED:
+            # MQTT v5 ends the session on disconnect unless it has an expiry interval.
+            # A per-PID client ID would never be reused, so its session must not outlive it.
+            properties = Properties(PacketTypes.CONNECT)
+            persistent = not broker.clean_session and self.engine.shared_slot is not None
+            if persistent:
+                properties.SessionExpiryInterval = int(getattr(settings, 'MQTT_SESSION_EXPIRY', 3600))
+            self.client.connect(
+                broker.host, broker.port, broker.keepalive,
+                clean_start=not persistent, properties=properties,
+            )
+        else:
+            self.client.connect(broker.host, broker.port, broker.keepalive)
+
+    def connect_failed(self, error):
+        """Record a failed connection attempt and return the delay before the next one"""
+        self.last_error = str(error)
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+        delay = self.backoff.next()
+        logger.error(f"Error connecting to MQTT broker {self.broker.host}:{self.broker.port}: {error} (retrying in {delay:.1f}s)")
+        return delay
+
+    def start(self):
+        """Connect and keep reconnecting on a background thread"""
+        broker = self.broker
+        logger.info(f"Connecting to MQTT broker: {broker.host}:{broker.port} (TLS: {broker.tls})")
+        self._stop.clear()
+        try:
+            self.client = self.create_client()
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Error connecting to MQTT broker: {e}")
+            return
+        self._thread = threading.Thread(target=self._run, name=f'mqtt-broker-{broker.key}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """Connect, run paho's network loop until the connection ends, back off, repeat"""
+        while not self._stop.is_set():
+            try:
+                self.connect_client()
+            except Exception as e:
+                self._stop.wait(self.connect_failed(e))
+                continue
+            if self._stop.is_set():
+                self.client.disconnect()
+            self.client.loop_forever()
+            if not self._stop.is_set():
+                self._stop.wait(self.backoff.next())
+
+    def stop(self):
+        """Disconnect and stop the network thread"""
+        self._stop.set()
+        if self.client:
+            self.client.disconnect()
+            self.is_connected = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_stats(self):
+        """Get connection statistics"""
+        return {
+            'id': self.broker.key if self.broker.key != SETTINGS_KEY else None,
+            'broker_host': self.broker.host,
+            'broker_port': self.broker.port,
+            'topics': list(self.broker.topics),
+            'client_id': self.client_id,
+            'connected': self.is_connected,
+            'session_present': self.session_present,
+            'received': self.received_count,
+            'duplicates': self.duplicate_count,
+            'connects': self.connect_count,
+            'disconnects': self.disconnect_count,
+            'last_recovery_seconds': self.last_recovery_seconds,
+            'last_error': self.last_error,
+        }
+
+
+class BrokerManager:
+    """
+    Keeps one connection open per active MQTTConfig row.
+
+    The configurations are re-read when the config API or admin changes them
+    (through signals, in this process) and every reload_interval seconds
+    (to pick up changes made in other processes). A connection whose settings
+    changed is replaced; one whose row was deleted or deactivated is closed.
+    While no configuration is active, the broker from settings.MQTT_* is used.
+    """
+
+    def __init__(self, engine, connection_class=BrokerConnection, reload_interval=10):
+        self.engine = engine
+        self.connection_class = connection_class
+        self.reload_interval = float(reload_interval)
+        self.connections = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def load(self):
+        """Return the wanted broker settings by key, or None when they cannot be read"""
+        from .models import MQTTConfig
+        try:
+            configs = list(MQTTConfig.objects.filter(is_active=True).order_by('id'))
+        except DatabaseError as e:
+            logger.warning(f"Could not read MQTT configurations: {e}")
+            return None if self.connections else {SETTINGS_KEY: BrokerSettings.from_settings()}
+        if not configs:
+            return {SETTINGS_KEY: BrokerSettings.from_settings()}
+        return {config.pk: BrokerSettings.from_config(config) for config in configs}
+
+    def update(self, wanted):
+        """Make wanted the current set of brokers; return the (stopped, started) connections to act on"""
+        stopped, started = [], []
+        with self._lock:
+            for key, conn in list(self.connections.items()):
+                if wanted.get(key) != conn.broker:
+                    stopped.append(self.connections.pop(key))
+            for key, broker in wanted.items():
+                if key not in self.connections:
+                    self.connections[key] = self.connection_class(self.engine, broker)
+                    started.append(self.connections[key])
+            # Keep the configuration order for status reports
+            self.connections = {key: self.connections[key] for key in wanted}
+        for conn in stopped:
+            logger.info(f"Closing MQTT broker connection {conn.broker.host}:{conn.broker.port}")
+        return stopped, started
+
+    def sync(self):
+        """Re-read the configurations and reconnect what changed"""
+        wanted = self.load()
+        if wanted is None:
+            return
+        stopped, started = self.update(wanted)
+        for conn in stopped:
+            conn.stop()
+        for conn in started:
+            conn.start()
+
+    def close(self):
+        """Return all connections to stop, forgetting them"""
+        with self._lock:
+            connections, self.connections = list(self.connections.values()), {}
+        return connections
+
+    @property
+    def is_connected(self):
+        return any(conn.is_connected for conn in list(self.connections.values()))
+
+    def get_stats(self):
+        """Per-broker statistics"""
+        return [conn.get_stats() for conn in list(self.connections.values())]
+
+    # Background reloading for the thread engine
+
+    def start(self):
+        """Connect on a background thread (keeping database access out of startup) and keep reloading"""
+        if self._thread:
+            return
+        self._stopping = False
+        self._wakeup.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-brokers', daemon=True)
+        self._thread.start()
+
+    def request_reload(self):
+        """Re-read the configurations as soon as possible"""
+        self._wakeup.set()
+
+    def stop(self):
+        """Stop reloading and close every connection"""
+        if self._thread:
+            self._stopping = True
+            self._wakeup.set()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+        for conn in self.close():
+            conn.stop()
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                close_old_connections()
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"Error applying MQTT configurations: {e}")
+                self._wakeup.wait(self.reload_interval)
+                self._wakeup.clear()
+        finally:
+            connection.close()
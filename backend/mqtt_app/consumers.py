@@ -1,72 +1,308 @@
 """
 WebSocket consumers for MQTT messages
 """
-import json
+import asyncio
+import itertools
+import time
+from urllib.parse import unquote
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from .broadcast import SNAPSHOT_FRAME, REPLAY_FRAME
+from .frames import LiveFrame, negotiate
+from .json_codec import codec, DecodeError
+from .last_values import last_values
+from .metrics import metrics, STAGE_WS_SEND
+from .outbox import SendQueue
+from .relay import relay
+from .replay import replay_buffer
+from .streams import TopicStreams, StreamOptions, InvalidStreamOptions
+from .topics import validate_filter, InvalidTopicFilter
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Names of WebSocket connections in logs and metrics
+_connection_ids = itertools.count(1)
+
 
 class MQTTConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for broadcasting MQTT messages"""
+    """
+    WebSocket consumer for broadcasting MQTT messages
+    
+    Clients receive every topic until they send a ``subscribe`` message (or
+    connect with ``?topics=a/+,b/#``); from then on they only receive messages
+    matching their filters.
+    
+    Clients reconnecting with ``?resume_from=<seq>&epoch=<epoch>`` get the
+    messages they missed replayed before live traffic continues.
+    
+    Live messages come from this server process's MessageRelay, which also
+    numbers them and keeps the replay buffer and last values, so sequence
+    numbers, replays and snapshots are those of the process the client is
+    connected to.
+    
+    Live messages go through a bounded per-connection send queue (see
+    SendQueue), so a client on a slow link is conflated, loses its oldest
+    messages or is disconnected instead of backing up the relay.
+    
+    Subscriptions may ask for ``"delta": true`` and/or ``"max_rate_ms": n``
+    (or connect with ``?delta=1&max_rate_ms=n``) to receive only changed
+    payload fields and at most one frame per topic every n milliseconds
+    (see TopicStreams).
+    
+    Clients offering the ``mqtt.msgpack`` or ``mqtt.cbor`` subprotocol
+    receive binary frames in that format instead of JSON text (see
+    BinaryFrameEncoder); they still send JSON text.
+    """
+    
+    # Close code sent to clients dropped for lagging (4000-4999: application defined)
+    SLOW_CONSUMER_CLOSE_CODE = 4008
+    
+    # Messages come from the relay: connections need no channel of their own
+    channel_layer_alias = None
     
     async def connect(self):
         """Handle WebSocket connection"""
-        self.group_name = 'mqtt_messages'
+        self.name = f'ws-{next(_connection_ids)}'
+        self.filters = None  # None means all topics
+        self.outbox = None
+        self.sender = None
+        self.dropping = False
+        self.send_lock = asyncio.Lock()
+        self.frame_encoder = negotiate(self.scope.get('subprotocols', []))
+        self.streams = TopicStreams(self.queue_frame, asyncio.get_running_loop())
         
-        # Join room group
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        topics = [t for t in self.get_query_param('topics', '').split(',') if t]
+        try:
+            if topics:
+                self.filters = {validate_filter(t) for t in topics}
+            max_rate_ms = self.get_query_param('max_rate_ms')
+            options = StreamOptions.parse(
+                delta=self.get_query_param('delta', '') in ('1', 'true'),
+                max_rate_ms=int(max_rate_ms) if max_rate_ms and max_rate_ms.isdigit() else max_rate_ms
+            )
+        except (InvalidTopicFilter, InvalidStreamOptions) as e:
+            logger.warning(f"Rejecting WebSocket connection: {e}")
+            await self.close()
+            return
+        if options is not None:
+            self.streams.set(self.filters or {'#'}, options)
         
-        await self.accept()
-        logger.info(f"WebSocket client connected: {self.channel_name}")
+        relay.start()
+        await self.accept(subprotocol=self.frame_encoder.subprotocol if self.frame_encoder else None)
+        self.outbox = SendQueue(
+            policy=getattr(settings, 'MQTT_WS_SLOW_CONSUMER_POLICY', 'conflate'),
+            max_size=getattr(settings, 'MQTT_WS_SEND_QUEUE_SIZE', 1000),
+            max_lag=getattr(settings, 'MQTT_WS_MAX_LAG', 30),
+            conflate_depth=getattr(settings, 'MQTT_WS_CONFLATE_DEPTH', 100),
+            conflate_lag=getattr(settings, 'MQTT_WS_CONFLATE_LAG', 1.0),
+        )
+        metrics.add_connection(self.name, self.outbox)
+        logger.info(f"WebSocket client connected: {self.name}")
         
-        # Send welcome message
-        await self.send(text_data=json.dumps({
+        # Routing starts together with the welcome, replay and snapshot, with no await in
+        # between: every message is either part of them or queued as live traffic after them
+        self._update_routing()
+        frames = [codec.dumps({
             'type': 'connection',
-            'message': 'Connected to MQTT WebSocket'
-        }))
+            'message': 'Connected to MQTT WebSocket',
+            'epoch': replay_buffer.epoch,
+            'seq': replay_buffer.last_seq
+        })]
+        complete = False
+        resume_from = self.get_query_param('resume_from')
+        if resume_from is not None and resume_from.isdigit():
+            complete = self.replay(int(resume_from), self.get_query_param('epoch'), frames)
+        if not complete:
+            # Send the current value of every topic the client is interested in
+            self.snapshot(self.filters, frames)
+        for frame in frames:
+            await self.send(text_data=frame)
+        if not self.dropping:
+            self.sender = asyncio.ensure_future(self.send_outbox())
+    
+    def get_query_param(self, name, default=None):
+        """Read a query string parameter, keeping '+' literal as MQTT filters need it"""
+        for part in self.scope.get('query_string', b'').decode().split('&'):
+            key, _, value = part.partition('=')
+            if key == name:
+                return unquote(value)
+        return default
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
-        logger.info(f"WebSocket client disconnected: {self.channel_name}")
+        relay.unsubscribe(self)
+        if getattr(self, 'streams', None) is not None:
+            self.streams.close()
+        await self.stop_sender()
+        metrics.remove_connection(self.name)
+        logger.info(f"WebSocket client disconnected: {self.name}")
     
     async def receive(self, text_data):
         """Handle messages received from WebSocket client"""
         try:
-            data = json.loads(text_data)
+            data = codec.loads(text_data)
             message_type = data.get('type', 'unknown')
             
             logger.info(f"Received WebSocket message: {message_type}")
             
             # Echo back or handle client messages
             if message_type == 'ping':
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=codec.dumps({
                     'type': 'pong',
                     'message': 'pong'
                 }))
+            elif message_type in ('subscribe', 'unsubscribe'):
+                await self.handle_subscription(
+                    message_type, data.get('topics', []),
+                    delta=data.get('delta', False), max_rate_ms=data.get('max_rate_ms')
+                )
                 
-        except json.JSONDecodeError:
+        except DecodeError:
             logger.error("Invalid JSON received from WebSocket client")
         except Exception as e:
             logger.error(f"Error handling WebSocket message: {e}")
     
-    async def mqtt_message(self, event):
-        """Receive message from room group and send to WebSocket"""
-        message = event['message']
+    async def handle_subscription(self, message_type, topics, delta=False, max_rate_ms=None):
+        """Add or remove topic filters (and their stream options) for this connection"""
+        if isinstance(topics, str):
+            topics = [topics]
+        try:
+            requested = {validate_filter(t) for t in topics}
+            options = StreamOptions.parse(delta, max_rate_ms) if message_type == 'subscribe' else None
+        except (InvalidTopicFilter, InvalidStreamOptions) as e:
+            await self.send(text_data=codec.dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+            return
         
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'mqtt_message',
-            'data': message
-        }))
-
+        if message_type == 'subscribe':
+            # The first explicit subscription replaces the implicit "all topics"
+            added = requested - (self.filters or set())
+            self.filters = (self.filters or set()) | requested
+        else:
+            added = set()
+            self.filters = (self.filters or set()) - requested
+        self._update_routing()
+        # Resubscribing without options returns the filters to plain delivery
+        self.streams.set(requested, options)
+        
+        # Queued like live frames, so the snapshot of added filters precedes their live messages
+        frames = [codec.dumps({
+            'type': f'{message_type}d',
+            'topics': sorted(self.filters),
+            'streams': self.streams.describe()
+        })]
+        if added:
+            self.snapshot(added, frames)
+        for frame in frames:
+            self.queue_frame(frame)
+    
+    def snapshot(self, filters, frames):
+        """Add a frame of the cached last values matching filters (None for all topics)"""
+        if not getattr(settings, 'MQTT_LAST_VALUE_SNAPSHOT', True):
+            return
+        values = last_values.snapshot(filters)
+        if values:
+            frames.append(SNAPSHOT_FRAME % ','.join(values))
+    
+    def replay(self, resume_from, epoch, frames):
+        """Add the frames replaying buffered messages after resume_from; return False if some were lost"""
+        if epoch != replay_buffer.epoch:
+            # Server restarted, or this is another server process: its sequence numbers mean nothing here
+            frames.append(self.replay_gap(resume_from, 'restart'))
+            return False
+        messages, gap = replay_buffer.since(resume_from, self.filters)
+        if gap:
+            frames.append(self.replay_gap(resume_from, 'evicted'))
+        if messages:
+            frames.append(REPLAY_FRAME % ','.join(data for _, data in messages))
+        return not gap
+    
+    def replay_gap(self, resume_from, reason):
+        """Frame telling the client that messages after resume_from cannot be replayed"""
+        return codec.dumps({
+            'type': 'replay_gap',
+            'reason': reason,
+            'requested': resume_from,
+            'oldest_available': replay_buffer.oldest_seq(),
+            'epoch': replay_buffer.epoch
+        })
+    
+    def _update_routing(self):
+        """Have the relay route every topic, or only the filtered ones, to this connection"""
+        wants_all = self.filters is None or '#' in self.filters
+        relay.subscribe(self, None if wants_all else self.filters)
+    
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        """Send one frame at a time, whether from the send queue or a direct reply"""
+        if text_data is not None and self.frame_encoder is not None:
+            text_data, bytes_data = None, self.frame_encoder.encode(text_data)
+        elif isinstance(text_data, LiveFrame):
+            text_data = text_data.text
+        async with self.send_lock:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+    
+    async def send_outbox(self):
+        """Sender task: forward queued frames as fast as the client takes them"""
+        try:
+            while True:
+                frame = await self.outbox.get()
+                started = time.perf_counter()
+                await self.send(text_data=frame)
+                metrics.observe(STAGE_WS_SEND, time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"Error sending to WebSocket client {self.name}: {e}")
+    
+    async def stop_sender(self):
+        """Cancel the sender task"""
+        sender, self.sender = getattr(self, 'sender', None), None
+        if sender is not None:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+    
+    def queue_frame(self, frame, topic=None):
+        """Queue a live frame (text or LiveFrame), applying the slow consumer policy"""
+        if self.outbox is None or self.dropping:
+            return
+        lost = self.outbox.lost_count
+        if not self.outbox.put(frame, topic):
+            self.dropping = True
+            self._drop_task = asyncio.ensure_future(self.drop_slow_consumer())
+        elif self.outbox.lost_count != lost:
+            # A lost frame may be a delta the client needed: start those topics over
+            self.streams.reset_deltas()
+    
+    async def drop_slow_consumer(self):
+        """Disconnect a client that fell too far behind, telling it why if the link allows"""
+        logger.warning(
+            f"Disconnecting slow WebSocket client {self.name}: "
+            f"{len(self.outbox)} frames pending, {self.outbox.lag():.1f}s behind"
+        )
+        metrics.websocket_slow_disconnects.inc()
+        await self.stop_sender()
+        try:
+            await asyncio.wait_for(self.send(text_data=self.outbox.notice()), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+        await self.close(code=self.SLOW_CONSUMER_CLOSE_CODE)
+    
+    def deliver(self, frame):
+        """Queue a LiveFrame routed here by the relay"""
+        if self.streams:
+            # Split off the messages of topics with stream options
+            plain = []
+            for message in frame.messages:
+                options = self.streams.options_for(message.topic)
+                if options is None:
+                    plain.append(message)
+                else:
+                    self.streams.offer(codec.loads(message.text), options, LiveFrame((message,)))
+            if not plain:
+                return
+            if len(plain) < len(frame.messages):
+                frame = LiveFrame(plain, frame.batch)
+        # Frames are encoded once per format for all clients and forwarded unchanged
+        self.queue_frame(frame, None if frame.batch else frame.messages[0].topic)
@@ -0,0 +1,86 @@
+"""
+Coordination of MQTT ingest across several server worker processes
+"""
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# single: every process subscribes (one worker only)
+# shared: MQTT v5 shared subscriptions, the broker load-balances messages across processes
+# leader: processes on this host elect one ingesting process through a lock file
+INGEST_SINGLE = 'single'
+INGEST_SHARED = 'shared'
+INGEST_LEADER = 'leader'
+INGEST_MODES = (INGEST_SINGLE, INGEST_SHARED, INGEST_LEADER)
+
+
+def shared_topic(topic_filter, group):
+    """Return the shared subscription for topic_filter within group"""
+    if topic_filter.startswith('$share/'):
+        return topic_filter
+    return f'$share/{group}/{topic_filter}'
+
+
+class LeaderLock:
+    """
+    Non-blocking exclusive lock on a local file.
+
+    The process holding the lock is the leader. The operating system releases
+    the lock when that process exits or crashes, so a follower retrying
+    acquire() takes over without any cleanup.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise ValueError("Leader election needs fcntl, which is not available on this platform")
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def acquire(self):
+        """Try to become the leader; return whether this process holds the lock"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # Record the leader's PID for operators; the lock itself is what counts
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        logger.info(f"Process {os.getpid()} acquired MQTT lock {self.path}")
+        return True
+
+    def release(self):
+        """Give up leadership"""
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+def acquire_slot(prefix, limit=256):
+    """
+    Lock the lowest free slot number on this host; return (slot, lock).
+
+    Slots are lock files named <prefix>-<n>.lock. The operating system frees
+    the slot of a process that exits, so its replacement takes the same number.
+    """
+    for slot in range(limit):
+        lock = LeaderLock(f'{prefix}-{slot}.lock')
+        if lock.acquire():
+            return slot, lock
+    raise ValueError(f"All {limit} MQTT ingest slots {prefix}-<n>.lock are taken")
@@ -0,0 +1,100 @@
+"""
+Streaming NDJSON/CSV export of MQTT message history
+"""
+import csv
+import io
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from .json_codec import codec
+from .payloads import payload_codec, to_text
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = ['id', 'topic', 'payload', 'payload_encoding', 'qos', 'timestamp']
+
+
+def iter_chunks(queryset, chunk_size=2000):
+    """
+    Yield lists of (id, topic, payload, payload_encoding, qos, timestamp) rows oldest-first.
+
+    Every chunk is its own short keyset query continuing after the last row
+    of the previous one, so memory stays bounded and no cursor or transaction
+    is held open between chunks.
+    """
+    queryset = queryset.order_by('timestamp', 'id').values_list(
+        'id', 'topic__name', 'payload_data', 'compression', 'dictionary_id', 'qos', 'timestamp'
+    )
+    position = Q()
+    while True:
+        rows = list(queryset.filter(position)[:chunk_size])
+        if not rows:
+            return
+        yield [
+            (pk, topic, *to_text(payload_codec.decode(data, compression, dictionary_id)), qos, timestamp)
+            for pk, topic, data, compression, dictionary_id, qos, timestamp in rows
+        ]
+        if len(rows) < chunk_size:
+            return
+        pk, timestamp = rows[-1][0], rows[-1][-1]
+        position = Q(timestamp__gte=timestamp) & (Q(timestamp__gt=timestamp) | Q(id__gt=pk))
+
+
+def ndjson_chunks(chunks):
+    """Encode each chunk of rows as newline-delimited JSON"""
+    for rows in chunks:
+        yield ''.join(
+            codec.dumps({
+                'id': pk,
+                'topic': topic,
+                'payload': payload,
+                'payload_encoding': encoding,
+                'qos': qos,
+                'timestamp': timestamp.isoformat(),
+            }) + '\n'
+            for pk, topic, payload, encoding, qos, timestamp in rows
+        )
+
+
+def csv_chunks(chunks):
+    """Encode each chunk of rows as CSV, starting with a header line"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for rows in chunks:
+        writer.writerows(
+            (pk, topic, payload, encoding or '', qos, timestamp.isoformat())
+            for pk, topic, payload, encoding, qos, timestamp in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when there are no rows
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def _aiter(parts):
+    """Pull a sync iterator from a worker thread, one chunk at a time"""
+    parts = iter(parts)
+    while True:
+        part = await sync_to_async(next)(parts, None)
+        if part is None:
+            return
+        yield part
+
+
+def export_response(request, queryset, export_format='ndjson', chunk_size=2000):
+    """Build a StreamingHttpResponse exporting queryset in export_format"""
+    encode = ndjson_chunks if export_format == 'ndjson' else csv_chunks
+    content = encode(iter_chunks(queryset, chunk_size))
+    # Under ASGI a sync iterator would be read into memory in full before sending
+    if isinstance(request, ASGIRequest):
+        content = _aiter(content)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="mqtt-messages.{export_format}"'
+    return response
@@ -0,0 +1,162 @@
+"""
+Query parameter filters for MQTT message history
+"""
+import re
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from .models import MQTTTopic, MQTTRollup, MQTTPayloadField
+from .payload_index import PARAM_PREFIX as PAYLOAD_PARAM_PREFIX, PayloadIndexer
+from .topics import validate_filter, InvalidTopicFilter
+
+
+def prefix_range(prefix):
+    """
+    Topic name lookups matching names that start with prefix.
+
+    A half-open range (>= prefix, < next prefix) can use the unique index on
+    the name, unlike LIKE 'prefix%' which SQLite only indexes in special cases.
+    """
+    if not prefix:
+        return {}
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {'name__gte': prefix, 'name__lt': upper}
+
+
+def topics_matching(pattern):
+    """
+    Topics matching an exact topic or an MQTT wildcard filter, as a queryset.
+
+    Callers pass it as a subquery (topic__in=...) so matching IDs are never
+    bound as query parameters. The literal levels before the first wildcard
+    narrow the name index with prefix_range(); a regex mirroring the
+    TopicTrie semantics is the residual check on the remaining candidates.
+    """
+    pattern = validate_filter(pattern)
+    levels = pattern.split('/')
+    if '+' not in levels and '#' not in levels:
+        return MQTTTopic.objects.filter(name=pattern)
+
+    literal = []
+    for level in levels:
+        if level in ('+', '#'):
+            break
+        literal.append(level)
+    topics = MQTTTopic.objects.filter(**prefix_range('/'.join(literal)))
+    if not literal:
+        # Wildcards at the first level never match topics starting with '$' (e.g. $SYS)
+        topics = topics.exclude(name__startswith='$')
+    return topics.filter(name__regex=filter_regex(levels))
+
+
+def filter_regex(levels):
+    """Anchored regex matching the same topic names as the filter levels"""
+    parts = []
+    for level in levels:
+        if level == '#':
+            # 'a/#' matches 'a' itself as well as everything below it
+            return '^' + ('/'.join(parts) + '(/.*)?' if parts else '.*') + '$'
+        parts.append('[^/]*' if level == '+' else re.escape(level))
+    return '^' + '/'.join(parts) + '$'
+
+
+def parse_datetime_param(params, name):
+    """Parse an ISO 8601 query parameter, raising a 400 on bad input"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: f"Invalid datetime '{value}', expected ISO 8601"})
+    return parsed
+
+
+def parse_int_param(params, name):
+    """Parse an integer query parameter, raising a 400 on bad input"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: f"Invalid integer '{value}'"})
+
+
+def filter_messages(queryset, params):
+    """Apply the history filters (topic, topic_prefix, topic_contains, since, until, after_id, payload.<key>)"""
+    # Topic filters are resolved on the small topic table, then applied by topic ID
+    topic = params.get('topic', None)
+    if topic:
+        try:
+            queryset = queryset.filter(topic__in=topics_matching(topic))
+        except InvalidTopicFilter as e:
+            raise ValidationError({'topic': str(e)})
+
+    topic_prefix = params.get('topic_prefix', None)
+    if topic_prefix:
+        queryset = queryset.filter(topic__in=MQTTTopic.objects.filter(**prefix_range(topic_prefix)))
+
+    topic_contains = params.get('topic_contains', None)
+    if topic_contains:
+        queryset = queryset.filter(topic__in=MQTTTopic.objects.filter(name__icontains=topic_contains))
+
+    since = parse_datetime_param(params, 'since')
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+
+    until = parse_datetime_param(params, 'until')
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+
+    after_id = parse_int_param(params, 'after_id')
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+
+    # payload.<key>=<value> filters are answered by the payload field index, never by reading payloads
+    indexed_keys = None
+    for name, value in params.items():
+        if not name.startswith(PAYLOAD_PARAM_PREFIX):
+            continue
+        key = name[len(PAYLOAD_PARAM_PREFIX):]
+        if indexed_keys is None:
+            indexed_keys = PayloadIndexer.from_settings().keys
+        if key not in indexed_keys:
+            raise ValidationError({name: f"Payload field '{key}' is not indexed, add it to MQTT_PAYLOAD_INDEX_FIELDS"})
+        queryset = queryset.filter(
+            id__in=MQTTPayloadField.objects.filter(key=key, value=value).values('message_id')
+        )
+
+    return queryset
+
+
+def filter_rollups(queryset, params):
+    """Apply the aggregate filters (topic, field, resolution, since, until)"""
+    topic = params.get('topic', None)
+    if not topic:
+        raise ValidationError({'topic': "This parameter is required"})
+    try:
+        queryset = queryset.filter(topic__in=topics_matching(topic))
+    except InvalidTopicFilter as e:
+        raise ValidationError({'topic': str(e)})
+
+    field = params.get('field', None)
+    if field:
+        queryset = queryset.filter(field=field)
+
+    resolution = params.get('resolution', '1m')
+    if resolution not in MQTTRollup.RESOLUTIONS:
+        raise ValidationError({'resolution': f"Expected one of {', '.join(MQTTRollup.RESOLUTIONS)}"})
+    queryset = queryset.filter(resolution=MQTTRollup.RESOLUTIONS[resolution])
+
+    # Buckets are selected by their start time
+    since = parse_datetime_param(params, 'since')
+    if since is not None:
+        queryset = queryset.filter(bucket__gte=since)
+
+    until = parse_datetime_param(params, 'until')
+    if until is not None:
+        queryset = queryset.filter(bucket__lt=until)
+
+    return queryset
@@ -0,0 +1,221 @@
+"""
+Binary WebSocket frames: MessagePack or CBOR instead of JSON text, negotiated by subprotocol
+"""
+import base64
+import functools
+import logging
+import zlib
+from django.conf import settings
+from .broadcast import MESSAGE_FRAME, BATCH_FRAME
+from .json_codec import codec
+
+logger = logging.getLogger(__name__)
+
+# First byte of every binary frame
+FLAG_PLAIN = 0
+FLAG_ZLIB = 1
+
+# Frame types whose data holds MQTT messages
+MESSAGE_FRAME_TYPES = ('mqtt_message', 'mqtt_batch', 'snapshot', 'replay')
+
+
+
+def raw_payload(message, raw=None):
+    """Replace the base64 payload of a decoded message with its bytes (raw, if already known)"""
+    if isinstance(message, dict) and message.get('payload_encoding') == 'base64':
+        message['payload'] = raw if raw is not None else base64.b64decode(message['payload'])
+        del message['payload_encoding']
+    return message
+
+
+class LiveMessage:
+    """
+    A broadcast message as its relay received it: the JSON text of its data
+    object, plus the raw bytes of a binary payload (base64 in the text).
+
+    The data is packed for binary clients once per format, on first use,
+    and shared by every frame and client it is sent to.
+    """
+    __slots__ = ('topic', 'text', 'raw', '_packed')
+
+    def __init__(self, topic, text, raw=None):
+        self.topic = topic
+        self.text = text
+        self.raw = raw
+        self._packed = None
+
+    def packed(self, encoder):
+        """The data object packed by encoder"""
+        if self._packed is None:
+            self._packed = {}
+        body = self._packed.get(encoder.name)
+        if body is None:
+            body = self._packed[encoder.name] = encoder.packb(raw_payload(codec.loads(self.text), self.raw))
+        return body
+
+
+class LiveFrame:
+    """
+    An mqtt_message frame of one LiveMessage, or an mqtt_batch frame of several.
+
+    Queued instead of text by consumers and rendered when sent: as JSON text
+    or, for binary clients, by joining the packed messages under a packed
+    frame header, without decoding any JSON. Either is built once for all
+    the clients the frame is queued for.
+    """
+    __slots__ = ('messages', 'batch', '_text', '_binary')
+
+    def __init__(self, messages, batch=False):
+        self.messages = messages
+        self.batch = batch
+        self._text = None
+        self._binary = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            if self.batch:
+                self._text = BATCH_FRAME % ','.join(message.text for message in self.messages)
+            else:
+                self._text = MESSAGE_FRAME % self.messages[0].text
+        return self._text
+
+    def binary(self, encoder):
+        """The binary frame in encoder's format"""
+        if self._binary is None:
+            self._binary = {}
+        frame = self._binary.get(encoder)
+        if frame is None:
+            if self.batch:
+                body = b''.join([
+                    encoder.header('mqtt_batch'),
+                    encoder.array_header(len(self.messages)),
+                    *(message.packed(encoder) for message in self.messages),
+                ])
+            else:
+                body = encoder.header('mqtt_message') + self.messages[0].packed(encoder)
+            frame = self._binary[encoder] = encoder.wrap(body)
+        return frame
+
+
+class BinaryFrameEncoder:
+    """
+    Converts the JSON text frames the server produces to one binary format.
+
+    A binary frame is one flag byte followed by the encoded frame:
+    FLAG_PLAIN, or FLAG_ZLIB when the frame was at least compress_min_bytes
+    long (0 = never) and compressing made it smaller. The frame has the same
+    structure as the JSON one, except that binary MQTT payloads are raw bytes
+    instead of base64 text with payload_encoding.
+
+    Live messages arrive as LiveFrames, which cache their encoding for all
+    clients; other frames (replies, snapshots, replays) are text encoded
+    for the one client they are sent to.
+    """
+
+    def __init__(self, name, subprotocol, packb, compress_min_bytes=1024, compress_level=6):
+        self.name = name
+        self.subprotocol = subprotocol
+        self.packb = packb
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self._headers = {}
+
+    def __repr__(self):
+        return f'<BinaryFrameEncoder {self.name}>'
+
+    def encode(self, frame):
+        """The binary frame for a JSON text frame or a LiveFrame"""
+        if isinstance(frame, LiveFrame):
+            return frame.binary(self)
+        return self.encode_object(codec.loads(frame))
+
+    def encode_object(self, obj):
+        """The binary frame for a decoded frame"""
+        if obj.get('type') in MESSAGE_FRAME_TYPES:
+            data = obj.get('data')
+            for message in (data if isinstance(data, list) else [data]):
+                raw_payload(message)
+        return self.wrap(self.packb(obj))
+
+    def header(self, frame_type):
+        """The packed start of a {"type": frame_type, "data": ...} frame, up to its data"""
+        header = self._headers.get(frame_type)
+        if header is None:
+            # Both formats pack null as a single byte: drop it from the packed map
+            header = self._headers[frame_type] = self.packb({'type': frame_type, 'data': None})[:-1]
+        return header
+
+    def array_header(self, length):
+        """The packed start of an array of length items"""
+        if not length:
+            return self.packb([])
+        return self.packb([None] * length)[:-length]
+
+    def wrap(self, body):
+        """Add the flag byte to a packed frame, compressing it if that pays off"""
+        if self.compress_min_bytes and len(body) >= self.compress_min_bytes:
+            compressed = zlib.compress(body, self.compress_level)
+            if len(compressed) < len(body):
+                return bytes([FLAG_ZLIB]) + compressed
+        return bytes([FLAG_PLAIN]) + body
+
+
+def _msgpack_packb():
+    import msgpack
+
+    return functools.partial(msgpack.packb, use_bin_type=True)
+
+
+def _cbor_packb():
+    import cbor2
+
+    return cbor2.dumps
+
+
+# Subprotocol -> (format name, package to install, packb factory), in the server's order of preference
+_FORMATS = {
+    'mqtt.msgpack': ('msgpack', 'msgpack', _msgpack_packb),
+    'mqtt.cbor': ('cbor', 'cbor2', _cbor_packb),
+}
+
+_encoders = {}
+
+
+def available_subprotocols():
+    """Binary subprotocols whose library is installed here"""
+    subprotocols = []
+    for subprotocol, (_, _, factory) in _FORMATS.items():
+        try:
+            factory()
+        except ImportError:
+            continue
+        subprotocols.append(subprotocol)
+    return subprotocols
+
+
+def get_encoder(subprotocol):
+    """The process-wide encoder for a subprotocol, or None if it is unknown or not installed"""
+    if subprotocol not in _FORMATS:
+        return None
+    if subprotocol not in _encoders:
+        name, package, factory = _FORMATS[subprotocol]
+        try:
+            _encoders[subprotocol] = BinaryFrameEncoder(
+                name, subprotocol, factory(),
+                compress_min_bytes=getattr(settings, 'MQTT_WS_COMPRESS_MIN_BYTES', 1024),
+                compress_level=getattr(settings, 'MQTT_WS_COMPRESS_LEVEL', 6),
+            )
+        except ImportError:
+            logger.warning(f"WebSocket subprotocol {subprotocol} needs `pip install {package}`, using JSON")
+            _encoders[subprotocol] = None
+    return _encoders[subprotocol]
+
+
+def negotiate(requested):
+    """The encoder for the first requested subprotocol this server supports, or None for JSON text"""
+    for subprotocol in requested:
+        encoder = get_encoder(subprotocol)
+        if encoder is not None:
+            return encoder
+    return None
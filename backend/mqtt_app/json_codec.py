@@ -0,0 +1,105 @@
+"""
+Pluggable JSON codec: orjson or ujson when installed, the standard library otherwise
+"""
+import json
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Tried in this order when MQTT_JSON_CODEC is 'auto'
+PREFERENCE = ('orjson', 'ujson', 'json')
+
+# Raised by loads() for invalid input, whichever library is in use
+DecodeError = ValueError
+
+
+class JSONCodec:
+    """
+    One JSON library behind a common interface.
+
+    loads() accepts str or bytes, dumps() returns compact UTF-8 text and
+    dumpb() the same as bytes. default is called for objects the library
+    cannot serialize, as with json.dumps(). strict codecs reject NaN and
+    Infinity when decoding.
+    """
+
+    def __init__(self, name, loads, dumps, dumpb, strict=False):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.dumpb = dumpb
+        self.strict = strict
+
+    def __repr__(self):
+        return f'<JSONCodec {self.name}>'
+
+
+def _stdlib_codec():
+    def dumps(obj, default=None):
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':'))
+
+    return JSONCodec('json', json.loads, dumps, lambda obj, default=None: dumps(obj, default).encode('utf-8'))
+
+
+def _orjson_codec():
+    import orjson
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumpb(obj, default=None):
+        return orjson.dumps(obj, default=default, option=option)
+
+    return JSONCodec(
+        'orjson', orjson.loads, lambda obj, default=None: dumpb(obj, default).decode('utf-8'), dumpb, strict=True
+    )
+
+
+def _ujson_codec():
+    import ujson
+
+    def dumps(obj, default=None):
+        return ujson.dumps(obj, default=default, ensure_ascii=False, escape_forward_slashes=False)
+
+    return JSONCodec('ujson', ujson.loads, dumps, lambda obj, default=None: dumps(obj, default).encode('utf-8'))
+
+
+_FACTORIES = {
+    'json': _stdlib_codec,
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+}
+
+
+def available_codecs():
+    """Names of the codecs that can be loaded here, fastest first"""
+    names = []
+    for name in PREFERENCE:
+        try:
+            _FACTORIES[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(name='auto'):
+    """
+    Return the codec called name, or the fastest available one for 'auto'.
+
+    A codec that is requested explicitly but not installed falls back to the
+    standard library with a warning.
+    """
+    if name == 'auto':
+        return _FACTORIES[available_codecs()[0]]()
+    if name not in _FACTORIES:
+        raise ValueError(f"Unknown JSON codec: {name}")
+    try:
+        return _FACTORIES[name]()
+    except ImportError:
+        logger.warning(f"JSON codec {name} is not installed, using the standard library")
+        return _stdlib_codec()
+
+
+# Process-wide codec used on the ingest, WebSocket and REST paths
+codec = get_codec(getattr(settings, 'MQTT_JSON_CODEC', 'auto'))
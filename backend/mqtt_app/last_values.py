@@ -0,0 +1,76 @@
+"""
+In-memory last-value cache of the most recent message per topic
+"""
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .topics import TopicTrie
+
+
+class LastValueCache:
+    """
+    Bounded LRU map of topic -> encoded message data.
+
+    Entries are the pre-encoded ``data`` objects built at ingest, so serving a
+    snapshot is a string join. An update carrying a lower sequence number
+    than the cached entry (a message overtaken by a newer one on another
+    worker) is ignored. The least recently updated topics are evicted
+    once either the topic count or the approximate byte size exceeds its cap.
+    """
+
+    def __init__(self, max_topics=10000, max_bytes=16 * 1024 * 1024):
+        self.max_topics = max(1, int(max_topics))
+        self.max_bytes = max(1, int(max_bytes))
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evicted_count = 0
+
+    def update(self, topic, data, seq=0):
+        """Store the latest encoded data for topic, unless a message with a higher seq is cached"""
+        size = len(topic) + len(data)
+        with self._lock:
+            previous = self._entries.get(topic)
+            if previous is not None:
+                if seq and previous[0] > seq:
+                    return
+                del self._entries[topic]
+                self._size -= len(topic) + len(previous[1])
+            self._entries[topic] = (seq, data)
+            self._size += size
+            while len(self._entries) > self.max_topics or (self._size > self.max_bytes and len(self._entries) > 1):
+                old_topic, (_, old_data) = self._entries.popitem(last=False)
+                self._size -= len(old_topic) + len(old_data)
+                self.evicted_count += 1
+
+    def snapshot(self, filters=None):
+        """Return encoded data for every cached topic, optionally limited to MQTT filters"""
+        with self._lock:
+            items = list(self._entries.items())
+        if filters is None:
+            return [data for _, (_, data) in items]
+        trie = TopicTrie()
+        for topic_filter in filters:
+            trie.add(topic_filter, True)
+        return [data for topic, (_, data) in items if trie.match(topic)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            return {
+                'last_value_topics': len(self._entries),
+                'last_value_bytes': self._size,
+                'last_value_evicted': self.evicted_count,
+            }
+
+
+# Process-wide cache updated by the MQTT client and read by consumers and views
+last_values = LastValueCache(
+    max_topics=getattr(settings, 'MQTT_LAST_VALUE_MAX_TOPICS', 10000),
+    max_bytes=getattr(settings, 'MQTT_LAST_VALUE_MAX_BYTES', 16 * 1024 * 1024),
+)
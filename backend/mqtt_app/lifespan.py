@@ -0,0 +1,61 @@
+"""
+ASGI lifespan handling that runs the asyncio MQTT engine inside the server's event loop
+"""
+import logging
+from .relay import relay
+
+logger = logging.getLogger(__name__)
+
+
+class MQTTLifespanMiddleware:
+    """
+    Starts and stops the asyncio ingest engine with the ASGI server.
+
+    The engine starts on lifespan.startup and stops on lifespan.shutdown.
+    Servers without lifespan support (such as Daphne) start it lazily on
+    the first HTTP or WebSocket connection instead. With the thread engine
+    this only acknowledges lifespan events. The message relay, started by
+    the first WebSocket connection, is stopped on lifespan.shutdown too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def get_client(self):
+        from django.conf import settings
+        if not getattr(settings, 'MQTT_AUTOSTART', True):
+            # Ingest runs separately (manage.py mqtt_ingest)
+            return None
+        from .mqtt_client import get_mqtt_client
+        client = get_mqtt_client()
+        return client if client.engine == 'asyncio' else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        client = self.get_client()
+        if client is not None:
+            await client.start()
+        await self.app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    client = self.get_client()
+                    if client is not None:
+                        await client.start()
+                except Exception as e:
+                    logger.error(f"Could not start MQTT client: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                client = self.get_client()
+                if client is not None:
+                    await client.stop()
+                await relay.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
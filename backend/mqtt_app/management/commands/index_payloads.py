@@ -0,0 +1,56 @@
+"""
+Rebuild the payload field index of stored messages after MQTT_PAYLOAD_INDEX_FIELDS changed
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from mqtt_app.filters import topics_matching
+from mqtt_app.json_codec import codec, DecodeError
+from mqtt_app.models import MQTTMessage, MQTTPayloadField, MQTTTopic
+from mqtt_app.payload_index import PayloadIndexer
+from mqtt_app.topics import InvalidTopicFilter
+
+
+class Command(BaseCommand):
+    help = "Index the configured payload fields (MQTT_PAYLOAD_INDEX_FIELDS) of stored messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', help="Only messages of topics matching this MQTT filter")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Messages per transaction (default 1000)")
+
+    def handle(self, *args, topic, batch_size, **options):
+        indexer = PayloadIndexer.from_settings()
+        if not indexer.enabled:
+            raise CommandError("No payload fields are configured in MQTT_PAYLOAD_INDEX_FIELDS")
+        try:
+            topics = MQTTTopic.objects.none()
+            for topic_filter in ([topic] if topic else indexer.fields):
+                topics |= topics_matching(topic_filter)
+        except InvalidTopicFilter as e:
+            raise CommandError(str(e))
+
+        messages = MQTTMessage.objects.filter(topic__in=topics).select_related('topic').order_by('id')
+        last_id = indexed = fields = 0
+        while True:
+            batch = list(messages.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            rows = []
+            for message in batch:
+                try:
+                    payload = codec.loads(message.payload_bytes)
+                except DecodeError:
+                    continue
+                if isinstance(payload, dict):
+                    rows.extend(
+                        MQTTPayloadField(message_id=message.pk, key=key, value=value)
+                        for key, value in indexer.extract(message.topic.name, payload)
+                    )
+            # Replace whatever an earlier configuration indexed for these messages
+            with transaction.atomic():
+                MQTTPayloadField.objects.filter(message__in=[message.pk for message in batch]).delete()
+                MQTTPayloadField.objects.bulk_create(rows)
+            last_id = batch[-1].pk
+            indexed += len(batch)
+            fields += len(rows)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {fields} payload fields of {indexed} messages"))
@@ -0,0 +1,46 @@
+"""
+Run MQTT ingest as its own process group, separate from the web server
+"""
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mqtt_app.partitioned import PartitionedIngest
+
+
+class Command(BaseCommand):
+    help = "Subscribe to the MQTT broker and store/broadcast messages using topic-partitioned worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'MQTT_INGEST_PROCESSES', 2),
+                            help="Worker processes (default MQTT_INGEST_PROCESSES)")
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help="Seconds between statistics lines, 0 to disable (default 60)")
+
+    def handle(self, *args, processes, stats_interval, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        ingest = PartitionedIngest(processes=processes)
+        ingest.connect()
+        self.stdout.write(f"MQTT ingest running with {ingest.process_count} worker processes, Ctrl+C to stop")
+
+        waited = 0
+        while not stop.wait(1):
+            ingest.check_workers()
+            waited += 1
+            if stats_interval and waited >= stats_interval:
+                waited = 0
+                self.stdout.write(self.format_stats(ingest))
+
+        self.stdout.write("Stopping: draining worker queues and flushing buffered writes")
+        ingest.disconnect()
+        self.stdout.write(self.style.SUCCESS(f"MQTT ingest stopped. {self.format_stats(ingest)}"))
+
+    def format_stats(self, ingest):
+        stats = ingest.get_engine_stats()
+        return (
+            f"connected={ingest.is_connected} dispatched={stats['dispatched']} "
+            f"per_worker={stats['dispatched_per_worker']} restarts={stats['restarts']}"
+        )
@@ -0,0 +1,38 @@
+"""
+Train a payload compression dictionary for a topic filter
+"""
+from django.core.management.base import BaseCommand, CommandError
+from mqtt_app.filters import topics_matching
+from mqtt_app.models import MQTTMessage, MQTTPayloadDictionary
+from mqtt_app.payloads import MAX_DICTIONARY_SIZE, train_dictionary
+from mqtt_app.topics import InvalidTopicFilter
+
+
+class Command(BaseCommand):
+    help = "Train a compression dictionary from recent payloads of topics matching a filter"
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_filter', help="MQTT topic filter, e.g. flash/sirens/+/status")
+        parser.add_argument('--samples', type=int, default=2000, help="Recent messages to sample (default 2000)")
+        parser.add_argument('--size', type=int, default=16 * 1024,
+                            help=f"Dictionary size in bytes (default 16384, max {MAX_DICTIONARY_SIZE})")
+
+    def handle(self, *args, topic_filter, samples, size, **options):
+        try:
+            topics = topics_matching(topic_filter)
+        except InvalidTopicFilter as e:
+            raise CommandError(str(e))
+        messages = MQTTMessage.objects.filter(topic__in=topics).order_by('-timestamp', '-id')[:samples]
+        payloads = [message.payload_bytes for message in messages]
+        if not payloads:
+            raise CommandError(f"No stored messages match {topic_filter}")
+
+        dictionary = MQTTPayloadDictionary.objects.create(
+            topic_filter=topic_filter,
+            data=train_dictionary(payloads, size),
+            sample_count=len(payloads),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained dictionary {dictionary.pk} for {topic_filter}: "
+            f"{len(dictionary.data)} bytes from {len(payloads)} payloads"
+        ))
@@ -0,0 +1,300 @@
+"""
+Process-local metrics exposed in the Prometheus text format
+"""
+import bisect
+import threading
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; per-message stages take microseconds, database writes and reconnects much longer
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+RECOVERY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+STAGE_DECODE = 'decode'
+STAGE_JSON_PARSE = 'json_parse'
+STAGE_DB_WRITE = 'db_write'
+STAGE_GROUP_SEND = 'group_send'
+STAGE_WS_SEND = 'ws_send'
+STAGES = (STAGE_DECODE, STAGE_JSON_PARSE, STAGE_DB_WRITE, STAGE_GROUP_SEND, STAGE_WS_SEND)
+
+OTHER_PREFIX = '_other'
+
+# get_status() key -> (metric name, type, help)
+STATUS_METRICS = {
+    'connected': ('mqtt_connected', 'gauge', 'Whether at least one broker connection is up'),
+    'leader': ('mqtt_leader', 'gauge', 'Whether this process holds the ingest leader lock'),
+    'queue_depth': ('mqtt_queue_depth', 'gauge', 'Messages waiting in the ingest queue'),
+    'queue_capacity': ('mqtt_queue_capacity', 'gauge', 'Size of the ingest queue'),
+    'processed': ('mqtt_processed_total', 'counter', 'Messages stored and broadcast'),
+    'dropped': ('mqtt_dropped_total', 'counter', 'Messages dropped because the ingest queue was full'),
+    'failed': ('mqtt_failed_total', 'counter', 'Messages that failed processing'),
+    'dispatched': ('mqtt_dispatched_total', 'counter', 'Messages handed to ingest worker processes'),
+    'restarts': ('mqtt_worker_restarts_total', 'counter', 'Ingest worker processes restarted'),
+    'db_pending': ('mqtt_db_pending', 'gauge', 'Messages waiting for the next database write'),
+    'db_max_pending': ('mqtt_db_max_pending', 'gauge', 'Messages the write buffer holds before overflowing'),
+    'db_flushed': ('mqtt_db_written_total', 'counter', 'Messages written to the database'),
+    'db_failed_flushes': ('mqtt_db_failed_writes_total', 'counter', 'Failed database batch writes'),
+    'db_dropped': ('mqtt_db_dropped_total', 'counter', 'Messages never stored (write buffer full or writes failing)'),
+    'broadcast_pending': ('mqtt_broadcast_pending', 'gauge', 'Messages waiting for the next broadcast batch'),
+    'broadcast_events': ('mqtt_broadcast_events_total', 'counter', 'Channel layer broadcasts sent'),
+    'broadcast_messages': ('mqtt_broadcast_messages_total', 'counter', 'Messages broadcast to WebSocket clients'),
+    'relay_messages': ('mqtt_relay_messages_total', 'counter', 'Broadcast messages received by the relay of this server process'),
+    'subscribed_clients': ('mqtt_subscribed_clients', 'gauge', 'WebSocket clients with topic filters'),
+    'last_value_topics': ('mqtt_last_value_topics', 'gauge', 'Topics in the last-value cache'),
+    'replay_buffered': ('mqtt_replay_buffered', 'gauge', 'Messages in the replay buffer'),
+    'retention_total_deleted': ('mqtt_retention_deleted_total', 'counter', 'Messages deleted by retention'),
+    'rollup_pending': ('mqtt_rollup_pending', 'gauge', 'Rollup buckets waiting to be written'),
+}
+
+# Broker stats key -> (metric name, type, help), labelled by broker
+BROKER_METRICS = {
+    'connected': ('mqtt_broker_connected', 'gauge', 'Whether the broker connection is up'),
+    'session_present': ('mqtt_broker_session_present', 'gauge', 'Whether the broker resumed the persistent session'),
+    'received': ('mqtt_broker_received_total', 'counter', 'Messages received from the broker'),
+    'duplicates': ('mqtt_broker_duplicates_total', 'counter', 'QoS 1 redeliveries dropped'),
+    'connects': ('mqtt_broker_connects_total', 'counter', 'Successful connects'),
+    'disconnects': ('mqtt_broker_disconnects_total', 'counter', 'Unexpected connection losses'),
+    'last_recovery_seconds': ('mqtt_broker_last_recovery_seconds', 'gauge', 'Time from the last connection loss to reconnecting'),
+}
+
+
+class ShardedMetric:
+    """
+    Base for metrics recorded without locks.
+
+    Every thread updates its own shard, so increments never race and need no
+    lock; collecting adds the shards up. The lock is only taken the first
+    time a thread records.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def new_shard(self):
+        raise NotImplementedError
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self.new_shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def shards(self):
+        with self._lock:
+            return list(self._shards)
+
+
+class Counter(ShardedMetric):
+    """Monotonic count"""
+
+    def new_shard(self):
+        return [0]
+
+    def inc(self, amount=1):
+        self.shard()[0] += amount
+
+    @property
+    def value(self):
+        return sum(shard[0] for shard in self.shards())
+
+
+class Histogram(ShardedMetric):
+    """Observations counted into fixed buckets, plus their sum"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        super().__init__()
+        self.buckets = tuple(buckets)
+
+    def new_shard(self):
+        # One count per bucket, one for +Inf, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value):
+        shard = self.shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def collect(self):
+        """Return (cumulative bucket counts including +Inf, sum)"""
+        totals = [0] * (len(self.buckets) + 2)
+        for shard in self.shards():
+            for index, value in enumerate(shard):
+                totals[index] += value
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+class PrefixCounter(ShardedMetric):
+    """
+    Messages counted per topic prefix (the first `levels` topic levels).
+
+    Prefixes are cached per topic so counting a known topic builds no new
+    strings. Beyond max_prefixes distinct prefixes, new ones are counted
+    under OTHER_PREFIX to bound the number of series.
+    """
+
+    def __init__(self, levels=1, max_prefixes=100, max_topics=10000):
+        super().__init__()
+        self.levels = max(1, int(levels))
+        self.max_prefixes = max(1, int(max_prefixes))
+        self.max_topics = max_topics
+        self._prefixes = {}
+        self._known = set()
+
+    def new_shard(self):
+        return {}
+
+    def prefix_of(self, topic):
+        prefix = '/'.join(topic.split('/')[:self.levels])
+        if prefix not in self._known:
+            if len(self._known) >= self.max_prefixes:
+                prefix = OTHER_PREFIX
+            else:
+                self._known.add(prefix)
+        if len(self._prefixes) < self.max_topics:
+            self._prefixes[topic] = prefix
+        return prefix
+
+    def inc(self, topic):
+        prefix = self._prefixes.get(topic)
+        if prefix is None:
+            prefix = self.prefix_of(topic)
+        shard = self.shard()
+        shard[prefix] = shard.get(prefix, 0) + 1
+
+    def collect(self):
+        """Return {prefix: count}"""
+        totals = {}
+        for shard in self.shards():
+            # dict() copies in one step, so a writer adding a prefix cannot break the iteration
+            for prefix, count in dict(shard).items():
+                totals[prefix] = totals.get(prefix, 0) + count
+        return totals
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+
+
+def format_value(value):
+    return repr(value) if isinstance(value, float) else str(int(value))
+
+
+class MetricsRegistry:
+    """Metrics recorded by this process, and their rendering for a /metrics scrape"""
+
+    def __init__(self, topic_levels=1, max_prefixes=100):
+        self.received = PrefixCounter(levels=topic_levels, max_prefixes=max_prefixes)
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.broker_recovery = Histogram(RECOVERY_BUCKETS)
+        # Send queues of open WebSocket connections by channel name
+        self.websocket_queues = {}
+        # Frames lost by connections that have since closed; open ones are added when rendering
+        self.websocket_dropped = Counter()
+        self.websocket_conflated = Counter()
+        self.websocket_slow_disconnects = Counter()
+
+    def add_connection(self, channel_name, send_queue):
+        """Track an open WebSocket connection's send queue"""
+        self.websocket_queues[channel_name] = send_queue
+
+    def remove_connection(self, channel_name):
+        """Stop tracking a closed connection, keeping its drop counts"""
+        send_queue = self.websocket_queues.pop(channel_name, None)
+        if send_queue is not None:
+            self.websocket_dropped.inc(send_queue.dropped_count)
+            self.websocket_conflated.inc(send_queue.conflated_count)
+
+    def observe(self, stage, seconds):
+        """Record how long one pass through a pipeline stage took"""
+        self.stages[stage].observe(seconds)
+
+    def render(self, status=None):
+        """The metrics, plus the numbers in an ingest engine's get_status(), as Prometheus text"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def sample(name, value, labels=None):
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+
+        def histogram(name, metric, labels=None):
+            counts, total = metric.collect()
+            for bound, count in zip(metric.buckets + ('+Inf',), counts):
+                sample(f'{name}_bucket', count, {**(labels or {}), 'le': bound if bound == '+Inf' else repr(bound)})
+            sample(f'{name}_sum', total, labels)
+            sample(f'{name}_count', counts[-1], labels)
+
+        family('mqtt_messages_received_total', 'counter', 'Messages ingested, by topic prefix')
+        for prefix, count in sorted(self.received.collect().items()):
+            sample('mqtt_messages_received_total', count, {'prefix': prefix})
+
+        family('mqtt_stage_duration_seconds', 'histogram',
+               'Time spent per message in each pipeline stage (db_write: per batch)')
+        for stage in STAGES:
+            histogram('mqtt_stage_duration_seconds', self.stages[stage], {'stage': stage})
+
+        queues = list(self.websocket_queues.items())
+        family('mqtt_websocket_connections', 'gauge', 'Open WebSocket connections')
+        sample('mqtt_websocket_connections', len(queues))
+        # Aggregated over connections: a label per connection would grow without bound
+        family('mqtt_websocket_max_lag_seconds', 'gauge', 'Age of the oldest frame waiting to be sent on any connection')
+        sample('mqtt_websocket_max_lag_seconds', max((q.lag() for _, q in queues), default=0))
+        family('mqtt_websocket_send_queue_depth', 'gauge', 'Frames waiting to be sent, over all connections')
+        sample('mqtt_websocket_send_queue_depth', sum(len(q) for _, q in queues))
+        family('mqtt_websocket_max_send_queue_depth', 'gauge', 'Frames waiting to be sent on the most backed-up connection')
+        sample('mqtt_websocket_max_send_queue_depth', max((len(q) for _, q in queues), default=0))
+        family('mqtt_websocket_dropped_frames_total', 'counter', 'Frames dropped for slow WebSocket clients')
+        sample('mqtt_websocket_dropped_frames_total',
+               self.websocket_dropped.value + sum(q.dropped_count for _, q in queues))
+        family('mqtt_websocket_conflated_frames_total', 'counter', 'Frames replaced by a newer value of their topic')
+        sample('mqtt_websocket_conflated_frames_total',
+               self.websocket_conflated.value + sum(q.conflated_count for _, q in queues))
+        family('mqtt_websocket_slow_disconnects_total', 'counter', 'WebSocket clients disconnected for lagging')
+        sample('mqtt_websocket_slow_disconnects_total', self.websocket_slow_disconnects.value)
+
+        family('mqtt_broker_recovery_seconds', 'histogram', 'Time from losing a broker connection to reconnecting')
+        histogram('mqtt_broker_recovery_seconds', self.broker_recovery)
+
+        status = status or {}
+        for key, (name, kind, help_text) in STATUS_METRICS.items():
+            if status.get(key) is not None:
+                family(name, kind, help_text)
+                sample(name, status[key])
+
+        brokers = status.get('brokers') or []
+        for key, (name, kind, help_text) in BROKER_METRICS.items():
+            values = [(broker, broker.get(key)) for broker in brokers if broker.get(key) is not None]
+            if values:
+                family(name, kind, help_text)
+                for broker, value in values:
+                    sample(name, value, {'broker': f"{broker['broker_host']}:{broker['broker_port']}"})
+
+        lines.append('')
+        return '\n'.join(lines)
+
+
+# Process-wide registry written by ingest and consumers and read by the metrics view
+metrics = MetricsRegistry(
+    topic_levels=getattr(settings, 'MQTT_METRICS_TOPIC_LEVELS', 1),
+    max_prefixes=getattr(settings, 'MQTT_METRICS_MAX_PREFIXES', 100),
+)
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MQTTConfig',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('broker_host', models.CharField(max_length=255)),
+                ('broker_port', models.IntegerField(default=1883)),
+                ('username', models.CharField(blank=True, max_length=255)),
+                ('topics', models.CharField(help_text='Comma-separated topics', max_length=1000)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'MQTT Configuration',
+                'verbose_name_plural': 'MQTT Configurations',
+            },
+        ),
+        migrations.CreateModel(
+            name='MQTTMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                ('qos', models.IntegerField(default=0)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['-timestamp'], name='mqtt_app_mq_timesta_ceecfc_idx'), models.Index(fields=['topic'], name='mqtt_app_mq_topic_096633_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    Add the topic table, binary payloads and the other new tables.
+
+    Messages get a nullable topic_ref and payload_data next to the old text
+    topic and payload; 0003 fills them in and 0004 drops the text columns.
+    """
+
+    dependencies = [
+        ('mqtt_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MQTTTopic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'MQTT Topic',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MQTTPayloadDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic_filter', models.CharField(max_length=255)),
+                ('data', models.BinaryField()),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'MQTT Payload Dictionary',
+                'verbose_name_plural': 'MQTT Payload Dictionaries',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='mqttmessage',
+            name='topic_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mqtt_app.mqtttopic'),
+        ),
+        migrations.AddField(
+            model_name='mqttmessage',
+            name='payload_data',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='mqttmessage',
+            name='compression',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'None'), (1, 'zlib')], default=0),
+        ),
+        migrations.AddField(
+            model_name='mqttmessage',
+            name='dictionary',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='mqtt_app.mqttpayloaddictionary'),
+        ),
+        migrations.AddField(
+            model_name='mqttconfig',
+            name='client_id',
+            field=models.CharField(blank=True, help_text='Stable client ID for a persistent session (generated when blank)', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mqttconfig',
+            name='password',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mqttconfig',
+            name='tls_insecure',
+            field=models.BooleanField(default=False, help_text='Skip certificate verification (development only)'),
+        ),
+        migrations.AddField(
+            model_name='mqttconfig',
+            name='use_tls',
+            field=models.BooleanField(default=False, help_text='Always enabled on port 8883'),
+        ),
+        # Nullable, so migrating back can re-add them empty before 0003 refills them
+        migrations.AlterField(
+            model_name='mqttmessage',
+            name='topic',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mqttmessage',
+            name='payload',
+            field=models.TextField(null=True),
+        ),
+    ]
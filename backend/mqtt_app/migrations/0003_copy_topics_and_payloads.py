@@ -0,0 +1,58 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def copy_forwards(apps, schema_editor):
+    """Create a topic row per distinct topic string and store text payloads as UTF-8 bytes"""
+    MQTTMessage = apps.get_model('mqtt_app', 'MQTTMessage')
+    MQTTTopic = apps.get_model('mqtt_app', 'MQTTTopic')
+
+    names = MQTTMessage.objects.order_by().values_list('topic', flat=True).distinct()
+    MQTTTopic.objects.bulk_create([MQTTTopic(name=name) for name in names], ignore_conflicts=True)
+    for topic in MQTTTopic.objects.all().iterator():
+        MQTTMessage.objects.filter(topic=topic.name).update(topic_ref=topic)
+
+    last_id = 0
+    while True:
+        batch = list(MQTTMessage.objects.filter(id__gt=last_id).order_by('id').only('id', 'payload')[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            message.payload_data = message.payload.encode('utf-8')
+        MQTTMessage.objects.bulk_update(batch, ['payload_data'])
+        last_id = batch[-1].id
+
+
+def copy_backwards(apps, schema_editor):
+    """Restore the text topic and payload columns"""
+    MQTTMessage = apps.get_model('mqtt_app', 'MQTTMessage')
+    MQTTTopic = apps.get_model('mqtt_app', 'MQTTTopic')
+
+    # Compressed payloads, stored after this migration, cannot be turned back into text here
+    if MQTTMessage.objects.exclude(compression=0).exists():
+        raise RuntimeError("Compressed MQTT payloads cannot be migrated back; clear the message history first")
+
+    for topic in MQTTTopic.objects.all().iterator():
+        MQTTMessage.objects.filter(topic_ref=topic).update(topic=topic.name)
+
+    last_id = 0
+    while True:
+        batch = list(MQTTMessage.objects.filter(id__gt=last_id).order_by('id').only('id', 'payload_data')[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            message.payload = bytes(message.payload_data).decode('utf-8', errors='replace')
+        MQTTMessage.objects.bulk_update(batch, ['payload'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt_app', '0002_mqtttopic_payload_data'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_forwards, copy_backwards),
+    ]
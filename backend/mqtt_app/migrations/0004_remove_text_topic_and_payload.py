@@ -0,0 +1,93 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    """Drop the text topic and payload columns copied by 0003 and add the new indexes and tables"""
+
+    dependencies = [
+        ('mqtt_app', '0003_copy_topics_and_payloads'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mqttmessage',
+            name='mqtt_app_mq_topic_096633_idx',
+        ),
+        migrations.RemoveField(
+            model_name='mqttmessage',
+            name='topic',
+        ),
+        migrations.RemoveField(
+            model_name='mqttmessage',
+            name='payload',
+        ),
+        migrations.RenameField(
+            model_name='mqttmessage',
+            old_name='topic_ref',
+            new_name='topic',
+        ),
+        migrations.AlterField(
+            model_name='mqttmessage',
+            name='topic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='mqtt_app.mqtttopic'),
+        ),
+        migrations.AlterField(
+            model_name='mqttmessage',
+            name='payload_data',
+            field=models.BinaryField(),
+        ),
+        migrations.AlterField(
+            model_name='mqttmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterModelOptions(
+            name='mqttmessage',
+            options={'ordering': ['-timestamp', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='mqttmessage',
+            index=models.Index(fields=['-timestamp', '-id'], name='mqtt_app_mq_timesta_847bf5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mqttmessage',
+            index=models.Index(fields=['topic', '-timestamp', '-id'], name='mqtt_app_mq_topic_i_83f50a_idx'),
+        ),
+        migrations.CreateModel(
+            name='MQTTPayloadField',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Dot-separated path in the JSON payload', max_length=255)),
+                ('value', models.CharField(help_text='Strings as-is, other scalars as JSON text', max_length=255)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='payload_fields', to='mqtt_app.mqttmessage')),
+            ],
+            options={
+                'verbose_name': 'MQTT Payload Field',
+                'indexes': [models.Index(fields=['key', 'value', 'message'], name='mqtt_app_mq_key_7a0411_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MQTTRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(help_text='Dot-separated path in the JSON payload', max_length=255)),
+                ('resolution', models.PositiveIntegerField(help_text='Bucket size in seconds')),
+                ('bucket', models.DateTimeField(help_text='Start of the bucket')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('last', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='mqtt_app.mqtttopic')),
+            ],
+            options={
+                'ordering': ['topic', 'field', 'resolution', 'bucket'],
+                'constraints': [models.UniqueConstraint(fields=('topic', 'field', 'resolution', 'bucket'), name='unique_rollup_bucket')],
+            },
+        ),
+    ]
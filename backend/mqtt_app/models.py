@@ -1,29 +1,160 @@
 from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .payloads import COMPRESSION_CHOICES, COMPRESSION_NONE, payload_codec, to_text
+
+
+class MQTTTopicManager(models.Manager):
+    """Resolves topic names to IDs, caching them for the life of the process"""
+    
+    _ids = {}
+    
+    def get_ids(self, names):
+        """Return {name: id} for names, creating missing topics"""
+        names = set(names)
+        missing = [name for name in names if name not in self._ids]
+        if missing:
+            self.bulk_create([self.model(name=name) for name in missing], ignore_conflicts=True)
+            self._ids.update(self.filter(name__in=missing).values_list('name', 'id'))
+        return {name: self._ids[name] for name in names}
+
+
+class MQTTTopic(models.Model):
+    """Distinct MQTT topic names, referenced by messages instead of repeating the string"""
+    name = models.CharField(max_length=255, unique=True)
+    
+    objects = MQTTTopicManager()
+    
+    class Meta:
+        ordering = ['name']
+        verbose_name = "MQTT Topic"
+    
+    def __str__(self):
+        return self.name
+
+
+class MQTTPayloadDictionary(models.Model):
+    """Preset compression dictionary trained on the payloads of a topic filter"""
+    topic_filter = models.CharField(max_length=255)
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-id']
+        verbose_name = "MQTT Payload Dictionary"
+        verbose_name_plural = "MQTT Payload Dictionaries"
+    
+    def __str__(self):
+        return f"{self.topic_filter} ({len(self.data)} bytes)"
 
 
 class MQTTMessage(models.Model):
     """Model to store MQTT messages (optional - for history)"""
-    topic = models.CharField(max_length=255)
-    payload = models.TextField()
+    topic = models.ForeignKey(MQTTTopic, on_delete=models.PROTECT, related_name='messages')
+    # Raw payload bytes, possibly compressed; use payload / payload_bytes to read
+    payload_data = models.BinaryField()
+    compression = models.PositiveSmallIntegerField(choices=COMPRESSION_CHOICES, default=COMPRESSION_NONE)
+    dictionary = models.ForeignKey(
+        MQTTPayloadDictionary, on_delete=models.PROTECT, null=True, blank=True,
+        related_name='messages', db_index=False,
+    )
     qos = models.IntegerField(default=0)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
         indexes = [
             models.Index(fields=['-timestamp']),
-            models.Index(fields=['topic']),
+            models.Index(fields=['-timestamp', '-id']),
+            models.Index(fields=['topic', '-timestamp', '-id']),
         ]
     
+    @cached_property
+    def payload_bytes(self):
+        """The original payload bytes"""
+        return payload_codec.decode(self.payload_data, self.compression, self.dictionary_id)
+    
+    @property
+    def payload(self):
+        """The payload as text (base64 when it is not valid UTF-8)"""
+        return to_text(self.payload_bytes)[0]
+    
+    @payload.setter
+    def payload(self, value):
+        # Stored uncompressed; ingest compresses through payload_codec instead
+        self.payload_data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+        self.compression = COMPRESSION_NONE
+        self.dictionary = None
+        self.__dict__.pop('payload_bytes', None)
+    
+    @property
+    def payload_encoding(self):
+        """None for UTF-8 text payloads, 'base64' for binary ones"""
+        return to_text(self.payload_bytes)[1]
+    
     def __str__(self):
         return f"{self.topic}: {self.payload[:50]}"
 
 
+class MQTTPayloadField(models.Model):
+    """Value of a JSON payload field configured in MQTT_PAYLOAD_INDEX_FIELDS, indexed for history filters"""
+    # No cascade: delete_in_chunks removes these first, keeping message deletes a single fast query
+    message = models.ForeignKey(MQTTMessage, on_delete=models.DO_NOTHING, related_name='payload_fields')
+    key = models.CharField(max_length=255, help_text="Dot-separated path in the JSON payload")
+    value = models.CharField(max_length=255, help_text="Strings as-is, other scalars as JSON text")
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'value', 'message']),
+        ]
+        verbose_name = "MQTT Payload Field"
+    
+    def __str__(self):
+        return f"{self.message_id}: {self.key}={self.value}"
+
+
+class MQTTRollup(models.Model):
+    """Aggregate of one numeric payload field of a topic over a time bucket"""
+    RESOLUTIONS = {'1s': 1, '1m': 60, '1h': 3600}
+    
+    topic = models.ForeignKey(MQTTTopic, on_delete=models.CASCADE, related_name='rollups')
+    field = models.CharField(max_length=255, help_text="Dot-separated path in the JSON payload")
+    resolution = models.PositiveIntegerField(help_text="Bucket size in seconds")
+    bucket = models.DateTimeField(help_text="Start of the bucket")
+    count = models.PositiveIntegerField(default=0)
+    sum = models.FloatField(default=0)
+    min = models.FloatField()
+    max = models.FloatField()
+    last = models.FloatField()
+    last_timestamp = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['topic', 'field', 'resolution', 'bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['topic', 'field', 'resolution', 'bucket'],
+                name='unique_rollup_bucket',
+            ),
+        ]
+    
+    @property
+    def avg(self):
+        return self.sum / self.count if self.count else None
+    
+    def __str__(self):
+        return f"{self.topic_id}/{self.field} @ {self.bucket} ({self.resolution}s)"
+
+
 class MQTTConfig(models.Model):
     """Model to store MQTT configuration"""
     broker_host = models.CharField(max_length=255)
     broker_port = models.IntegerField(default=1883)
     username = models.CharField(max_length=255, blank=True)
+    password = models.CharField(max_length=255, blank=True)
+    use_tls = models.BooleanField(default=False, help_text="Always enabled on port 8883")
+    tls_insecure = models.BooleanField(default=False, help_text="Skip certificate verification (development only)")
+    client_id = models.CharField(max_length=255, blank=True, help_text="Stable client ID for a persistent session (generated when blank)")
     topics = models.CharField(max_length=1000, help_text="Comma-separated topics")
     is_active = models.BooleanField(default=True)
     updated_at = models.DateTimeField(auto_now=True)
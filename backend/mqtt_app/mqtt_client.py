@@ -1,13 +1,28 @@
 """
 MQTT Client for subscribing to ControlByWeb MQTT broker
 """
-import paho.mqtt.client as mqtt
-import json
+import base64
+import os
+import tempfile
+import threading
+import time
 import logging
 from django.conf import settings
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import MQTTMessage
+from django.utils import timezone
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from .broadcast import Broadcaster, encode_message_data
+from .brokers import BrokerConnection, BrokerManager
+from .coordination import INGEST_LEADER, INGEST_MODES, INGEST_SHARED, INGEST_SINGLE, LeaderLock, acquire_slot
+from .json_codec import codec, DecodeError
+from .last_values import last_values
+from .metrics import metrics, STAGE_DECODE, STAGE_JSON_PARSE
+from .payload_index import PayloadIndexer
+from .relay import relay
+from .replay import replay_buffer
+from .retention import RetentionPolicy, RetentionWorker
+from .rollups import RollupAggregator
+from .persistence import MessageWriteBuffer
+from .pipeline import MessagePipeline
 
 logger = logging.getLogger(__name__)
 
@@ -15,155 +30,298 @@ logger = logging.getLogger(__name__)
 mqtt_client_instance = None
 
 class MQTTClient:
+    """Ingest engine running paho's network loop and a worker pool on threads"""
+    engine = 'thread'
+    
+    connection_class = BrokerConnection
+    
     def __init__(self):
-        self.client = None
-        self.is_connected = False
         self.channel_layer = get_channel_layer()
-        
-    def on_connect(self, client, userdata, flags, rc):
-        """Callback when MQTT client connects"""
-        if rc == 0:
-            self.is_connected = True
-            logger.info("MQTT Client connected successfully")
-            
-            # Subscribe to topics
-            topics = getattr(settings, 'MQTT_TOPICS', ['#'])
-            for topic in topics:
-                topic = topic.strip()
-                if topic:
-                    client.subscribe(topic)
-                    logger.info(f"Subscribed to topic: {topic}")
-        else:
-            self.is_connected = False
-            logger.error(f"MQTT Connection failed with code {rc}")
-    
-    def on_disconnect(self, client, userdata, rc):
-        """Callback when MQTT client disconnects"""
-        self.is_connected = False
-        logger.warning("MQTT Client disconnected")
+        self.write_buffer = MessageWriteBuffer(
+            batch_size=getattr(settings, 'MQTT_DB_BATCH_SIZE', 200),
+            flush_interval=getattr(settings, 'MQTT_DB_FLUSH_INTERVAL', 1.0),
+            max_pending=getattr(settings, 'MQTT_DB_MAX_PENDING', 100000),
+            overflow=getattr(settings, 'MQTT_DB_OVERFLOW', 'drop_oldest'),
+            max_retries=getattr(settings, 'MQTT_DB_MAX_RETRIES', 3),
+        )
+        self.broadcaster = Broadcaster(
+            self.channel_layer,
+            batching=getattr(settings, 'MQTT_BROADCAST_BATCHING', False),
+            window=getattr(settings, 'MQTT_BROADCAST_WINDOW_MS', 25) / 1000,
+            batch_size=getattr(settings, 'MQTT_BROADCAST_BATCH_SIZE', 100),
+        )
+        self.retention = RetentionWorker(
+            RetentionPolicy.from_settings(),
+            interval=getattr(settings, 'MQTT_RETENTION_INTERVAL', 300),
+        )
+        self.payload_index = PayloadIndexer.from_settings()
+        self.payload_index.check_database()
+        self.rollups = RollupAggregator(
+            fields=getattr(settings, 'MQTT_ROLLUP_FIELDS', {}),
+            flush_interval=getattr(settings, 'MQTT_ROLLUP_FLUSH_INTERVAL', 1.0),
+        )
+        self.pipeline = MessagePipeline(
+            self.process_message,
+            workers=getattr(settings, 'MQTT_WORKERS', 2),
+            max_size=getattr(settings, 'MQTT_QUEUE_SIZE', 10000),
+            overflow=getattr(settings, 'MQTT_QUEUE_OVERFLOW', 'block'),
+        )
+        self.ingest_mode = getattr(settings, 'MQTT_INGEST_MODE', INGEST_SINGLE)
+        if self.ingest_mode not in INGEST_MODES:
+            raise ValueError(
+                f"Unknown ingest mode '{self.ingest_mode}', expected one of {', '.join(INGEST_MODES)}"
+            )
+        if self.ingest_mode != INGEST_SINGLE and isinstance(self.channel_layer, InMemoryChannelLayer):
+            # Each process would only relay what it ingested itself to its own clients
+            logger.warning(
+                f"MQTT_INGEST_MODE={self.ingest_mode} needs a channel layer shared by all processes (Redis), "
+                f"the in-memory layer only reaches this process's WebSocket clients"
+            )
+        self.shared_group = getattr(settings, 'MQTT_SHARED_GROUP', 'mqtt-websocket')
+        # Slot number of this process in shared mode, part of its stable client IDs
+        self.shared_slot = None
+        self.slot_lock = None
+        self.leader_lock = None
+        if self.ingest_mode == INGEST_LEADER:
+            self.leader_lock = LeaderLock(getattr(
+                settings, 'MQTT_LEADER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'mqtt-ingest.lock')
+            ))
+        self.leader_retry_interval = float(getattr(settings, 'MQTT_LEADER_RETRY_INTERVAL', 5))
+        self._follower = None
+        self._stop_following = threading.Event()
+        self.brokers = BrokerManager(
+            self, self.connection_class,
+            reload_interval=getattr(settings, 'MQTT_CONFIG_RELOAD_INTERVAL', 10),
+        )
+    
+    @property
+    def is_connected(self):
+        """Whether at least one broker connection is up"""
+        return self.brokers.is_connected
     
     def on_message(self, client, userdata, msg):
-        """Callback when MQTT message is received"""
+        """Callback when MQTT message is received - hand off to the worker pool"""
+        self.pipeline.submit(msg)
+    
+    def process_message(self, msg):
+        """Decode, store and broadcast a received message (runs on a worker thread)"""
+        self.broadcaster.publish(*self.ingest(msg))
+    
+    def ingest(self, msg):
+        """Decode and store a received message; return (topic, data, raw binary payload) to broadcast"""
+        received_at = timezone.now()
+        topic = msg.topic
+        qos = msg.qos
+        metrics.received.inc(topic)
+        
+        # Binary payloads are stored as-is and sent to clients base64 encoded
+        started = time.perf_counter()
         try:
-            topic = msg.topic
             payload = msg.payload.decode('utf-8')
-            qos = msg.qos
-            
-            logger.info(f"Received MQTT message - Topic: {topic}, Payload: {payload}")
-            
-            # Try to parse payload as JSON
-            try:
-                payload_json = json.loads(payload)
-            except json.JSONDecodeError:
-                payload_json = payload
-            
-            # Prepare message data
-            message_data = {
-                'topic': topic,
-                'payload': payload_json if isinstance(payload_json, dict) else payload,
-                'qos': qos,
-                'timestamp': None,  # Will be set on frontend
-            }
-            
-            # Store message in database (optional)
+            payload_encoding = None
+        except UnicodeDecodeError:
+            payload = base64.b64encode(msg.payload).decode('ascii')
+            payload_encoding = 'base64'
+        decoded = time.perf_counter()
+        metrics.observe(STAGE_DECODE, decoded - started)
+        
+        # Lazy formatting: this runs for every message
+        logger.debug("Received MQTT message - Topic: %s, Payload: %s", topic, payload)
+        
+        # Try to parse payload as JSON
+        payload_json = payload
+        if payload_encoding is None:
             try:
-                MQTTMessage.objects.create(
-                    topic=topic,
-                    payload=payload if isinstance(payload, str) else json.dumps(payload_json),
-                    qos=qos
-                )
-            except Exception as e:
-                logger.error(f"Error saving message to database: {e}")
-            
-            # Broadcast message to WebSocket clients
-            async_to_sync(self.channel_layer.group_send)(
-                'mqtt_messages',
-                {
-                    'type': 'mqtt_message',
-                    'message': message_data
-                }
-            )
-            
-        except Exception as e:
-            logger.error(f"Error processing MQTT message: {e}")
+                payload_json = codec.loads(msg.payload)
+            except DecodeError:
+                pass
+            metrics.observe(STAGE_JSON_PARSE, time.perf_counter() - decoded)
+        
+        # Queue message for batched database write (optional), with its indexed payload fields
+        fields = ()
+        if isinstance(payload_json, dict) and self.payload_index.enabled:
+            fields = self.payload_index.extract(topic, payload_json)
+        self.write_buffer.add(topic=topic, payload=msg.payload, qos=qos, timestamp=received_at, fields=fields)
+        
+        # Fold configured numeric fields into the time-bucket rollups
+        if isinstance(payload_json, dict) and self.rollups.enabled:
+            self.rollups.add(topic, payload_json, received_at)
+        
+        # Encode once for WebSocket clients; JSON objects are forwarded as received.
+        # Each server process's relay adds its own sequence number and caches the value.
+        return topic, encode_message_data(
+            topic, payload, qos,
+            payload_is_json=isinstance(payload_json, dict),
+            payload_encoding=payload_encoding,
+            timestamp=received_at,
+        ), msg.payload if payload_encoding else None
+    
+    def start_services(self):
+        """Start the background writers shared by both ingest engines"""
+        self.write_buffer.start()
+        self.rollups.start()
+        self.retention.start()
     
-    def on_log(self, client, userdata, level, buf):
-        """Callback for MQTT logging"""
-        logger.debug(f"MQTT Log: {buf}")
+    def stop_services(self):
+        """Flush and stop the background writers"""
+        self.write_buffer.stop()
+        self.rollups.stop()
+        self.retention.stop()
+    
+    def start_processing(self):
+        """Start everything that handles received messages"""
+        self.start_services()
+        self.broadcaster.start()
+        self.pipeline.start()
+    
+    def stop_processing(self):
+        """Drain the queue and flush whatever is still buffered before shutting down"""
+        self.pipeline.stop()
+        self.broadcaster.stop()
+        self.stop_services()
+    
+    def acquire_leadership(self):
+        """Return whether this process may ingest: always, unless another process holds the leader lock"""
+        if self.leader_lock is None or self.leader_lock.acquire():
+            return True
+        logger.info(f"Another process holds the MQTT leader lock, standing by (retrying every {self.leader_retry_interval}s)")
+        return False
+    
+    def acquire_shared_slot(self):
+        """In shared mode, lock the slot number that keeps this process's client IDs stable across restarts"""
+        if self.ingest_mode != INGEST_SHARED or self.slot_lock is not None:
+            return
+        prefix = getattr(settings, 'MQTT_SHARED_SLOT_LOCK', os.path.join(tempfile.gettempdir(), 'mqtt-ingest-slot'))
+        try:
+            self.shared_slot, self.slot_lock = acquire_slot(prefix)
+        except ValueError as e:
+            logger.warning(f"{e}, shared subscriptions use clean sessions")
+    
+    def release_shared_slot(self):
+        """Free the shared mode slot for the process replacing this one"""
+        if self.slot_lock is not None:
+            self.slot_lock.release()
+            self.slot_lock = None
+            self.shared_slot = None
+    
+    def _follow(self):
+        """Wait for the leader to go away, then take over"""
+        while not self._stop_following.wait(self.leader_retry_interval):
+            if self.leader_lock.acquire():
+                self.connect()
+                return
     
     def connect(self):
         """Connect to MQTT broker"""
+        if not self.acquire_leadership():
+            self._stop_following.clear()
+            self._follower = threading.Thread(target=self._follow, name='mqtt-follower', daemon=True)
+            self._follower.start()
+            return
         try:
-            self.client = mqtt.Client()
-            
-            # Set callbacks
-            self.client.on_connect = self.on_connect
-            self.client.on_disconnect = self.on_disconnect
-            self.client.on_message = self.on_message
-            self.client.on_log = self.on_log
-            
-            # Set credentials if provided
-            username = getattr(settings, 'MQTT_USERNAME', '')
-            password = getattr(settings, 'MQTT_PASSWORD', '')
-            if username:
-                self.client.username_pw_set(username, password)
-            
-            # Get connection settings
-            broker_host = getattr(settings, 'MQTT_BROKER_HOST', 'localhost')
-            broker_port = getattr(settings, 'MQTT_BROKER_PORT', 1883)
-            keepalive = getattr(settings, 'MQTT_KEEPALIVE', 60)
-            use_tls = getattr(settings, 'MQTT_USE_TLS', False)
-            tls_insecure = getattr(settings, 'MQTT_TLS_INSECURE', False)
-            
-            # Enable TLS if configured or if port is 8883 (standard TLS port)
-            if use_tls or broker_port == 8883:
-                logger.info(f"Configuring TLS for MQTT connection")
-                # Configure TLS
-                # For HiveMQ Cloud and most cloud MQTT brokers
-                if tls_insecure:
-                    # Development mode: disable certificate verification
-                    self.client.tls_set()
-                    self.client.tls_insecure_set(True)
-                    logger.warning("TLS certificate verification is disabled (development mode)")
-                else:
-                    # Production mode: use default CA certificates
-                    self.client.tls_set_context(ssl.create_default_context(ssl.Purpose.SERVER_AUTH))
-                    logger.info("TLS with certificate verification enabled")
-            
-            logger.info(f"Connecting to MQTT broker: {broker_host}:{broker_port} (TLS: {use_tls or broker_port == 8883})")
-            self.client.connect(broker_host, broker_port, keepalive)
-            
-            # Start the loop in a non-blocking way
-            self.client.loop_start()
-            
+            self.acquire_shared_slot()
+            self.start_processing()
+            # One connection per active MQTTConfig, opened and kept in sync in the background
+            self.brokers.start()
         except Exception as e:
             logger.error(f"Error connecting to MQTT broker: {e}")
-            self.is_connected = False
+    
+    def request_broker_reload(self):
+        """Re-read the broker configurations (called when they change)"""
+        self.brokers.request_reload()
     
     def disconnect(self):
         """Disconnect from MQTT broker"""
-        if self.client:
-            self.client.loop_stop()
-            self.client.disconnect()
-            self.is_connected = False
-            logger.info("MQTT Client disconnected")
+        if self._follower is not None:
+            self._stop_following.set()
+            if self._follower is not threading.current_thread():
+                self._follower.join()
+            self._follower = None
+        self.brokers.stop()
+        logger.info("MQTT Client disconnected")
+        self.stop_processing()
+        self.release_shared_slot()
+        if self.leader_lock is not None:
+            self.leader_lock.release()
+    
+    def get_engine_stats(self):
+        """Queue and worker statistics of the ingest engine"""
+        return self.pipeline.get_stats()
     
     def get_status(self):
         """Get connection status"""
-        return {
-            'connected': self.is_connected,
+        brokers = self.brokers.get_stats()
+        # Top-level broker fields describe the first connection
+        primary = brokers[0] if brokers else {
             'broker_host': getattr(settings, 'MQTT_BROKER_HOST', ''),
             'broker_port': getattr(settings, 'MQTT_BROKER_PORT', 1883),
             'topics': getattr(settings, 'MQTT_TOPICS', []),
         }
+        return {
+            'connected': self.is_connected,
+            'engine': self.engine,
+            'ingest_mode': self.ingest_mode,
+            'leader': self.leader_lock.held if self.leader_lock is not None else None,
+            'broker_host': primary['broker_host'],
+            'broker_port': primary['broker_port'],
+            'topics': primary['topics'],
+            'brokers': brokers,
+            **self.write_buffer.get_stats(),
+            **self.get_engine_stats(),
+            **self.broadcaster.get_stats(),
+            **relay.get_stats(),
+            **last_values.get_stats(),
+            **replay_buffer.get_stats(),
+            **self.retention.get_stats(),
+            **self.rollups.get_stats(),
+        }
+
+def create_mqtt_client():
+    """Create the ingest engine selected by MQTT_ENGINE"""
+    engine = getattr(settings, 'MQTT_ENGINE', 'thread')
+    if engine == 'asyncio':
+        from .async_client import AsyncMQTTClient
+        return AsyncMQTTClient()
+    if engine != 'thread':
+        raise ValueError(f"Unknown MQTT engine '{engine}', expected 'thread' or 'asyncio'")
+    return MQTTClient()
 
-# Global instance
-_mqtt_client = MQTTClient()
+# Global instance, created on first use so the engine modules can import this one
+_mqtt_client = None
+_mqtt_client_lock = threading.Lock()
 
-def get_mqtt_client():
-    """Get the global MQTT client instance"""
+def get_mqtt_client(create=True):
+    """Get the global MQTT client instance; with create=False, None until one exists"""
+    global _mqtt_client
+    with _mqtt_client_lock:
+        if _mqtt_client is None and create:
+            _mqtt_client = create_mqtt_client()
     return _mqtt_client
 
+def get_process_status():
+    """Status of this process: its ingest engine's, or only the relay and caches when it runs none"""
+    client = get_mqtt_client(create=False)
+    if client is not None:
+        return client.get_status()
+    return {
+        'connected': False,
+        'engine': None,
+        'ingest_mode': getattr(settings, 'MQTT_INGEST_MODE', INGEST_SINGLE),
+        'leader': None,
+        'broker_host': getattr(settings, 'MQTT_BROKER_HOST', ''),
+        'broker_port': getattr(settings, 'MQTT_BROKER_PORT', 1883),
+        'topics': getattr(settings, 'MQTT_TOPICS', []),
+        'brokers': [],
+        **relay.get_stats(),
+        **last_values.get_stats(),
+        **replay_buffer.get_stats(),
+    }
+
+def reload_brokers():
+    """Make this process's ingest engine, if it exists, re-read the broker configurations"""
+    if _mqtt_client is not None:
+        _mqtt_client.request_broker_reload()
+
 def start_mqtt_client():
     """Start the MQTT client"""
     global mqtt_client_instance
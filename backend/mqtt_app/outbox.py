@@ -0,0 +1,128 @@
+"""
+Bounded per-connection send queue protecting WebSocket clients on slow links
+"""
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from .json_codec import codec
+
+SLOW_CONFLATE = 'conflate'
+SLOW_DROP_OLDEST = 'drop_oldest'
+SLOW_DISCONNECT = 'disconnect'
+SLOW_CONSUMER_POLICIES = (SLOW_CONFLATE, SLOW_DROP_OLDEST, SLOW_DISCONNECT)
+
+
+class SendQueue:
+    """
+    Frames waiting to be sent to one WebSocket client.
+
+    Frames are queued as they are broadcast and sent by a single task, so a
+    client on a slow link only delays itself. What happens when it falls
+    behind depends on the policy:
+
+    - conflate: once the client is behind (conflate_depth frames queued, or
+      the oldest conflate_lag seconds old), a new frame for a topic that
+      still has one queued replaces it in place, so the client skips stale
+      values but keeps the latest of every topic; when full, the oldest
+      frame is dropped. Bursts a healthy client keeps up with are queued
+      in full
+    - drop_oldest: when full, the oldest frame is dropped
+    - disconnect: the client is dropped once the oldest queued frame is more
+      than max_lag seconds old, or the queue is full
+
+    Lag is the age of the oldest frame not yet sent. Used from one event
+    loop; lag() and the counters may be read from other threads.
+    """
+
+    def __init__(self, policy=SLOW_CONFLATE, max_size=1000, max_lag=30.0, conflate_depth=100, conflate_lag=1.0):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(
+                f"Unknown slow consumer policy '{policy}', expected one of {', '.join(SLOW_CONSUMER_POLICIES)}"
+            )
+        self.policy = policy
+        self.max_size = max(1, int(max_size))
+        self.max_lag = float(max_lag)
+        self.conflate_depth = max(1, int(conflate_depth))
+        self.conflate_lag = float(conflate_lag)
+        # key -> (frame, time queued); topics for conflatable frames, unique ints otherwise
+        self._frames = OrderedDict()
+        self._keys = itertools.count()
+        self._ready = asyncio.Event()
+        self.degraded = False
+        self._notify = False
+        self.dropped_count = 0
+        self.conflated_count = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def lost_count(self):
+        """Frames dropped or replaced so far"""
+        return self.dropped_count + self.conflated_count
+
+    def put(self, frame, topic=None):
+        """Queue a frame; return False when the client has to be disconnected"""
+        now = time.monotonic()
+        conflate = self.policy == SLOW_CONFLATE and topic is not None and self.behind(now)
+        if conflate and topic in self._frames:
+            # Keep the queued frame's position and age, so lag still shows how stale it is
+            self._frames[topic] = (frame, self._frames[topic][1])
+            self.conflated_count += 1
+            self._degrade()
+            return True
+        if len(self._frames) >= self.max_size:
+            if self.policy == SLOW_DISCONNECT:
+                return False
+            self._frames.popitem(last=False)
+            self.dropped_count += 1
+            self._degrade()
+        self._frames[topic if conflate else next(self._keys)] = (frame, now)
+        self._ready.set()
+        return self.policy != SLOW_DISCONNECT or self.lag(now) <= self.max_lag
+
+    def behind(self, now=None):
+        """Whether the client is far enough behind for frames to be conflated"""
+        return len(self._frames) >= self.conflate_depth or self.lag(now) >= self.conflate_lag
+
+    def _degrade(self):
+        if not self.degraded:
+            self.degraded = True
+            self._notify = True
+            self._ready.set()
+
+    async def get(self):
+        """Wait for the next frame to send; a notice goes first once the client starts missing messages"""
+        while True:
+            if self._notify:
+                self._notify = False
+                return self.notice()
+            if self._frames:
+                frame, _ = self._frames.popitem(last=False)[1]
+                return frame
+            # Caught up: the next time frames are lost the client is told again
+            self.degraded = False
+            self._ready.clear()
+            await self._ready.wait()
+
+    def notice(self, **extra):
+        """The slow_consumer frame telling the client it is missing messages"""
+        return codec.dumps({
+            'type': 'slow_consumer',
+            'policy': self.policy,
+            'dropped': self.dropped_count,
+            'conflated': self.conflated_count,
+            'pending': len(self._frames),
+            'lag': round(self.lag(), 3),
+            **extra,
+        })
+
+    def lag(self, now=None):
+        """Seconds the oldest queued frame has been waiting"""
+        try:
+            _, queued_at = next(iter(self._frames.values()))
+        except (StopIteration, RuntimeError):
+            # Empty, or changed by the event loop while read from another thread
+            return 0.0
+        return (now or time.monotonic()) - queued_at
@@ -0,0 +1,91 @@
+"""
+Keyset (cursor) pagination for MQTT message history
+"""
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates newest-first on (timestamp, id).
+
+    Each page continues strictly after the last row of the previous one, so a
+    page costs one index range scan no matter how deep the client pages, and
+    no COUNT(*) is needed.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-timestamp', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            timestamp, pk = position
+            # The first condition alone is an index range; the second breaks ties
+            queryset = queryset.filter(
+                Q(timestamp__lte=timestamp) & (Q(timestamp__lt=timestamp) | Q(id__lt=pk))
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 100
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+            timestamp, pk = value.rsplit('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (ValueError, TypeError, UnicodeError):
+            timestamp = None
+        if timestamp is None:
+            raise NotFound('Invalid cursor')
+        return timestamp, pk
+
+    def encode_cursor(self, message):
+        value = f'{message.timestamp.isoformat()}|{message.pk}'
+        cursor = base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
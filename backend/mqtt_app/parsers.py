@@ -0,0 +1,24 @@
+"""
+DRF parser using the configured JSON codec
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from .json_codec import codec, DecodeError
+from .renderers import CodecJSONRenderer
+
+
+class CodecJSONParser(JSONParser):
+    """JSONParser that decodes UTF-8 request bodies with the configured JSON codec"""
+    renderer_class = CodecJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        # Strict mode (no NaN/Infinity) without a strict codec, and other charsets, are left to DRF
+        if codec.name == 'json' or (self.strict and not codec.strict) or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return codec.loads(stream.read())
+        except DecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,129 @@
+"""
+Standalone ingest: one broker connection feeding worker processes, with topics partitioned between them
+"""
+import multiprocessing
+import queue
+import signal
+import logging
+from collections import namedtuple
+from django.conf import settings
+from django.db import connections
+from .mqtt_client import MQTTClient
+from .pipeline import partition_for
+
+logger = logging.getLogger(__name__)
+
+# Picklable stand-in for paho's MQTTMessage, with the attributes ingest() uses
+ReceivedMessage = namedtuple('ReceivedMessage', 'topic payload qos')
+
+
+def run_worker(index, messages):
+    """Worker process: ingest the messages of one partition until told to stop"""
+    import django
+    django.setup()  # Already done when forked; needed with the spawn start method
+
+    # Shutdown is driven by the parent, which drains the queues first, so
+    # signals sent to the whole process group (Ctrl+C, systemd) are ignored
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    worker = MQTTClient()
+    worker.write_buffer.start()
+    worker.rollups.start()
+    if index == 0:
+        # One retention thread is enough for the whole group
+        worker.retention.start()
+    worker.broadcaster.start()
+    parent = multiprocessing.parent_process()
+    processed = failed = 0
+    while True:
+        try:
+            msg = messages.get(timeout=1)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logger.warning(f"Ingest worker {index} lost its parent, shutting down")
+                break
+            continue
+        if msg is None:
+            break
+        try:
+            worker.process_message(msg)
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error processing MQTT message: {e}")
+        else:
+            processed += 1
+    worker.broadcaster.stop()
+    worker.stop_services()
+    logger.info(f"Ingest worker {index} stopped: {processed} processed, {failed} failed")
+
+
+class PartitionedIngest(MQTTClient):
+    """
+    Receives messages on one broker connection and hands them to worker processes.
+
+    Each topic always goes to the same worker (crc32 of the topic modulo the
+    number of workers), so messages of a topic are stored and broadcast in
+    the order they were received while different topics are processed in
+    parallel on separate CPUs. A full worker queue blocks the network
+    thread, which slows down reading from the broker.
+    """
+
+    def __init__(self, processes=2):
+        super().__init__()
+        self.process_count = max(1, int(processes))
+        self.queue_size = max(1, int(getattr(settings, 'MQTT_QUEUE_SIZE', 10000)))
+        self._context = multiprocessing.get_context()
+        self._queues = []
+        self._processes = []
+        self.dispatched = [0] * self.process_count
+        self.restarts = 0
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=run_worker, args=(index, self._queues[index]), name=f'mqtt-ingest-{index}', daemon=False
+        )
+        process.start()
+        return process
+
+    def start_processing(self):
+        """Start the worker processes (before any broker connection or thread exists)"""
+        if self._processes:
+            return
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        self._queues = [self._context.Queue(self.queue_size) for _ in range(self.process_count)]
+        self._processes = [self._spawn(index) for index in range(self.process_count)]
+        logger.info(f"Started {self.process_count} ingest worker processes")
+
+    def stop_processing(self):
+        """Let every worker drain its queue and flush, then wait for them to exit"""
+        for messages in self._queues:
+            messages.put(None)
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+    def check_workers(self):
+        """Restart workers that died; their queued messages are picked up by the replacement"""
+        for index, process in enumerate(self._processes):
+            if not process.is_alive():
+                logger.error(f"Ingest worker {index} exited with code {process.exitcode}, restarting")
+                self._processes[index] = self._spawn(index)
+                self.restarts += 1
+
+    def on_message(self, client, userdata, msg):
+        """Callback when MQTT message is received - route it to the topic's worker"""
+        index = partition_for(msg.topic, self.process_count)
+        self._queues[index].put(ReceivedMessage(msg.topic, msg.payload, msg.qos))
+        self.dispatched[index] += 1
+
+    def get_engine_stats(self):
+        """Dispatch statistics of the worker processes"""
+        return {
+            'workers': self.process_count,
+            'alive': sum(process.is_alive() for process in self._processes),
+            'dispatched': sum(self.dispatched),
+            'dispatched_per_worker': list(self.dispatched),
+            'restarts': self.restarts,
+        }
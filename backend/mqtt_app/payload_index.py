@@ -0,0 +1,94 @@
+"""
+Indexed JSON payload fields, so message history can be filtered by payload values
+"""
+from django.conf import settings
+from django.db import connections
+from .json_codec import codec
+from .rollups import parse_field_config
+from .topics import TopicTrie
+
+# Query parameters filtering history by an indexed field: payload.<path>=<value>
+PARAM_PREFIX = 'payload.'
+
+# Longer values are not indexed (the column is a CharField of this length)
+MAX_VALUE_LENGTH = 255
+
+
+def index_value(value):
+    """
+    The text stored (and compared) for a payload value, or None if it is not indexed.
+
+    Strings are kept as they are; numbers, booleans and null as their JSON
+    text (5, 2.5, true, null), so ``payload.count=5`` matches both 5 and "5".
+    Objects, arrays and values longer than MAX_VALUE_LENGTH are not indexed.
+    """
+    if isinstance(value, str):
+        text = value
+    elif value is None or isinstance(value, (bool, int, float)):
+        text = codec.dumps(value)
+    else:
+        return None
+    return text if len(text) <= MAX_VALUE_LENGTH else None
+
+
+def extract_value(payload, path):
+    """Follow a dot-separated path into a JSON object and return the indexed text, or None"""
+    value = payload
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return index_value(value)
+
+
+class PayloadIndexer:
+    """
+    Picks the configured fields (MQTT_PAYLOAD_INDEX_FIELDS) out of JSON payloads.
+
+    The write buffer stores them as MQTTPayloadField rows next to their
+    message, where an index on (key, value, message) answers payload.<key>
+    history filters without reading payloads.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = parse_field_config(fields or {})
+        self._trie = TopicTrie()
+        for topic_filter in self.fields:
+            self._trie.add(topic_filter, topic_filter)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(getattr(settings, 'MQTT_PAYLOAD_INDEX_FIELDS', {}))
+
+    def check_database(self, using='default'):
+        """Refuse to index on a database whose bulk inserts do not return IDs to link fields to"""
+        if self.enabled and not connections[using].features.can_return_rows_from_bulk_insert:
+            raise ValueError(
+                "MQTT_PAYLOAD_INDEX_FIELDS needs a database returning IDs from bulk inserts "
+                "(PostgreSQL, SQLite 3.35+, MariaDB 10.5+)"
+            )
+
+    @property
+    def enabled(self):
+        return bool(self.fields)
+
+    @property
+    def keys(self):
+        """Every configured field path"""
+        return {path for paths in self.fields.values() for path in paths}
+
+    def paths_for(self, topic):
+        """Field paths configured for topic"""
+        paths = set()
+        for topic_filter in self._trie.match(topic):
+            paths.update(self.fields[topic_filter])
+        return paths
+
+    def extract(self, topic, payload):
+        """(path, value) pairs of the configured fields present in a parsed JSON payload"""
+        fields = []
+        for path in self.paths_for(topic):
+            value = extract_value(payload, path)
+            if value is not None:
+                fields.append((path, value))
+        return fields
@@ -0,0 +1,155 @@
+"""
+Compressed payload storage with per-topic preset dictionaries
+"""
+import base64
+import threading
+import time
+import zlib
+from collections import Counter
+from django.apps import apps
+from django.conf import settings
+from .topics import TopicTrie
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+COMPRESSION_CHOICES = [
+    (COMPRESSION_NONE, 'None'),
+    (COMPRESSION_ZLIB, 'zlib'),
+]
+
+# zlib can only reference the last 32 KiB, so a larger dictionary is wasted
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Raw deflate: no zlib header or checksum, which matter for small payloads
+WBITS = -15
+
+
+def to_text(data):
+    """Return (text, encoding): UTF-8 text with encoding None, or base64 with encoding 'base64'"""
+    try:
+        return data.decode('utf-8'), None
+    except UnicodeDecodeError:
+        return base64.b64encode(data).decode('ascii'), 'base64'
+
+
+def train_dictionary(samples, size=16 * 1024):
+    """
+    Build a zlib preset dictionary from sample payloads.
+
+    Distinct samples are concatenated least-frequent first, so the most common
+    payload shapes sit at the end of the dictionary where back-references are
+    shortest, and the result is trimmed to size bytes from the front.
+    """
+    size = min(int(size), MAX_DICTIONARY_SIZE)
+    counts = Counter(bytes(sample) for sample in samples)
+    ordered = sorted(counts, key=lambda sample: counts[sample])
+    return b''.join(ordered)[-size:]
+
+
+class PayloadCodec:
+    """
+    Encodes payloads for storage and decodes stored rows.
+
+    New payloads are compressed with the newest dictionary trained for a topic
+    filter matching the topic (or without a dictionary when none matches) and
+    stored uncompressed when that does not make them smaller. Dictionaries are
+    immutable and referenced by ID, so rows stay readable after retraining.
+    """
+
+    def __init__(self, compression='zlib', level=6, refresh_interval=60):
+        if compression not in ('none', 'zlib'):
+            raise ValueError(f"Unknown payload compression: {compression}")
+        self.compression = compression
+        self.level = int(level)
+        self.refresh_interval = float(refresh_interval)
+        self._dictionaries = {}
+        self._trie = TopicTrie()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def _model(self):
+        return apps.get_model('mqtt_app', 'MQTTPayloadDictionary')
+
+    def refresh(self):
+        """Reload the dictionaries, e.g. after training in another process"""
+        trie = TopicTrie()
+        dictionaries = {}
+        for pk, topic_filter, data in self._model().objects.order_by('id').values_list('id', 'topic_filter', 'data'):
+            dictionaries[pk] = bytes(data)
+            trie.add(topic_filter, pk)
+        with self._lock:
+            self._dictionaries = dictionaries
+            self._trie = trie
+            self._loaded_at = time.monotonic()
+
+    def _maybe_refresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= self.refresh_interval:
+            self.refresh()
+
+    def dictionary_for(self, topic):
+        """Return (id, data) of the newest dictionary matching topic, or (None, None)"""
+        with self._lock:
+            matches = self._trie.match(topic)
+            if not matches:
+                return None, None
+            pk = max(matches)
+            return pk, self._dictionaries[pk]
+
+    def get_dictionary(self, pk):
+        """Dictionary data by ID, loading it if this process has not seen it yet"""
+        data = self._dictionaries.get(pk)
+        if data is None:
+            data = bytes(self._model().objects.values_list('data', flat=True).get(pk=pk))
+            with self._lock:
+                self._dictionaries[pk] = data
+        return data
+
+    def encode(self, topic, data):
+        """Return (stored bytes, compression, dictionary ID) for a raw payload"""
+        self.raw_bytes += len(data)
+        if self.compression == 'none' or not data:
+            self.stored_bytes += len(data)
+            return data, COMPRESSION_NONE, None
+        self._maybe_refresh()
+        dictionary_id, dictionary = self.dictionary_for(topic)
+        if dictionary is not None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) >= len(data):
+            self.stored_bytes += len(data)
+            return data, COMPRESSION_NONE, None
+        self.stored_bytes += len(compressed)
+        return compressed, COMPRESSION_ZLIB, dictionary_id
+
+    def decode(self, stored, compression, dictionary_id=None):
+        """Return the raw payload of a stored row"""
+        stored = bytes(stored)
+        if compression == COMPRESSION_NONE:
+            return stored
+        if dictionary_id is not None:
+            decompressor = zlib.decompressobj(WBITS, zdict=self.get_dictionary(dictionary_id))
+        else:
+            decompressor = zlib.decompressobj(WBITS)
+        return decompressor.decompress(stored) + decompressor.flush()
+
+    def get_stats(self):
+        """Get storage statistics"""
+        return {
+            'payload_compression': self.compression,
+            'payload_raw_bytes': self.raw_bytes,
+            'payload_stored_bytes': self.stored_bytes,
+        }
+
+
+# Process-wide codec used when writing and reading message history
+payload_codec = PayloadCodec(
+    compression=getattr(settings, 'MQTT_PAYLOAD_COMPRESSION', 'zlib'),
+    level=getattr(settings, 'MQTT_PAYLOAD_COMPRESSION_LEVEL', 6),
+    refresh_interval=getattr(settings, 'MQTT_PAYLOAD_DICTIONARY_REFRESH', 60),
+)
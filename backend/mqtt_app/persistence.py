@@ -0,0 +1,216 @@
+"""
+Write-behind persistence for MQTT messages
+"""
+import threading
+import time
+import logging
+from collections import deque
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from .metrics import metrics, STAGE_DB_WRITE
+from .models import MQTTMessage, MQTTPayloadField, MQTTTopic
+from .payloads import payload_codec
+from .pipeline import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_POLICIES
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Collects messages in memory and stores them with bulk_create.
+
+    Payloads are raw bytes and are compressed here, on the flush thread,
+    rather than on the workers handling live traffic. Indexed payload fields
+    (see PayloadIndexer) are written in the same transaction as their
+    messages.
+
+    At most max_pending messages are held, including a batch waiting to be
+    retried; beyond that the overflow policy blocks add() until the flush
+    thread makes room, or drops the oldest or newest messages. A batch whose
+    write fails is retried alone every flush_interval, up to max_retries
+    times, before it is dropped.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, codec=None,
+                 max_pending=100000, overflow=OVERFLOW_DROP_OLDEST, max_retries=3):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy '{overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}"
+            )
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.codec = codec if codec is not None else payload_codec
+        self.max_pending = max(self.batch_size, int(max_pending))
+        self.overflow = overflow
+        self.max_retries = max(0, int(max_retries))
+        self._pending = deque()
+        self._retry = deque()  # Failed batch, retried before anything newer
+        self._attempts = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.flushed_count = 0
+        self.failed_flushes = 0
+        self.dropped_count = 0
+
+    def start(self):
+        """Start the background flush thread"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='mqtt-write-buffer', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write out everything still pending"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._wakeup.notify()
+            self._space.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def add(self, topic, payload, qos, timestamp=None, fields=()):
+        """Queue a message, and its (path, value) index fields, for the next flush"""
+        # Timestamp is the receive time (or now), not the flush time
+        message = (topic, payload, qos, timestamp or timezone.now(), fields)
+        with self._lock:
+            if len(self._pending) + len(self._retry) >= self.max_pending:
+                # Blocking only makes sense while the flush thread is there to make room
+                while (self.overflow == OVERFLOW_BLOCK and self._running
+                       and len(self._pending) + len(self._retry) >= self.max_pending):
+                    self._space.wait()
+                if len(self._pending) + len(self._retry) >= self.max_pending:
+                    if self.overflow == OVERFLOW_DROP_OLDEST:
+                        self._drop([(self._retry or self._pending).popleft()], 'buffer full')
+                    else:
+                        self._drop([message], 'buffer full')
+                        return
+            self._pending.append(message)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def _drop(self, messages, reason):
+        """Count and log messages that will never be stored (called with the lock held or from flush)"""
+        dropped = self.dropped_count = self.dropped_count + len(messages)
+        if len(messages) > 1 or dropped == 1 or dropped % 1000 == 0:
+            topics = sorted({topic for topic, _, _, _, _ in messages})
+            logger.error(
+                f"Dropped {len(messages)} messages not yet stored ({reason}, {dropped} so far), "
+                f"received {messages[0][3].isoformat()} to {messages[-1][3].isoformat()}, "
+                f"topics: {', '.join(topics[:10])}{' ...' if len(topics) > 10 else ''}"
+            )
+
+    def flush(self):
+        """Write the batch waiting for a retry, or else all pending messages, to the database"""
+        with self._flush_lock:
+            with self._lock:
+                retrying = bool(self._retry)
+                if retrying:
+                    batch = list(self._retry)
+                else:
+                    batch = list(self._pending)
+                    self._pending.clear()
+                self._space.notify_all()
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                self._write(batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                with self._lock:
+                    self._attempts += 1
+                    if self._attempts > self.max_retries:
+                        self._retry.clear()
+                        self._attempts = 0
+                        self._drop(batch, f'write failed: {e}')
+                    else:
+                        if not retrying:
+                            self._retry.extend(batch)
+                        logger.error(
+                            f"Error saving {len(batch)} messages to database, "
+                            f"retry {self._attempts} of {self.max_retries}: {e}"
+                        )
+                return 0
+            with self._lock:
+                if retrying:
+                    # Rows dropped from the retry batch while writing it (drop_oldest) were stored after all
+                    self._retry.clear()
+                self._attempts = 0
+                self._space.notify_all()
+            metrics.observe(STAGE_DB_WRITE, time.perf_counter() - started)
+            self.flushed_count += len(batch)
+            return len(batch)
+
+    def _write(self, batch):
+        """Store messages and their index fields in one transaction"""
+        topic_ids = MQTTTopic.objects.get_ids(topic for topic, _, _, _, _ in batch)
+        messages = []
+        for topic, payload, qos, timestamp, _ in batch:
+            data, compression, dictionary_id = self.codec.encode(topic, payload)
+            messages.append(MQTTMessage(
+                topic_id=topic_ids[topic], payload_data=data, compression=compression,
+                dictionary_id=dictionary_id, qos=qos, timestamp=timestamp,
+            ))
+        with transaction.atomic():
+            MQTTMessage.objects.bulk_create(messages, batch_size=self.batch_size)
+            self._write_fields(messages, [fields for _, _, _, _, fields in batch])
+
+    def _write_fields(self, messages, fields):
+        """Store the index fields of just-created messages"""
+        rows = [
+            MQTTPayloadField(message_id=message.pk, key=key, value=value)
+            for message, message_fields in zip(messages, fields)
+            for key, value in message_fields
+        ]
+        if not rows:
+            return
+        # PayloadIndexer.check_database() makes sure bulk_create set the message IDs
+        MQTTPayloadField.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def _run(self):
+        """Flush loop: wake on size threshold or after flush_interval"""
+        try:
+            while True:
+                with self._lock:
+                    deadline = time.monotonic() + self.flush_interval
+                    # A failed batch is retried after a full interval, whatever piles up meanwhile
+                    while self._running and (self._retry or len(self._pending) < self.batch_size):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._wakeup.wait(remaining)
+                    running = self._running
+                close_old_connections()
+                self.flush()
+                if not running:
+                    # Write out everything left; each failure counts towards dropping its batch
+                    while self._pending or self._retry:
+                        self.flush()
+                    break
+        finally:
+            connection.close()
+
+    def get_stats(self):
+        """Get buffer statistics"""
+        with self._lock:
+            pending = len(self._pending) + len(self._retry)
+        return {
+            'db_pending': pending,
+            'db_max_pending': self.max_pending,
+            'db_overflow': self.overflow,
+            'db_flushed': self.flushed_count,
+            'db_failed_flushes': self.failed_flushes,
+            'db_dropped': self.dropped_count,
+            **self.codec.get_stats(),
+        }
@@ -0,0 +1,139 @@
+"""
+Bounded worker pipeline that keeps message processing off the paho network thread
+"""
+import queue
+import threading
+import zlib
+import logging
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+_STOP = object()
+
+
+def partition_for(topic, partitions):
+    """Stable partition of a topic: the same in every process and across restarts"""
+    return zlib.crc32(topic.encode('utf-8')) % partitions
+
+
+class MessagePipeline:
+    """
+    Bounded queues, one per worker thread.
+
+    Items are routed by key (the MQTT topic), so every topic is handled by
+    the same worker and its messages are stored and broadcast in the order
+    they were received, while different topics are processed in parallel.
+    max_size is split evenly between the queues.
+    """
+
+    def __init__(self, handler, workers=2, max_size=10000, overflow=OVERFLOW_BLOCK, key=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy '{overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}"
+            )
+        self.handler = handler
+        self.worker_count = max(1, int(workers))
+        self.overflow = overflow
+        self.key = key if key is not None else (lambda item: item.topic)
+        queue_size = max(1, -(-int(max_size) // self.worker_count))
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.worker_count)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    def start(self):
+        """Start the worker threads"""
+        with self._lock:
+            if self._threads:
+                return
+            for index, items in enumerate(self.queues):
+                thread = threading.Thread(
+                    target=self._run, args=(items,), name=f'mqtt-worker-{index}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """Process everything already queued, then stop the workers"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for items in self.queues[:len(threads)]:
+            # Sentinels always go in, even when the queue is full
+            items.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    def submit(self, item):
+        """Enqueue an item on its key's queue according to the overflow policy"""
+        items = self.queues[0]
+        if self.worker_count > 1:
+            items = self.queues[partition_for(self.key(item), self.worker_count)]
+        if self.overflow == OVERFLOW_BLOCK:
+            items.put(item)
+            return True
+        if self.overflow == OVERFLOW_DROP_NEWEST:
+            try:
+                items.put_nowait(item)
+                return True
+            except queue.Full:
+                self._count_drop()
+                return False
+        # Drop oldest: make room by discarding the head of the queue
+        while True:
+            try:
+                items.put_nowait(item)
+                return True
+            except queue.Full:
+                try:
+                    items.get_nowait()
+                    items.task_done()
+                    self._count_drop()
+                except queue.Empty:
+                    pass
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped_count += 1
+            dropped = self.dropped_count
+        if dropped == 1 or dropped % 1000 == 0:
+            logger.warning(f"MQTT pipeline queue full ({self.overflow}), {dropped} messages dropped so far")
+
+    def _run(self, items):
+        """Worker loop over one queue"""
+        try:
+            while True:
+                item = items.get()
+                try:
+                    if item is _STOP:
+                        break
+                    self.handler(item)
+                    with self._lock:
+                        self.processed_count += 1
+                except Exception as e:
+                    with self._lock:
+                        self.failed_count += 1
+                    logger.error(f"Error processing MQTT message: {e}")
+                finally:
+                    items.task_done()
+        finally:
+            connection.close()
+
+    def get_stats(self):
+        """Get pipeline statistics"""
+        return {
+            'queue_depth': sum(items.qsize() for items in self.queues),
+            'queue_capacity': sum(items.maxsize for items in self.queues),
+            'queue_overflow': self.overflow,
+            'workers': self.worker_count,
+            'processed': self.processed_count,
+            'dropped': self.dropped_count,
+            'failed': self.failed_count,
+        }
@@ -0,0 +1,179 @@
+"""
+Per-process relay of broadcast MQTT messages to the WebSocket clients of this server process
+"""
+import asyncio
+import time
+import logging
+from channels.layers import get_channel_layer
+from .broadcast import GROUP_NAME, sequenced
+from .frames import LiveFrame, LiveMessage
+from .last_values import last_values
+from .replay import replay_buffer
+from .topics import SubscriptionRegistry
+
+logger = logging.getLogger(__name__)
+
+# channels_redis forgets group members after a day unless they are added again
+GROUP_RENEW_INTERVAL = 3600
+
+# Seconds between attempts to join the broadcast group while the channel layer is unreachable
+START_RETRY_INTERVAL = 5
+
+
+class MessageRelay:
+    """
+    Receives every broadcast message once per server process and fans it out locally.
+
+    Ingest may run in this process or in others (``manage.py mqtt_ingest``
+    partition workers, ``shared`` or ``leader`` ingest modes), so all of it
+    publishes to the GROUP_NAME group, which only relays join: one channel
+    per server process. For each message the relay assigns this process's
+    replay sequence number, updates the last-value cache and queues the
+    frame on every local consumer whose filters match. All of this happens
+    on the event loop, in the order messages arrive, so sequence numbers,
+    cached values and delivery order always agree.
+
+    Consumers receiving every topic are kept in a set; those with topic
+    filters in a SubscriptionRegistry keyed by consumer.
+    """
+
+    def __init__(self):
+        self.everything = set()
+        self.registry = SubscriptionRegistry()
+        self.channel_layer = None
+        self.channel_name = None
+        self.loop = None
+        self._task = None
+        self.joined = False
+        self._grouped_at = 0.0
+        self.received_events = 0
+        self.received_messages = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start relaying on the running event loop in the background (idempotent, never raises)"""
+        loop = asyncio.get_running_loop()
+        if self.running and self.loop is loop:
+            return
+        self.loop = loop
+        self.joined = False
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        """Leave the broadcast group and stop relaying"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if not self.joined:
+            return
+        self.joined = False
+        try:
+            await self.channel_layer.group_discard(GROUP_NAME, self.channel_name)
+        except Exception as e:
+            logger.warning(f"Could not leave the MQTT broadcast group: {e}")
+
+    async def _join(self):
+        """Join the broadcast group, retrying until the channel layer can be reached"""
+        while True:
+            try:
+                self.channel_layer = get_channel_layer()
+                self.channel_name = await self.channel_layer.new_channel()
+                await self._join_group()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Could not join the MQTT broadcast group, retrying in {START_RETRY_INTERVAL}s: {e}")
+                await asyncio.sleep(START_RETRY_INTERVAL)
+                continue
+            self.joined = True
+            logger.info(f"Relaying MQTT broadcasts to this process's WebSocket clients ({self.channel_name})")
+            return
+
+    async def _join_group(self):
+        await self.channel_layer.group_add(GROUP_NAME, self.channel_name)
+        self._grouped_at = time.monotonic()
+
+    async def _run(self):
+        """Receive loop"""
+        await self._join()
+        while True:
+            try:
+                event = await self.channel_layer.receive(self.channel_name)
+                if time.monotonic() - self._grouped_at > GROUP_RENEW_INTERVAL:
+                    await self._join_group()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error receiving MQTT broadcasts: {e}")
+                await asyncio.sleep(1)
+                continue
+            try:
+                self.dispatch(event['messages'], event.get('batch', False))
+            except Exception as e:
+                logger.error(f"Error relaying MQTT broadcast: {e}")
+
+    def subscribe(self, consumer, filters):
+        """Route topics matching filters to consumer; None routes every topic"""
+        if filters is None:
+            self.registry.discard(consumer)
+            self.everything.add(consumer)
+        else:
+            self.everything.discard(consumer)
+            self.registry.set_filters(consumer, filters)
+
+    def unsubscribe(self, consumer):
+        """Stop routing anything to consumer"""
+        self.everything.discard(consumer)
+        self.registry.discard(consumer)
+
+    def dispatch(self, messages, batch=False):
+        """Sequence, cache and deliver broadcast (topic, data, raw payload) messages"""
+        self.received_events += 1
+        self.received_messages += len(messages)
+        per_consumer = {}
+        for topic, data, raw in messages:
+            seq, data = replay_buffer.add(topic, lambda seq: sequenced(data, seq))
+            last_values.update(topic, data, seq)
+            message = LiveMessage(topic, data, raw)
+            targets = self.targets(topic)
+            if not targets:
+                continue
+            if not batch:
+                frame = LiveFrame((message,))
+                for consumer in targets:
+                    consumer.deliver(frame)
+                continue
+            for consumer in targets:
+                per_consumer.setdefault(consumer, []).append(message)
+        # Each consumer gets the part of the batch it subscribed to as one frame,
+        # shared with the consumers that matched the same part
+        frames = {}
+        for consumer, matched in per_consumer.items():
+            key = tuple(matched)
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = LiveFrame(matched, batch=True)
+            consumer.deliver(frame)
+
+    def targets(self, topic):
+        """Consumers subscribed to topic"""
+        if not self.registry:
+            return self.everything
+        return self.everything.union(self.registry.match(topic))
+
+    def get_stats(self):
+        """Get relay statistics"""
+        return {
+            'relay_running': self.running and self.joined,
+            'relay_messages': self.received_messages,
+            'subscribed_clients': len(self.registry),
+        }
+
+
+# Process-wide relay, started by the first WebSocket connection
+relay = MessageRelay()
@@ -0,0 +1,26 @@
+"""
+DRF renderer using the configured JSON codec
+"""
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+from .json_codec import codec
+
+
+class CodecJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes compact responses with the configured JSON codec"""
+
+    # Handles the types DRF supports beyond plain JSON (Decimal, lazy strings, ...)
+    _encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Indented, ASCII-only or non-compact output is left to DRF
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if codec.name == 'json' or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = codec.dumpb(data, default=self._encoder.default)
+        # Same escaping as DRF so the output stays a strict JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,75 @@
+"""
+Sequence-numbered replay buffer for resuming WebSocket connections
+"""
+import threading
+import uuid
+from collections import deque
+from django.conf import settings
+from .topics import TopicTrie
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of the most recent encoded messages, keyed by sequence number.
+
+    Sequence numbers are monotonic within an epoch; the epoch changes every
+    time the process starts, so clients can tell a restart from a gap.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = max(1, int(capacity))
+        self.epoch = uuid.uuid4().hex[:12]
+        self._entries = deque(maxlen=self.capacity)
+        self._last_seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, topic, build):
+        """Assign the next sequence number, encode with build(seq) and store the result"""
+        with self._lock:
+            seq = self._last_seq + 1
+            data = build(seq)
+            self._entries.append((seq, topic, data))
+            self._last_seq = seq
+        return seq, data
+
+    @property
+    def last_seq(self):
+        return self._last_seq
+
+    def since(self, seq, filters=None):
+        """
+        Return (messages, gap) for everything after seq.
+
+        messages is a list of (seq, data), optionally limited to MQTT filters.
+        gap is True when messages after seq have already been evicted.
+        """
+        with self._lock:
+            entries = list(self._entries)
+        first_seq = entries[0][0] if entries else self._last_seq + 1
+        gap = seq < first_seq - 1
+        # Sequence numbers in the buffer are contiguous
+        entries = entries[max(0, seq - first_seq + 1):]
+        if filters is not None:
+            trie = TopicTrie()
+            for topic_filter in filters:
+                trie.add(topic_filter, True)
+            entries = [entry for entry in entries if trie.match(entry[1])]
+        return [(entry_seq, data) for entry_seq, _, data in entries], gap
+
+    def oldest_seq(self):
+        """Sequence number of the oldest message still buffered"""
+        with self._lock:
+            return self._entries[0][0] if self._entries else self._last_seq + 1
+
+    def get_stats(self):
+        """Get replay buffer statistics"""
+        with self._lock:
+            return {
+                'replay_epoch': self.epoch,
+                'replay_last_seq': self._last_seq,
+                'replay_buffered': len(self._entries),
+            }
+
+
+# Process-wide buffer written by the MQTT client and read by consumers
+replay_buffer = ReplayBuffer(capacity=getattr(settings, 'MQTT_REPLAY_BUFFER_SIZE', 10000))
@@ -0,0 +1,226 @@
+"""
+Chunked deletion and background retention policies for MQTT message history
+"""
+import json
+import threading
+import time
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .filters import topics_matching
+from .models import MQTTMessage, MQTTPayloadField, MQTTRollup, MQTTTopic
+
+logger = logging.getLogger(__name__)
+
+
+def delete_in_chunks(queryset, chunk_size=1000, pause=0.0, order_by=None):
+    """
+    Delete the rows of queryset in batches of chunk_size.
+
+    Each batch is a short DELETE ... WHERE id IN (...) in its own transaction,
+    so the database is never locked for long and memory stays bounded.
+    The indexed payload fields of messages are deleted first, in the same
+    transaction. Returns the number of rows deleted.
+
+    Batches are taken in primary key order after the last deleted key, so
+    the primary key index yields them without sorting and no row is read
+    twice. Pass order_by only when an index returns the queryset's rows in
+    that order (see delete_messages_before).
+    """
+    model = queryset.model
+    total = 0
+    last_pk = None
+    while True:
+        if order_by is not None:
+            rows = queryset.order_by(*order_by)
+        elif last_pk is None:
+            rows = queryset.order_by('pk')
+        else:
+            rows = queryset.filter(pk__gt=last_pk).order_by('pk')
+        pks = list(rows.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return total
+        last_pk = pks[-1]
+        with transaction.atomic():
+            if model is MQTTMessage:
+                MQTTPayloadField.objects.filter(message_id__in=pks).delete()
+            deleted, _ = model._base_manager.filter(pk__in=pks).delete()
+        total += deleted
+        if len(pks) < chunk_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def delete_messages_before(condition, topics=None, chunk_size=1000, pause=0.0):
+    """
+    Delete the messages matching a timestamp condition, oldest-first.
+
+    With topics (an MQTTTopic queryset), each topic is walked on its own along
+    the (topic, -timestamp, -id) index, so every batch is read straight off the
+    index instead of sorting all expired rows of several topics again for each
+    batch. Without, all messages are walked along the (-timestamp, -id) index.
+    """
+    if topics is None:
+        expired = MQTTMessage.objects.filter(condition)
+        return delete_in_chunks(expired, chunk_size, pause, order_by=('timestamp', 'id'))
+    total = 0
+    for topic_id in topics.order_by('id').values_list('id', flat=True):
+        expired = MQTTMessage.objects.filter(condition, topic_id=topic_id)
+        total += delete_in_chunks(expired, chunk_size, pause, order_by=('timestamp', 'id'))
+    return total
+
+
+def parse_rules(rules):
+    """Parse MQTT_RETENTION_RULES (a list or its JSON text) into a list of dicts"""
+    if isinstance(rules, str):
+        rules = json.loads(rules) if rules.strip() else []
+    return [
+        {
+            'topic': rule['topic'],
+            'max_age': int(rule.get('max_age') or 0),
+            'max_rows': int(rule.get('max_rows') or 0),
+        }
+        for rule in rules
+    ]
+
+
+def parse_rollup_retention(retention):
+    """Parse MQTT_ROLLUP_RETENTION ({resolution name: max_age} or its JSON text) into {seconds: max_age}"""
+    if isinstance(retention, str):
+        retention = json.loads(retention) if retention.strip() else {}
+    return {
+        MQTTRollup.RESOLUTIONS[name]: int(max_age or 0)
+        for name, max_age in retention.items()
+        if int(max_age or 0)
+    }
+
+
+class RetentionPolicy:
+    """
+    Applies max_age (seconds) and max_rows limits to message history.
+
+    Per-topic rules are checked in order and the first rule matching a topic
+    applies to it; topics not matched by any rule use the global limits.
+    A limit of 0 means unlimited. Rollups are expired by age per resolution.
+    """
+
+    def __init__(self, max_age=0, max_rows=0, rules=(), chunk_size=1000, pause=0.0, rollup_max_age=None):
+        self.max_age = int(max_age or 0)
+        self.max_rows = int(max_rows or 0)
+        self.rules = parse_rules(rules)
+        self.rollup_max_age = parse_rollup_retention(rollup_max_age or {})
+        self.chunk_size = max(1, int(chunk_size))
+        self.pause = float(pause)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_age=getattr(settings, 'MQTT_RETENTION_MAX_AGE', 0),
+            max_rows=getattr(settings, 'MQTT_RETENTION_MAX_ROWS', 0),
+            rules=getattr(settings, 'MQTT_RETENTION_RULES', []),
+            chunk_size=getattr(settings, 'MQTT_RETENTION_BATCH_SIZE', 1000),
+            pause=getattr(settings, 'MQTT_RETENTION_BATCH_PAUSE', 0.05),
+            rollup_max_age=getattr(settings, 'MQTT_ROLLUP_RETENTION', {}),
+        )
+
+    def is_enabled(self):
+        return bool(self.max_age or self.max_rows or self.rules or self.rollup_max_age)
+
+    def apply(self):
+        """Delete everything outside the limits; return the number of rows deleted"""
+        deleted = 0
+        claimed = MQTTTopic.objects.none()
+        for rule in self.rules:
+            topics = topics_matching(rule['topic']).exclude(pk__in=claimed)
+            claimed |= topics_matching(rule['topic'])
+            deleted += self._apply_limits(rule['max_age'], rule['max_rows'], topics=topics)
+        if self.max_age or self.max_rows:
+            # Global limits cover every message outside the rules' topics, without listing topics
+            scope = ~Q(topic__in=claimed) if self.rules else Q()
+            deleted += self._apply_limits(self.max_age, self.max_rows, scope=scope)
+        for resolution, max_age in self.rollup_max_age.items():
+            cutoff = timezone.now() - timedelta(seconds=max_age)
+            expired = MQTTRollup.objects.filter(resolution=resolution, bucket__lt=cutoff)
+            deleted += delete_in_chunks(expired, self.chunk_size, self.pause)
+        return deleted
+
+    def _apply_limits(self, max_age, max_rows, topics=None, scope=Q()):
+        deleted = 0
+        if max_age:
+            cutoff = timezone.now() - timedelta(seconds=max_age)
+            condition = scope & Q(timestamp__lt=cutoff)
+            deleted += delete_messages_before(condition, topics, self.chunk_size, self.pause)
+        if max_rows:
+            # Newest row past the limit, looked up once per run; it and everything older goes
+            queryset = MQTTMessage.objects.filter(scope)
+            if topics is not None:
+                queryset = queryset.filter(topic__in=topics)
+            boundary = queryset.order_by('-timestamp', '-id').values_list('timestamp', 'id')[max_rows:max_rows + 1]
+            boundary = list(boundary)
+            if boundary:
+                timestamp, pk = boundary[0]
+                condition = scope & Q(timestamp__lte=timestamp) & (Q(timestamp__lt=timestamp) | Q(id__lte=pk))
+                deleted += delete_messages_before(condition, topics, self.chunk_size, self.pause)
+        return deleted
+
+
+class RetentionWorker:
+    """Runs the retention policy periodically on a background thread"""
+
+    def __init__(self, policy, interval=300):
+        self.policy = policy
+        self.interval = float(interval)
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_deleted = 0
+        self.total_deleted = 0
+
+    def start(self):
+        """Start the retention thread (no-op when no limits are configured)"""
+        if self._thread or not self.policy.is_enabled():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """Apply the policy once"""
+        try:
+            deleted = self.policy.apply()
+        except Exception as e:
+            logger.error(f"Error applying MQTT retention policy: {e}")
+            return 0
+        self.last_run = timezone.now()
+        self.last_deleted = deleted
+        self.total_deleted += deleted
+        if deleted:
+            logger.info(f"Retention removed {deleted} MQTT message and rollup rows")
+        return deleted
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                close_old_connections()
+                self.run_once()
+        finally:
+            connection.close()
+
+    def get_stats(self):
+        """Get retention statistics"""
+        return {
+            'retention_enabled': self.policy.is_enabled(),
+            'retention_last_run': self.last_run,
+            'retention_last_deleted': self.last_deleted,
+            'retention_total_deleted': self.total_deleted,
+        }
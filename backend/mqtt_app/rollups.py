@@ -0,0 +1,216 @@
+"""
+Incrementally maintained time-bucket rollups of numeric payload fields
+"""
+import json
+import threading
+import logging
+from datetime import datetime, timezone as dt_timezone
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Q
+from .models import MQTTRollup, MQTTTopic
+from .topics import TopicTrie, validate_filter
+
+logger = logging.getLogger(__name__)
+
+# Merges retried after another process created one of the same buckets
+MERGE_ATTEMPTS = 3
+
+# Existing rollups looked up per query: SQLite limits the depth of the OR-ed key conditions
+MERGE_CHUNK_SIZE = 250
+
+
+def parse_field_config(config):
+    """Parse MQTT_ROLLUP_FIELDS ({topic filter: [field paths]} or its JSON text)"""
+    if isinstance(config, str):
+        config = json.loads(config) if config.strip() else {}
+    return {validate_filter(topic_filter): list(paths) for topic_filter, paths in config.items()}
+
+
+def extract_number(payload, path):
+    """Follow a dot-separated path into a JSON object and return a float, or None"""
+    value = payload
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        # Devices such as ControlByWeb often send numbers as strings
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+class RollupAggregator:
+    """
+    Accumulates min/max/sum/count/last per (topic, field, resolution, bucket)
+    in memory and merges them into MQTTRollup rows on a background thread.
+    """
+
+    def __init__(self, fields=None, resolutions=(1, 60, 3600), flush_interval=1.0):
+        self.fields = parse_field_config(fields or {})
+        self.resolutions = tuple(resolutions)
+        self.flush_interval = float(flush_interval)
+        self._trie = TopicTrie()
+        for topic_filter in self.fields:
+            self._trie.add(topic_filter, topic_filter)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushed_count = 0
+        self.failed_flushes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.fields)
+
+    def paths_for(self, topic):
+        """Field paths configured for topic"""
+        paths = set()
+        for topic_filter in self._trie.match(topic):
+            paths.update(self.fields[topic_filter])
+        return paths
+
+    def add(self, topic, payload, timestamp):
+        """Fold the configured numeric fields of a parsed JSON payload into the pending buckets"""
+        paths = self.paths_for(topic)
+        if not paths:
+            return
+        epoch = timestamp.timestamp()
+        with self._lock:
+            for path in paths:
+                value = extract_number(payload, path)
+                if value is None:
+                    continue
+                for resolution in self.resolutions:
+                    key = (topic, path, resolution, int(epoch // resolution) * resolution)
+                    self._fold(key, [1, value, value, value, value, timestamp])
+
+    def _fold(self, key, aggregate):
+        """Combine a [count, sum, min, max, last, last timestamp] aggregate into the pending one of key"""
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = aggregate
+            return
+        count, total, low, high, last, last_timestamp = aggregate
+        entry[0] += count
+        entry[1] += total
+        entry[2] = min(entry[2], low)
+        entry[3] = max(entry[3], high)
+        if last_timestamp >= entry[5]:
+            entry[4] = last
+            entry[5] = last_timestamp
+
+    def start(self):
+        """Start the flush thread (no-op when no fields are configured)"""
+        if self._thread or not self.enabled:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-rollups', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write out pending aggregates"""
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def flush(self):
+        """Merge pending aggregates into the rollup table"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                self._merge(pending)
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Error saving {len(pending)} MQTT rollups, retrying with the next flush: {e}")
+                # Put them back, combined with whatever arrived meanwhile
+                with self._lock:
+                    for key, aggregate in pending.items():
+                        self._fold(key, aggregate)
+                return 0
+            self.flushed_count += len(pending)
+            return len(pending)
+
+    def _merge(self, pending):
+        topic_ids = MQTTTopic.objects.get_ids(topic for topic, _, _, _ in pending)
+        keyed = {
+            (topic_ids[topic], path, resolution, datetime.fromtimestamp(bucket, tz=dt_timezone.utc)): entry
+            for (topic, path, resolution, bucket), entry in pending.items()
+        }
+
+        # Several ingesting processes may merge into the same buckets: existing rows
+        # are locked, and a bucket created concurrently by another process is retried
+        for attempt in range(MERGE_ATTEMPTS):
+            try:
+                self._merge_once(keyed)
+                return
+            except IntegrityError:
+                if attempt == MERGE_ATTEMPTS - 1:
+                    raise
+
+    @transaction.atomic
+    def _merge_once(self, keyed):
+        keys = list(keyed)
+        existing = {}
+        for start in range(0, len(keys), MERGE_CHUNK_SIZE):
+            condition = Q()
+            for topic_id, path, resolution, bucket in keys[start:start + MERGE_CHUNK_SIZE]:
+                condition |= Q(topic_id=topic_id, field=path, resolution=resolution, bucket=bucket)
+            existing.update(
+                ((rollup.topic_id, rollup.field, rollup.resolution, rollup.bucket), rollup)
+                for rollup in MQTTRollup.objects.select_for_update().filter(condition)
+            )
+        created, updated = [], []
+        for key, (count, total, low, high, last, last_timestamp) in keyed.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                topic_id, path, resolution, bucket = key
+                created.append(MQTTRollup(
+                    topic_id=topic_id, field=path, resolution=resolution, bucket=bucket,
+                    count=count, sum=total, min=low, max=high,
+                    last=last, last_timestamp=last_timestamp,
+                ))
+                continue
+            rollup.count += count
+            rollup.sum += total
+            rollup.min = min(rollup.min, low)
+            rollup.max = max(rollup.max, high)
+            if last_timestamp >= rollup.last_timestamp:
+                rollup.last = last
+                rollup.last_timestamp = last_timestamp
+            updated.append(rollup)
+        MQTTRollup.objects.bulk_create(created)
+        MQTTRollup.objects.bulk_update(
+            updated, ['count', 'sum', 'min', 'max', 'last', 'last_timestamp']
+        )
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.flush_interval):
+                close_old_connections()
+                self.flush()
+            self.flush()
+        finally:
+            connection.close()
+
+    def get_stats(self):
+        """Get rollup statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'rollup_pending': pending,
+            'rollup_flushed': self.flushed_count,
+            'rollup_failed_flushes': self.failed_flushes,
+        }
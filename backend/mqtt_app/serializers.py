@@ -2,29 +2,110 @@
 Serializers for MQTT app
 """
 from rest_framework import serializers
-from .models import MQTTMessage, MQTTConfig
+from .models import MQTTMessage, MQTTConfig, MQTTTopic, MQTTRollup
 
 
 class MQTTMessageSerializer(serializers.ModelSerializer):
     """Serializer for MQTT messages"""
+    topic = serializers.SlugRelatedField(slug_field='name', queryset=MQTTTopic.objects.all())
+    # Decompressed transparently; binary payloads are base64 with payload_encoding 'base64'
+    payload = serializers.CharField()
+    payload_encoding = serializers.CharField(read_only=True, allow_null=True)
+    
     class Meta:
         model = MQTTMessage
-        fields = ['id', 'topic', 'payload', 'qos', 'timestamp']
+        fields = ['id', 'topic', 'payload', 'payload_encoding', 'qos', 'timestamp']
         read_only_fields = ['id', 'timestamp']
 
 
+class MQTTRollupSerializer(serializers.ModelSerializer):
+    """Serializer for time-bucket rollups"""
+    topic = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    resolution = serializers.SerializerMethodField()
+    avg = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = MQTTRollup
+        fields = ['topic', 'field', 'resolution', 'bucket', 'count', 'min', 'max', 'avg', 'last']
+    
+    def get_resolution(self, obj):
+        names = {seconds: name for name, seconds in MQTTRollup.RESOLUTIONS.items()}
+        return names.get(obj.resolution, f'{obj.resolution}s')
+
+
 class MQTTConfigSerializer(serializers.ModelSerializer):
     """Serializer for MQTT configuration"""
     class Meta:
         model = MQTTConfig
-        fields = ['id', 'broker_host', 'broker_port', 'username', 'topics', 'is_active', 'updated_at']
+        fields = [
+            'id', 'broker_host', 'broker_port', 'username', 'password', 'use_tls', 'tls_insecure',
+            'client_id', 'topics', 'is_active', 'updated_at',
+        ]
         read_only_fields = ['id', 'updated_at']
+        extra_kwargs = {'password': {'write_only': True}}
+
+
+class MQTTBrokerStatusSerializer(serializers.Serializer):
+    """Serializer for the status of one broker connection"""
+    id = serializers.IntegerField(allow_null=True, help_text="MQTTConfig ID, null for the broker from settings")
+    broker_host = serializers.CharField()
+    broker_port = serializers.IntegerField()
+    topics = serializers.ListField(child=serializers.CharField())
+    client_id = serializers.CharField()
+    connected = serializers.BooleanField()
+    session_present = serializers.BooleanField(help_text="Whether the broker resumed a persistent session")
+    received = serializers.IntegerField()
+    duplicates = serializers.IntegerField(help_text="QoS 1 redeliveries dropped")
+    connects = serializers.IntegerField()
+    disconnects = serializers.IntegerField(help_text="Unexpected connection losses")
+    last_recovery_seconds = serializers.FloatField(allow_null=True, help_text="Time from the last connection loss to reconnecting")
+    last_error = serializers.CharField(allow_null=True)
 
 
 class MQTTStatusSerializer(serializers.Serializer):
-    """Serializer for MQTT connection status"""
+    """Serializer for MQTT connection status (ingest engine fields are left out when the process runs none)"""
     connected = serializers.BooleanField()
+    engine = serializers.CharField(allow_null=True, help_text="Ingest engine of this process, null when it runs none")
+    ingest_mode = serializers.CharField()
+    leader = serializers.BooleanField(allow_null=True)
     broker_host = serializers.CharField()
     broker_port = serializers.IntegerField()
     topics = serializers.ListField(child=serializers.CharField())
+    brokers = MQTTBrokerStatusSerializer(many=True)
+    db_pending = serializers.IntegerField(required=False)
+    db_max_pending = serializers.IntegerField(required=False)
+    db_overflow = serializers.CharField(required=False)
+    db_flushed = serializers.IntegerField(required=False)
+    db_failed_flushes = serializers.IntegerField(required=False)
+    db_dropped = serializers.IntegerField(required=False)
+    payload_compression = serializers.CharField(required=False)
+    payload_raw_bytes = serializers.IntegerField(required=False)
+    payload_stored_bytes = serializers.IntegerField(required=False)
+    queue_depth = serializers.IntegerField(required=False)
+    queue_capacity = serializers.IntegerField(required=False)
+    queue_overflow = serializers.CharField(required=False)
+    workers = serializers.IntegerField(required=False)
+    processed = serializers.IntegerField(required=False)
+    dropped = serializers.IntegerField(required=False)
+    failed = serializers.IntegerField(required=False)
+    broadcast_batching = serializers.BooleanField(required=False)
+    broadcast_pending = serializers.IntegerField(required=False)
+    broadcast_events = serializers.IntegerField(required=False)
+    broadcast_messages = serializers.IntegerField(required=False)
+    relay_running = serializers.BooleanField()
+    relay_messages = serializers.IntegerField()
+    subscribed_clients = serializers.IntegerField()
+    last_value_topics = serializers.IntegerField()
+    last_value_bytes = serializers.IntegerField()
+    last_value_evicted = serializers.IntegerField()
+    replay_epoch = serializers.CharField()
+    replay_last_seq = serializers.IntegerField()
+    replay_buffered = serializers.IntegerField()
+    retention_enabled = serializers.BooleanField(required=False)
+    retention_last_run = serializers.DateTimeField(required=False, allow_null=True)
+    retention_last_deleted = serializers.IntegerField(required=False)
+    retention_total_deleted = serializers.IntegerField(required=False)
+    rollup_pending = serializers.IntegerField(required=False)
+    rollup_flushed = serializers.IntegerField(required=False)
+    rollup_failed_flushes = serializers.IntegerField(required=False)
 
@@ -0,0 +1,15 @@
+"""
+Signal handlers applying configuration changes to the running ingest engine
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import MQTTConfig
+
+
+@receiver(post_save, sender=MQTTConfig)
+@receiver(post_delete, sender=MQTTConfig)
+def config_changed(sender, **kwargs):
+    """Reconnect the brokers of this process once the change is committed"""
+    from .mqtt_client import reload_brokers
+    transaction.on_commit(reload_brokers)
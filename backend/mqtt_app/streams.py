@@ -0,0 +1,166 @@
+"""
+Per-connection delta encoding and rate limiting of topic streams
+"""
+from collections import namedtuple
+from .broadcast import MESSAGE_FRAME
+from .json_codec import codec
+from .topics import TopicTrie
+
+DELTA_FRAME = '{"type":"mqtt_delta","data":%s}'
+
+# Topics whose matching options are remembered per connection
+MAX_RESOLVED_TOPICS = 10000
+
+
+class InvalidStreamOptions(ValueError):
+    """Raised when a subscription asks for invalid stream options"""
+
+
+class StreamOptions(namedtuple('StreamOptions', 'delta max_rate_ms')):
+    """How a subscription wants the messages of its topics delivered"""
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, delta=False, max_rate_ms=None):
+        """Validate client supplied options; None when every full message is wanted"""
+        if not isinstance(delta, bool):
+            raise InvalidStreamOptions("'delta' must be true or false")
+        if max_rate_ms is not None and (
+            isinstance(max_rate_ms, bool) or not isinstance(max_rate_ms, (int, float)) or max_rate_ms < 0
+        ):
+            raise InvalidStreamOptions("'max_rate_ms' must be a non-negative number of milliseconds")
+        if not delta and not max_rate_ms:
+            return None
+        return cls(delta, max_rate_ms or 0)
+
+    def as_dict(self):
+        return {'delta': self.delta, 'max_rate_ms': self.max_rate_ms}
+
+
+_NOTHING = object()
+
+
+class _TopicState:
+    __slots__ = ('payload', 'sent_at', 'pending', 'timer')
+
+    def __init__(self):
+        self.payload = _NOTHING  # Payload last sent (delta mode)
+        self.sent_at = None
+        self.pending = None  # Newest (data, frame) held back by the rate limit
+        self.timer = None
+
+
+class TopicStreams:
+    """
+    Delta and rate limit state of one WebSocket connection.
+
+    Subscriptions may ask for ``delta`` (after the first full message of a
+    topic, send only the top-level payload fields that changed, and nothing
+    when none did) and ``max_rate_ms`` (at most one frame per topic per
+    interval; held-back messages are replaced by newer ones and the latest
+    is sent when the interval ends). Only topics matching such a
+    subscription keep state: the payload last sent and the time of the last
+    frame, plus the held-back message and its timer.
+
+    emit(frame, topic) queues a frame; topic is None for frames that must
+    not be conflated with later ones.
+    """
+
+    def __init__(self, emit, loop):
+        self.emit = emit
+        self.loop = loop
+        self._options = {}
+        self._trie = TopicTrie()
+        self._resolved = {}
+        self._topics = {}
+
+    def __bool__(self):
+        return bool(self._options)
+
+    def set(self, filters, options):
+        """Use options (None for plain delivery) for the topics of these filters"""
+        for topic_filter in filters:
+            if self._options.pop(topic_filter, None) is not None:
+                self._trie.remove(topic_filter, topic_filter)
+            if options is not None:
+                self._options[topic_filter] = options
+                self._trie.add(topic_filter, topic_filter)
+        # Start over: held-back messages go out now and delta topics restart with a full message
+        self._resolved.clear()
+        self.close(flush=True)
+
+    def describe(self):
+        """The options of every filter that has some, for the client"""
+        return {topic_filter: options.as_dict() for topic_filter, options in sorted(self._options.items())}
+
+    def options_for(self, topic):
+        """The options of the most specific matching filter, or None"""
+        try:
+            return self._resolved[topic]
+        except KeyError:
+            pass
+        matched = self._trie.match(topic) if self._options else ()
+        options = self._options[max(matched, key=len)] if matched else None
+        if len(self._resolved) < MAX_RESOLVED_TOPICS:
+            self._resolved[topic] = options
+        return options
+
+    def offer(self, data, options, frame=None):
+        """Deliver a message (decoded data object, and its frame if at hand) according to options"""
+        topic = data['topic']
+        state = self._topics.get(topic)
+        if state is None:
+            state = self._topics[topic] = _TopicState()
+        if options.max_rate_ms and state.sent_at is not None:
+            wait = state.sent_at + options.max_rate_ms / 1000 - self.loop.time()
+            if wait > 0:
+                state.pending = (data, frame)
+                if state.timer is None:
+                    state.timer = self.loop.call_later(wait, self._release, topic, options)
+                return
+        self._send(topic, state, data, frame, options)
+
+    def _release(self, topic, options):
+        state = self._topics.get(topic)
+        if state is None or state.pending is None:
+            return
+        state.timer = None
+        (data, frame), state.pending = state.pending, None
+        self._send(topic, state, data, frame, options)
+
+    def _send(self, topic, state, data, frame, options):
+        if options.delta:
+            payload = data.get('payload')
+            previous, state.payload = state.payload, payload
+            if previous is not _NOTHING and isinstance(payload, dict) and isinstance(previous, dict):
+                changes = {key: value for key, value in payload.items() if previous.get(key, _NOTHING) != value}
+                removed = [key for key in previous if key not in payload]
+                if not changes and not removed:
+                    return
+                delta = {key: value for key, value in data.items() if key != 'payload'}
+                delta['changes'] = changes
+                if removed:
+                    delta['removed'] = removed
+                state.sent_at = self.loop.time()
+                # Deltas build on each other, so they are never conflated
+                self.emit(DELTA_FRAME % codec.dumps(delta), None)
+                return
+            if previous is not _NOTHING and payload == previous:
+                return
+        state.sent_at = self.loop.time()
+        self.emit(frame or MESSAGE_FRAME % codec.dumps(data), None if options.delta else topic)
+
+    def reset_deltas(self):
+        """Send the next message of every delta topic in full (after frames to the client were lost)"""
+        for state in self._topics.values():
+            state.payload = _NOTHING
+
+    def close(self, flush=False):
+        """Cancel the rate limit timers, sending what they held back if flush, and forget all state"""
+        topics, self._topics = self._topics, {}
+        for topic, state in topics.items():
+            if state.timer is not None:
+                state.timer.cancel()
+            if flush and state.pending is not None:
+                data, frame = state.pending
+                self.emit(frame or MESSAGE_FRAME % codec.dumps(data), topic)
@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from mqtt_app.models import MQTTMessage, MQTTTopic
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        topic = MQTTTopic.objects.create(name='flash/sirens/1/status')
+        now = timezone.now()
+        # Pairs of messages share a timestamp, so pages have to break ties on the ID
+        MQTTMessage.objects.bulk_create([
+            MQTTMessage(topic=topic, payload_data=str(i).encode(), timestamp=now - timedelta(seconds=i // 2))
+            for i in range(7)
+        ])
+        cls.expected = list(MQTTMessage.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+    def test_pages_follow_each_other_without_gaps_or_repeats(self):
+        client = APIClient()
+        url = '/api/mqtt/messages/?page_size=2'
+        seen = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen.extend(message['id'] for message in page['results'])
+            url = page['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = APIClient().get('/api/mqtt/messages/?cursor=bm90IGEgY3Vyc29y')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,64 @@
+from unittest import mock
+from django.db import DatabaseError
+from django.test import TestCase
+from mqtt_app.models import MQTTMessage, MQTTTopic
+from mqtt_app.persistence import MessageWriteBuffer
+
+
+class MessageWriteBufferTests(TestCase):
+
+    def setUp(self):
+        # Topic IDs are cached per process; the rows are rolled back after every test
+        MQTTTopic.objects._ids.clear()
+
+    def fail_writes(self, times):
+        """Make the next `times` bulk inserts of messages fail"""
+        bulk_create = MQTTMessage.objects.bulk_create
+        calls = {'count': 0}
+
+        def flaky(*args, **kwargs):
+            calls['count'] += 1
+            if calls['count'] <= times:
+                raise DatabaseError('database is locked')
+            return bulk_create(*args, **kwargs)
+        return mock.patch.object(MQTTMessage.objects, 'bulk_create', side_effect=flaky)
+
+    def test_failed_batch_is_retried(self):
+        buffer = MessageWriteBuffer(batch_size=10, max_retries=3)
+        buffer.add('a/1', b'one', 0)
+        buffer.add('a/2', b'two', 1)
+        with self.fail_writes(1), self.assertLogs('mqtt_app.persistence', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+            buffer.add('a/3', b'three', 0)
+            # The failed batch goes first and alone
+            self.assertEqual(buffer.flush(), 2)
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.failed_flushes, 1)
+        self.assertEqual(buffer.dropped_count, 0)
+        self.assertEqual(
+            sorted(bytes(data) for data in MQTTMessage.objects.values_list('payload_data', flat=True)),
+            [b'one', b'three', b'two'],
+        )
+
+    def test_batch_is_dropped_after_max_retries(self):
+        buffer = MessageWriteBuffer(batch_size=10, max_retries=2)
+        buffer.add('a/1', b'one', 0)
+        with self.fail_writes(3), self.assertLogs('mqtt_app.persistence', 'ERROR') as logs:
+            for _ in range(3):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertIn('Dropped 1 messages', logs.output[-1])
+        self.assertEqual(buffer.dropped_count, 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertFalse(MQTTMessage.objects.exists())
+
+    def test_drop_oldest_makes_room_when_full(self):
+        buffer = MessageWriteBuffer(batch_size=2, max_pending=2)
+        with self.assertLogs('mqtt_app.persistence', 'ERROR'):
+            for index in range(3):
+                buffer.add('a/1', str(index).encode(), 0)
+        self.assertEqual(buffer.dropped_count, 1)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(
+            sorted(bytes(data) for data in MQTTMessage.objects.values_list('payload_data', flat=True)),
+            [b'1', b'2'],
+        )
@@ -0,0 +1,55 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from mqtt_app.models import MQTTMessage, MQTTTopic
+from mqtt_app.retention import RetentionPolicy, delete_in_chunks
+
+
+class RetentionPolicyTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.topics = {name: MQTTTopic.objects.create(name=name) for name in ('a/1', 'a/2', 'b/1')}
+        # Ten messages per topic, one second apart, the newest now
+        MQTTMessage.objects.bulk_create([
+            MQTTMessage(topic=topic, payload_data=b'x', timestamp=now - timedelta(seconds=age, milliseconds=1))
+            for topic in self.topics.values()
+            for age in range(10)
+        ])
+
+    def count(self, name):
+        return MQTTMessage.objects.filter(topic=self.topics[name]).count()
+
+    def test_global_max_rows_keeps_the_newest(self):
+        deleted = RetentionPolicy(max_rows=12, chunk_size=5).apply()
+        self.assertEqual(deleted, 18)
+        self.assertEqual([self.count(name) for name in ('a/1', 'a/2', 'b/1')], [4, 4, 4])
+
+    def test_max_rows_breaks_timestamp_ties_by_id(self):
+        # The three topics' messages share timestamps; of the 4th newest, the two highest IDs stay
+        RetentionPolicy(max_rows=11).apply()
+        self.assertEqual([self.count(name) for name in ('a/1', 'a/2', 'b/1')], [3, 4, 4])
+
+    def test_global_max_age(self):
+        RetentionPolicy(max_age=5, chunk_size=4).apply()
+        self.assertEqual([self.count(name) for name in ('a/1', 'a/2', 'b/1')], [5, 5, 5])
+
+    def test_rule_applies_instead_of_global_limits(self):
+        policy = RetentionPolicy(max_age=3, rules=[{'topic': 'a/+', 'max_rows': 4}], chunk_size=3)
+        deleted = policy.apply()
+        # a/1 and a/2 keep their four newest together; b/1 keeps three seconds
+        self.assertEqual(self.count('a/1') + self.count('a/2'), 4)
+        self.assertEqual(self.count('b/1'), 3)
+        self.assertEqual(deleted, 16 + 7)
+
+    def test_first_matching_rule_wins(self):
+        rules = [{'topic': 'a/1', 'max_rows': 2}, {'topic': 'a/#', 'max_rows': 5}]
+        RetentionPolicy(rules=rules).apply()
+        self.assertEqual(self.count('a/1'), 2)
+        self.assertEqual(self.count('a/2'), 5)
+        self.assertEqual(self.count('b/1'), 10)
+
+    def test_delete_in_chunks(self):
+        deleted = delete_in_chunks(MQTTMessage.objects.filter(topic=self.topics['b/1']), chunk_size=3)
+        self.assertEqual(deleted, 10)
+        self.assertEqual(MQTTMessage.objects.count(), 20)
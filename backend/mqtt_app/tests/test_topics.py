@@ -0,0 +1,78 @@
+from django.test import SimpleTestCase, TestCase
+from mqtt_app.filters import topics_matching
+from mqtt_app.models import MQTTTopic
+from mqtt_app.topics import InvalidTopicFilter, SubscriptionRegistry, TopicTrie, topic_matches, validate_filter
+
+TOPICS = [
+    'a', 'a/b', 'a/b/c', 'a/', 'a//c', 'ab/c', 'a/bc', 'a/b.c', '/a', '/',
+    '$SYS', '$SYS/broker/uptime', 'flash/sirens/1/status', 'flash/sirens/2/status',
+]
+FILTERS = ['#', '+', 'a/#', 'a/+', 'a/+/c', '+/b/#', '+/#', '/#', '+/+', 'a/b.c', '$SYS/#', 'flash/sirens/+/status']
+
+
+class TopicTrieTests(SimpleTestCase):
+
+    def test_single_level_wildcard_matches_one_level(self):
+        self.assertTrue(topic_matches('a/+/c', 'a/b/c'))
+        self.assertTrue(topic_matches('a/+', 'a/'))
+        self.assertFalse(topic_matches('a/+', 'a/b/c'))
+        self.assertFalse(topic_matches('a/+', 'a'))
+
+    def test_multi_level_wildcard_matches_parent_and_children(self):
+        self.assertTrue(topic_matches('a/#', 'a'))
+        self.assertTrue(topic_matches('a/#', 'a/b/c'))
+        self.assertFalse(topic_matches('a/#', 'ab/c'))
+
+    def test_first_level_wildcards_skip_dollar_topics(self):
+        self.assertFalse(topic_matches('#', '$SYS/broker/uptime'))
+        self.assertFalse(topic_matches('+/broker/uptime', '$SYS/broker/uptime'))
+        self.assertTrue(topic_matches('$SYS/#', '$SYS/broker/uptime'))
+
+    def test_match_returns_keys_of_every_matching_filter(self):
+        trie = TopicTrie()
+        trie.add('a/#', 1)
+        trie.add('a/+/c', 2)
+        trie.add('a/b/c', 3)
+        trie.add('x/#', 4)
+        self.assertEqual(trie.match('a/b/c'), {1, 2, 3})
+
+    def test_remove_prunes_empty_branches(self):
+        trie = TopicTrie()
+        trie.add('a/b/c', 1)
+        trie.add('a/+', 2)
+        trie.remove('a/b/c', 1)
+        self.assertEqual(trie.match('a/b/c'), set())
+        self.assertEqual(trie.match('a/b'), {2})
+        trie.remove('a/+', 2)
+        self.assertFalse(trie)
+
+    def test_registry_replaces_filters(self):
+        registry = SubscriptionRegistry()
+        registry.set_filters('ws-1', {'a/#'})
+        registry.set_filters('ws-1', {'b/+'})
+        self.assertEqual(registry.match('a/x'), set())
+        self.assertEqual(registry.match('b/x'), {'ws-1'})
+        registry.discard('ws-1')
+        self.assertEqual(len(registry), 0)
+
+    def test_invalid_filters_are_rejected(self):
+        for topic_filter in ('', 'a/#/b', 'a/b#', 'a/+b'):
+            with self.subTest(topic_filter=topic_filter):
+                with self.assertRaises(InvalidTopicFilter):
+                    validate_filter(topic_filter)
+
+
+class TopicsMatchingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        MQTTTopic.objects.bulk_create([MQTTTopic(name=name) for name in TOPICS])
+
+    def test_database_matching_agrees_with_trie(self):
+        for topic_filter in FILTERS:
+            with self.subTest(topic_filter=topic_filter):
+                matched = set(topics_matching(topic_filter).values_list('name', flat=True))
+                self.assertEqual(matched, {name for name in TOPICS if topic_matches(topic_filter, name)})
+
+    def test_exact_topic(self):
+        self.assertEqual(list(topics_matching('a/b').values_list('name', flat=True)), ['a/b'])
@@ -0,0 +1,135 @@
+"""
+MQTT topic filter matching with a topic trie
+"""
+import threading
+
+
+class InvalidTopicFilter(ValueError):
+    """Raised when a topic filter is not a valid MQTT filter"""
+
+
+def validate_filter(topic_filter):
+    """Check a topic filter against the MQTT wildcard rules and return it"""
+    if not isinstance(topic_filter, str) or not topic_filter:
+        raise InvalidTopicFilter("Topic filter must be a non-empty string")
+    levels = topic_filter.split('/')
+    for index, level in enumerate(levels):
+        if '#' in level and (level != '#' or index != len(levels) - 1):
+            raise InvalidTopicFilter(f"'#' must be the last level on its own: {topic_filter}")
+        if '+' in level and level != '+':
+            raise InvalidTopicFilter(f"'+' must occupy a whole level: {topic_filter}")
+    return topic_filter
+
+
+def topic_matches(topic_filter, topic):
+    """Check whether a single topic matches a single filter"""
+    trie = TopicTrie()
+    trie.add(topic_filter, True)
+    return bool(trie.match(topic))
+
+
+class _Node:
+    __slots__ = ('children', 'keys')
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+
+
+class TopicTrie:
+    """
+    Maps MQTT topic filters to subscriber keys.
+
+    Matching walks at most one literal, one '+' and one '#' branch per topic level,
+    so its cost depends on the topic depth rather than the number of filters.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, topic_filter, key):
+        """Register key under topic_filter"""
+        node = self._root
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, _Node())
+        node.keys.add(key)
+
+    def remove(self, topic_filter, key):
+        """Unregister key from topic_filter, pruning empty branches"""
+        path = [self._root]
+        for level in topic_filter.split('/'):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].keys.discard(key)
+        levels = topic_filter.split('/')
+        for depth in range(len(levels), 0, -1):
+            node = path[depth]
+            if node.keys or node.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+
+    def match(self, topic):
+        """Return the set of keys whose filters match topic"""
+        levels = topic.split('/')
+        result = set()
+        # Wildcards at the first level never match topics starting with '$' (e.g. $SYS)
+        self._match(self._root, levels, 0, result, not topic.startswith('$'))
+        return result
+
+    def _match(self, node, levels, depth, result, wildcards):
+        multi = node.children.get('#') if wildcards else None
+        if multi is not None:
+            # 'a/#' matches 'a' itself as well as everything below it
+            result.update(multi.keys)
+        if depth == len(levels):
+            result.update(node.keys)
+            return
+        child = node.children.get(levels[depth])
+        if child is not None:
+            self._match(child, levels, depth + 1, result, True)
+        single = node.children.get('+') if wildcards else None
+        if single is not None:
+            self._match(single, levels, depth + 1, result, True)
+
+    def __bool__(self):
+        return bool(self._root.children)
+
+
+class SubscriptionRegistry:
+    """Thread-safe registry of per-connection topic filters"""
+
+    def __init__(self):
+        self._trie = TopicTrie()
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    def set_filters(self, key, filters):
+        """Replace the filters registered for key"""
+        filters = set(filters)
+        with self._lock:
+            current = self._filters.get(key, set())
+            for topic_filter in current - filters:
+                self._trie.remove(topic_filter, key)
+            for topic_filter in filters - current:
+                self._trie.add(topic_filter, key)
+            if filters:
+                self._filters[key] = filters
+            else:
+                self._filters.pop(key, None)
+
+    def discard(self, key):
+        """Remove every filter registered for key"""
+        self.set_filters(key, ())
+
+    def match(self, topic):
+        """Return the keys subscribed to topic"""
+        with self._lock:
+            if not self._filters:
+                return set()
+            return self._trie.match(topic)
+
+    def __len__(self):
+        return len(self._filters)
+
@@ -12,6 +12,8 @@ router.register(r'config', views.MQTTConfigViewSet, basename='mqttconfig')
 urlpatterns = [
     path('mqtt/', include(router.urls)),
     path('mqtt/status/', views.mqtt_status, name='mqtt-status'),
+    path('mqtt/latest/', views.latest_values, name='latest-values'),
+    path('mqtt/aggregates/', views.aggregates, name='aggregates'),
     path('mqtt/clear-history/', views.clear_history, name='clear-history'),
 ]
 
@@ -3,11 +3,22 @@ Views for MQTT app
 """
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
 from django.utils import timezone
-from .models import MQTTMessage, MQTTConfig
-from .serializers import MQTTMessageSerializer, MQTTConfigSerializer, MQTTStatusSerializer
-from .mqtt_client import get_mqtt_client
+from .models import MQTTMessage, MQTTConfig, MQTTRollup
+from .serializers import MQTTMessageSerializer, MQTTConfigSerializer, MQTTStatusSerializer, MQTTRollupSerializer
+from .mqtt_client import get_process_status
+from .last_values import last_values
+from .metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .topics import validate_filter, InvalidTopicFilter
+from .filters import filter_messages, filter_rollups, parse_int_param
+from .pagination import KeysetPagination
+from .retention import delete_in_chunks
+from .export import EXPORT_FORMATS, export_response
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 import logging
@@ -19,26 +30,34 @@ class MQTTMessageViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing MQTT messages (history)
     
-    list: Get list of MQTT messages (paginated)
+    list: Get list of MQTT messages (cursor paginated, newest first)
     retrieve: Get a specific MQTT message by ID
+    export: Stream the filtered history as NDJSON or CSV
     """
-    queryset = MQTTMessage.objects.all()
+    queryset = MQTTMessage.objects.select_related('topic')
     serializer_class = MQTTMessageSerializer
+    pagination_class = KeysetPagination
     
     @swagger_auto_schema(
-        operation_description="Get list of MQTT messages (history)",
+        operation_description=(
+            "Get list of MQTT messages (history), newest first. Follow `next` to page. "
+            "Filter by indexed payload fields (MQTT_PAYLOAD_INDEX_FIELDS) with `payload.<key>=<value>`, "
+            "e.g. `?payload.status=alert&payload.vin=VIN123`."
+        ),
         manual_parameters=[
-            openapi.Parameter('topic', openapi.IN_QUERY, description="Filter by topic", type=openapi.TYPE_STRING),
+            openapi.Parameter('topic', openapi.IN_QUERY, description="Exact topic or MQTT filter with + / # wildcards", type=openapi.TYPE_STRING),
+            openapi.Parameter('topic_prefix', openapi.IN_QUERY, description="Topics starting with this prefix", type=openapi.TYPE_STRING),
+            openapi.Parameter('topic_contains', openapi.IN_QUERY, description="Topics containing this text (case-insensitive)", type=openapi.TYPE_STRING),
+            openapi.Parameter('since', openapi.IN_QUERY, description="Only messages at or after this ISO 8601 time", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+            openapi.Parameter('until', openapi.IN_QUERY, description="Only messages before this ISO 8601 time", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+            openapi.Parameter('after_id', openapi.IN_QUERY, description="Only messages with a greater ID (incremental polling)", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor from a previous `next` link", type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description="Results per page (max 1000)", type=openapi.TYPE_INTEGER),
         ]
     )
     def list(self, request, *args, **kwargs):
-        """Get list of MQTT messages with optional topic filter"""
-        queryset = self.get_queryset()
-        
-        # Filter by topic if provided
-        topic = request.query_params.get('topic', None)
-        if topic:
-            queryset = queryset.filter(topic__icontains=topic)
+        """Get list of MQTT messages with optional topic and time filters"""
+        queryset = filter_messages(self.get_queryset(), request.query_params)
         
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -47,6 +66,35 @@ class MQTTMessageViewSet(viewsets.ReadOnlyModelViewSet):
         
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+    
+    @swagger_auto_schema(
+        operation_description=(
+            "Stream the filtered message history, oldest first, as NDJSON (default) or CSV. "
+            "Accepts the same `payload.<key>=<value>` filters as the list."
+        ),
+        manual_parameters=[
+            openapi.Parameter('export_format', openapi.IN_QUERY, description="ndjson (default) or csv", type=openapi.TYPE_STRING),
+            openapi.Parameter('topic', openapi.IN_QUERY, description="Exact topic or MQTT filter with + / # wildcards", type=openapi.TYPE_STRING),
+            openapi.Parameter('topic_prefix', openapi.IN_QUERY, description="Topics starting with this prefix", type=openapi.TYPE_STRING),
+            openapi.Parameter('topic_contains', openapi.IN_QUERY, description="Topics containing this text (case-insensitive)", type=openapi.TYPE_STRING),
+            openapi.Parameter('since', openapi.IN_QUERY, description="Only messages at or after this ISO 8601 time", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+            openapi.Parameter('until', openapi.IN_QUERY, description="Only messages before this ISO 8601 time", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+            openapi.Parameter('after_id', openapi.IN_QUERY, description="Only messages with a greater ID", type=openapi.TYPE_INTEGER),
+        ],
+        responses={200: openapi.Response(description="NDJSON or CSV stream")}
+    )
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered message history in constant memory"""
+        # 'format' is reserved by DRF for renderer selection
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': f"Expected one of {', '.join(EXPORT_FORMATS)}"})
+        queryset = filter_messages(MQTTMessage.objects.all(), request.query_params)
+        return export_response(
+            request._request, queryset, export_format,
+            chunk_size=getattr(settings, 'MQTT_EXPORT_CHUNK_SIZE', 2000),
+        )
 
 
 class MQTTConfigViewSet(viewsets.ModelViewSet):
@@ -69,8 +117,7 @@ class MQTTConfigViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def status(self, request):
         """Get current MQTT connection status"""
-        mqtt_client = get_mqtt_client()
-        status_data = mqtt_client.get_status()
+        status_data = get_process_status()
         serializer = MQTTStatusSerializer(status_data)
         return Response(serializer.data)
 
@@ -83,8 +130,7 @@ class MQTTConfigViewSet(viewsets.ModelViewSet):
 @api_view(['GET'])
 def mqtt_status(request):
     """Get MQTT connection status"""
-    mqtt_client = get_mqtt_client()
-    status_data = mqtt_client.get_status()
+    status_data = get_process_status()
     serializer = MQTTStatusSerializer(status_data)
     return Response(serializer.data)
 
@@ -97,9 +143,63 @@ def mqtt_status(request):
 @api_view(['POST'])
 def clear_history(request):
     """Clear all MQTT message history"""
-    deleted_count, _ = MQTTMessage.objects.all().delete()
+    # Delete in bounded batches so ingest is never locked out for long
+    deleted_count = delete_in_chunks(
+        MQTTMessage.objects.all(),
+        chunk_size=getattr(settings, 'MQTT_RETENTION_BATCH_SIZE', 1000),
+    )
     return Response({
         'message': f'Deleted {deleted_count} messages from history',
         'deleted_count': deleted_count
     }, status=status.HTTP_200_OK)
 
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Get the latest message of every topic from the in-memory cache",
+    manual_parameters=[
+        openapi.Parameter('topic', openapi.IN_QUERY, description="MQTT topic filter, e.g. flash/sirens/+/status", type=openapi.TYPE_STRING),
+    ],
+    responses={200: MQTTMessageSerializer(many=True)}
+)
+@api_view(['GET'])
+def latest_values(request):
+    """Get the latest message per topic without touching the database"""
+    topic = request.query_params.get('topic', None)
+    try:
+        filters = [validate_filter(topic)] if topic else None
+    except InvalidTopicFilter as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    # Cached entries are already JSON encoded
+    return HttpResponse('[%s]' % ','.join(last_values.snapshot(filters)), content_type='application/json')
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Get min/max/avg/count/last of numeric payload fields per time bucket, oldest first",
+    manual_parameters=[
+        openapi.Parameter('topic', openapi.IN_QUERY, description="Exact topic or MQTT filter with + / # wildcards", type=openapi.TYPE_STRING, required=True),
+        openapi.Parameter('field', openapi.IN_QUERY, description="Dot-separated payload field path (default: all configured fields)", type=openapi.TYPE_STRING),
+        openapi.Parameter('resolution', openapi.IN_QUERY, description="Bucket size: 1s, 1m (default) or 1h", type=openapi.TYPE_STRING),
+        openapi.Parameter('since', openapi.IN_QUERY, description="Only buckets starting at or after this ISO 8601 time", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+        openapi.Parameter('until', openapi.IN_QUERY, description="Only buckets starting before this ISO 8601 time", type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+        openapi.Parameter('limit', openapi.IN_QUERY, description="Maximum buckets returned (default 1000, max 10000)", type=openapi.TYPE_INTEGER),
+    ],
+    responses={200: MQTTRollupSerializer(many=True)}
+)
+@api_view(['GET'])
+def aggregates(request):
+    """Answer range queries from the rollup tables instead of scanning raw messages"""
+    queryset = filter_rollups(
+        MQTTRollup.objects.select_related('topic'), request.query_params
+    ).order_by('bucket', 'topic', 'field')
+    limit = min(max(parse_int_param(request.query_params, 'limit') or 1000, 1), 10000)
+    serializer = MQTTRollupSerializer(queryset[:limit], many=True)
+    return Response(serializer.data)
+
+
+@require_GET
+def prometheus_metrics(request):
+    """Expose ingest, latency and WebSocket metrics of this process in the Prometheus text format"""
+    # Plain Django view: scrapers expect text/plain, not a DRF renderer
+    return HttpResponse(metrics.render(get_process_status()), content_type=METRICS_CONTENT_TYPE)
@@ -28,7 +28,7 @@ export default function MQTTMessages() {
             <h3 className="text-lg font-semibold text-blue-900 mb-2">Latest Message</h3>
             <div className="text-sm">
               <p><span className="font-medium">Topic:</span> {lastMessage.topic}</p>
-              <p><span className="font-medium">Payload:</span> {typeof lastMessage.payload === 'object' ? JSON.stringify(lastMessage.payload) : lastMessage.payload}</p>
+              <p><span className="font-medium">Payload:</span> {lastMessage.payload instanceof Uint8Array ? `<${lastMessage.payload.length} bytes binary>` : typeof lastMessage.payload === 'object' ? JSON.stringify(lastMessage.payload) : lastMessage.payload}</p>
             </div>
           </div>
         )}
@@ -15,6 +15,9 @@ export default function MessageList({ messages, onClear }: MessageListProps) {
   };
 
   const formatPayload = (payload: any) => {
+    if (payload instanceof Uint8Array) {
+      return `<${payload.length} bytes binary>`;
+    }
     if (typeof payload === 'object') {
       return JSON.stringify(payload, null, 2);
     }
@@ -1,7 +1,19 @@
 import { useEffect, useRef, useState, useCallback } from 'react';
-import { WebSocketMessage, ConnectionStatus, MQTTMessage } from '@/types/mqtt';
+import {
+  WebSocketMessage,
+  WebSocketBatchMessage,
+  WebSocketReplayGapMessage,
+  WebSocketSlowConsumerMessage,
+  WebSocketDeltaMessage,
+  StreamOptions,
+  ConnectionStatus,
+  MQTTMessage,
+} from '@/types/mqtt';
+import { decodeFrame } from '@/lib/msgpack';
 
 const WS_URL = process.env.NEXT_PUBLIC_WS_URL || 'ws://localhost:8000/ws/mqtt/';
+// 'msgpack' asks the server for binary MessagePack frames instead of JSON text
+const WS_FORMAT = process.env.NEXT_PUBLIC_WS_FORMAT || 'json';
 
 interface UseWebSocketReturn {
   connectionStatus: ConnectionStatus;
@@ -9,47 +21,166 @@ interface UseWebSocketReturn {
   sendMessage: (message: any) => void;
   clearMessages: () => void;
   lastMessage: MQTTMessage | null;
+  latestValues: Record<string, MQTTMessage>;
+  subscribe: (topics: string[], options?: StreamOptions) => void;
+  unsubscribe: (topics: string[]) => void;
 }
 
-export function useWebSocket(): UseWebSocketReturn {
+// Topic filters are MQTT filters such as 'flash/sirens/+/status' or 'foo/#'.
+// Without any filters the server sends every topic.
+// After a reconnect, resume_from/epoch ask the server to replay what was missed.
+function buildUrl(topics: string[], epoch: string | null, lastSeq: number): string {
+  const params: string[] = [];
+  if (topics.length > 0) {
+    params.push(`topics=${topics.map(encodeURIComponent).join(',')}`);
+  }
+  if (epoch && lastSeq > 0) {
+    params.push(`resume_from=${lastSeq}`, `epoch=${encodeURIComponent(epoch)}`);
+  }
+  if (params.length === 0) {
+    return WS_URL;
+  }
+  const separator = WS_URL.includes('?') ? '&' : '?';
+  return `${WS_URL}${separator}${params.join('&')}`;
+}
+
+export function useWebSocket(initialTopics: string[] = []): UseWebSocketReturn {
   const [connectionStatus, setConnectionStatus] = useState<ConnectionStatus>('disconnected');
   const [messages, setMessages] = useState<MQTTMessage[]>([]);
   const [lastMessage, setLastMessage] = useState<MQTTMessage | null>(null);
+  // Latest message per topic, seeded by the snapshot sent on connect
+  const [latestValues, setLatestValues] = useState<Record<string, MQTTMessage>>({});
   const ws = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const reconnectAttempts = useRef(0);
   const maxReconnectAttempts = 5;
+  // Current filters, re-sent in the URL on every (re)connect
+  const topicsRef = useRef<string[]>(initialTopics);
+  // Stream options per topic filter; the URL only carries the filters, so they are re-sent on every (re)connect
+  const streamsRef = useRef<Record<string, StreamOptions>>({});
+  // Server epoch and highest sequence number seen, used to resume after a reconnect
+  const epochRef = useRef<string | null>(null);
+  const lastSeqRef = useRef(0);
+  // Highest sequence number covered by the replay after a resume; live messages
+  // up to it were already replayed. Live messages may arrive out of seq order,
+  // so they are only compared against this boundary, never against lastSeqRef.
+  const replayBoundaryRef = useRef(0);
+  // Last payload per topic, which mqtt_delta frames are applied to
+  const payloadsRef = useRef<Record<string, any>>({});
+
+  // Add live or replayed messages (oldest-first), skipping live ones the replay already contained
+  const receiveMessages = useCallback((incoming: MQTTMessage[], replayed = false) => {
+    const fresh = replayed
+      ? incoming
+      : incoming.filter((message) => message.seq === undefined || message.seq > replayBoundaryRef.current);
+    if (fresh.length === 0) {
+      return;
+    }
+    fresh.forEach((message) => {
+      if (message.seq !== undefined) {
+        lastSeqRef.current = Math.max(lastSeqRef.current, message.seq);
+      }
+      payloadsRef.current[message.topic] = message.payload;
+    });
+    const now = new Date().toISOString();
+    // The list is newest-first
+    const batch: MQTTMessage[] = fresh
+      .map((message) => ({ ...message, timestamp: message.timestamp || now }))
+      .reverse();
+    setLastMessage(batch[0]);
+    setMessages((prev) => [...batch, ...prev].slice(0, 1000)); // Keep last 1000 messages
+    setLatestValues((prev) => {
+      const next = { ...prev };
+      fresh.forEach((message) => {
+        next[message.topic] = message;
+      });
+      return next;
+    });
+  }, []);
 
   const connect = useCallback(() => {
     try {
       setConnectionStatus('connecting');
-      ws.current = new WebSocket(WS_URL);
+      const url = buildUrl(topicsRef.current, epochRef.current, lastSeqRef.current);
+      // Without msgpack support the server ignores the subprotocol and sends JSON text
+      ws.current = WS_FORMAT === 'msgpack' ? new WebSocket(url, ['mqtt.msgpack']) : new WebSocket(url);
+      ws.current.binaryType = 'arraybuffer';
 
       ws.current.onopen = () => {
         console.log('WebSocket connected');
         setConnectionStatus('connected');
         reconnectAttempts.current = 0;
+        // One subscribe message per distinct set of options
+        const groups: Record<string, string[]> = {};
+        Object.entries(streamsRef.current).forEach(([topic, options]) => {
+          const key = JSON.stringify(options);
+          groups[key] = [...(groups[key] || []), topic];
+        });
+        Object.entries(groups).forEach(([key, topics]) => {
+          ws.current?.send(JSON.stringify({ type: 'subscribe', topics, ...JSON.parse(key) }));
+        });
       };
 
+      // Binary frames are decoded asynchronously; chaining keeps frames in order
+      let frames = Promise.resolve();
       ws.current.onmessage = (event) => {
-        try {
-          const data: WebSocketMessage = JSON.parse(event.data);
-          
-          if (data.type === 'mqtt_message' && data.data) {
-            const mqttMessage: MQTTMessage = {
-              ...data.data,
-              timestamp: data.data.timestamp || new Date().toISOString(),
-            };
-            setLastMessage(mqttMessage);
-            setMessages((prev) => [mqttMessage, ...prev].slice(0, 1000)); // Keep last 1000 messages
-          } else if (data.type === 'connection') {
-            console.log('WebSocket connection established');
-          } else if (data.type === 'pong') {
-            console.log('Received pong');
+        frames = frames.then(async () => {
+          try {
+            const data: WebSocketMessage | WebSocketBatchMessage | WebSocketDeltaMessage | WebSocketReplayGapMessage | WebSocketSlowConsumerMessage =
+              typeof event.data === 'string' ? JSON.parse(event.data) : await decodeFrame(event.data);
+
+            if (data.type === 'snapshot') {
+              setLatestValues((prev) => {
+                const next = { ...prev };
+                data.data.forEach((message) => {
+                  next[message.topic] = message;
+                });
+                return next;
+              });
+            } else if (data.type === 'replay') {
+              data.data.forEach((message) => {
+                replayBoundaryRef.current = Math.max(replayBoundaryRef.current, message.seq ?? 0);
+              });
+              receiveMessages(data.data, true);
+            } else if (data.type === 'mqtt_batch') {
+              receiveMessages(data.data);
+            } else if (data.type === 'mqtt_message' && data.data) {
+              receiveMessages([data.data]);
+            } else if (data.type === 'mqtt_delta') {
+              const { changes, removed, ...message } = data.data;
+              const payload = { ...payloadsRef.current[message.topic], ...changes };
+              (removed || []).forEach((key) => {
+                delete payload[key];
+              });
+              receiveMessages([{ ...message, payload }]);
+            } else if (data.type === 'connection') {
+              console.log('WebSocket connection established');
+              if (data.epoch !== epochRef.current) {
+                // New server epoch: sequence numbers restart and nothing is replayed
+                epochRef.current = data.epoch || null;
+                lastSeqRef.current = 0;
+                replayBoundaryRef.current = 0;
+              } else {
+                // Everything up to the server's seq at connect is part of the replay
+                replayBoundaryRef.current = lastSeqRef.current > 0 ? data.seq || 0 : 0;
+              }
+              // A new connection starts every delta topic with a full message
+              payloadsRef.current = {};
+            } else if (data.type === 'replay_gap') {
+              console.warn(`Missed messages after seq ${data.requested} could not be replayed (${data.reason})`);
+            } else if (data.type === 'slow_consumer') {
+              console.warn(`Connection is too slow (${data.policy}): ${data.dropped} dropped, ${data.conflated} conflated, ${data.lag}s behind`);
+            } else if (data.type === 'pong') {
+              console.log('Received pong');
+            } else if (data.type === 'subscribed' || data.type === 'unsubscribed') {
+              topicsRef.current = data.topics || [];
+            } else if (data.type === 'error') {
+              console.error('WebSocket server error:', data.message);
+            }
+          } catch (error) {
+            console.error('Error parsing WebSocket message:', error);
           }
-        } catch (error) {
-          console.error('Error parsing WebSocket message:', error);
-        }
+        });
       };
 
       ws.current.onerror = (error) => {
@@ -79,7 +210,7 @@ export function useWebSocket(): UseWebSocketReturn {
       console.error('Error creating WebSocket connection:', error);
       setConnectionStatus('error');
     }
-  }, []);
+  }, [receiveMessages]);
 
   const sendMessage = useCallback((message: any) => {
     if (ws.current && ws.current.readyState === WebSocket.OPEN) {
@@ -89,6 +220,27 @@ export function useWebSocket(): UseWebSocketReturn {
     }
   }, []);
 
+  const subscribe = useCallback((topics: string[], options: StreamOptions = {}) => {
+    topicsRef.current = Array.from(new Set([...topicsRef.current, ...topics]));
+    topics.forEach((topic) => {
+      // Subscribing without options returns a filter to plain delivery
+      if (options.delta || options.max_rate_ms) {
+        streamsRef.current[topic] = options;
+      } else {
+        delete streamsRef.current[topic];
+      }
+    });
+    sendMessage({ type: 'subscribe', topics, ...options });
+  }, [sendMessage]);
+
+  const unsubscribe = useCallback((topics: string[]) => {
+    topicsRef.current = topicsRef.current.filter((topic) => !topics.includes(topic));
+    topics.forEach((topic) => {
+      delete streamsRef.current[topic];
+    });
+    sendMessage({ type: 'unsubscribe', topics });
+  }, [sendMessage]);
+
   const clearMessages = useCallback(() => {
     setMessages([]);
     setLastMessage(null);
@@ -124,6 +276,9 @@ export function useWebSocket(): UseWebSocketReturn {
     sendMessage,
     clearMessages,
     lastMessage,
+    latestValues,
+    subscribe,
+    unsubscribe,
   };
 }
 
@@ -0,0 +1,122 @@
+// Minimal MessagePack decoder for the server's mqtt.msgpack WebSocket frames.
+// Binary values decode to Uint8Array; 64-bit integers beyond 2^53 lose precision;
+// extension types (never sent by the server) are rejected.
+
+const textDecoder = new TextDecoder();
+
+class Reader {
+  private view: DataView;
+  private bytes: Uint8Array;
+  private offset = 0;
+
+  constructor(bytes: Uint8Array) {
+    this.bytes = bytes;
+    this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  }
+
+  done(): boolean {
+    return this.offset >= this.bytes.length;
+  }
+
+  private take(length: number): number {
+    const start = this.offset;
+    this.offset += length;
+    if (this.offset > this.bytes.length) {
+      throw new Error('MessagePack data is truncated');
+    }
+    return start;
+  }
+
+  private uint64(signed: boolean): number {
+    const start = this.take(8);
+    const high = signed ? this.view.getInt32(start) : this.view.getUint32(start);
+    return high * 4294967296 + this.view.getUint32(start + 4);
+  }
+
+  private str(length: number): string {
+    const start = this.take(length);
+    return textDecoder.decode(this.bytes.subarray(start, start + length));
+  }
+
+  private bin(length: number): Uint8Array {
+    const start = this.take(length);
+    return this.bytes.slice(start, start + length);
+  }
+
+  private array(length: number): any[] {
+    const result = new Array(length);
+    for (let i = 0; i < length; i++) {
+      result[i] = this.value();
+    }
+    return result;
+  }
+
+  private map(length: number): Record<string, any> {
+    const result: Record<string, any> = {};
+    for (let i = 0; i < length; i++) {
+      const key = this.value();
+      result[String(key)] = this.value();
+    }
+    return result;
+  }
+
+  value(): any {
+    const type = this.view.getUint8(this.take(1));
+    if (type <= 0x7f) return type;
+    if (type <= 0x8f) return this.map(type & 0x0f);
+    if (type <= 0x9f) return this.array(type & 0x0f);
+    if (type <= 0xbf) return this.str(type & 0x1f);
+    if (type >= 0xe0) return type - 0x100;
+
+    switch (type) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return this.bin(this.view.getUint8(this.take(1)));
+      case 0xc5: return this.bin(this.view.getUint16(this.take(2)));
+      case 0xc6: return this.bin(this.view.getUint32(this.take(4)));
+      case 0xca: return this.view.getFloat32(this.take(4));
+      case 0xcb: return this.view.getFloat64(this.take(8));
+      case 0xcc: return this.view.getUint8(this.take(1));
+      case 0xcd: return this.view.getUint16(this.take(2));
+      case 0xce: return this.view.getUint32(this.take(4));
+      case 0xcf: return this.uint64(false);
+      case 0xd0: return this.view.getInt8(this.take(1));
+      case 0xd1: return this.view.getInt16(this.take(2));
+      case 0xd2: return this.view.getInt32(this.take(4));
+      case 0xd3: return this.uint64(true);
+      case 0xd9: return this.str(this.view.getUint8(this.take(1)));
+      case 0xda: return this.str(this.view.getUint16(this.take(2)));
+      case 0xdb: return this.str(this.view.getUint32(this.take(4)));
+      case 0xdc: return this.array(this.view.getUint16(this.take(2)));
+      case 0xdd: return this.array(this.view.getUint32(this.take(4)));
+      case 0xde: return this.map(this.view.getUint16(this.take(2)));
+      case 0xdf: return this.map(this.view.getUint32(this.take(4)));
+      default:
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+  }
+}
+
+export function decodeMsgpack(bytes: Uint8Array): any {
+  const reader = new Reader(bytes);
+  const value = reader.value();
+  if (!reader.done()) {
+    throw new Error('Unexpected data after MessagePack value');
+  }
+  return value;
+}
+
+// Binary frames start with a flag byte: 0 = plain, 1 = zlib compressed
+const FLAG_ZLIB = 1;
+
+async function inflate(bytes: Uint8Array): Promise<Uint8Array> {
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+export async function decodeFrame(buffer: ArrayBuffer): Promise<any> {
+  const bytes = new Uint8Array(buffer);
+  const body = bytes.subarray(1);
+  return decodeMsgpack(bytes[0] === FLAG_ZLIB ? await inflate(body) : body);
+}
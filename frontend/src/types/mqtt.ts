@@ -1,22 +1,134 @@
 export interface MQTTMessage {
   id?: number;
+  seq?: number;
   topic: string;
-  payload: any;
+  payload: any; // Uint8Array for binary payloads in mqtt.msgpack frames
+  payload_encoding?: 'base64';
   qos: number;
   timestamp?: string;
 }
 
 export interface MQTTStatus {
   connected: boolean;
+  // null, and the engine fields absent, when the server process runs no ingest engine
+  engine: 'thread' | 'asyncio' | null;
+  ingest_mode: 'single' | 'shared' | 'leader';
+  leader: boolean | null;
   broker_host: string;
   broker_port: number;
   topics: string[];
+  brokers: MQTTBrokerStatus[];
+  db_pending?: number;
+  db_max_pending?: number;
+  db_overflow?: 'block' | 'drop_oldest' | 'drop_newest';
+  db_flushed?: number;
+  db_failed_flushes?: number;
+  db_dropped?: number;
+  payload_compression?: 'zlib' | 'none';
+  payload_raw_bytes?: number;
+  payload_stored_bytes?: number;
+  queue_depth?: number;
+  queue_capacity?: number;
+  queue_overflow?: 'block' | 'drop_oldest' | 'drop_newest';
+  workers?: number;
+  processed?: number;
+  dropped?: number;
+  failed?: number;
+  broadcast_batching?: boolean;
+  broadcast_pending?: number;
+  broadcast_events?: number;
+  broadcast_messages?: number;
+  relay_running: boolean;
+  relay_messages: number;
+  subscribed_clients: number;
+  last_value_topics: number;
+  last_value_bytes: number;
+  last_value_evicted: number;
+  replay_epoch: string;
+  replay_last_seq: number;
+  replay_buffered: number;
+  retention_enabled?: boolean;
+  retention_last_run: string | null;
+  retention_last_deleted?: number;
+  retention_total_deleted?: number;
+  rollup_pending?: number;
+  rollup_flushed?: number;
+  rollup_failed_flushes?: number;
+}
+
+export interface MQTTBrokerStatus {
+  id: number | null;
+  broker_host: string;
+  broker_port: number;
+  topics: string[];
+  client_id: string;
+  connected: boolean;
+  session_present: boolean;
+  received: number;
+  duplicates: number;
+  connects: number;
+  disconnects: number;
+  last_recovery_seconds: number | null;
+  last_error: string | null;
+}
+
+export interface MQTTRollup {
+  topic: string;
+  field: string;
+  resolution: '1s' | '1m' | '1h';
+  bucket: string;
+  count: number;
+  min: number;
+  max: number;
+  avg: number | null;
+  last: number;
 }
 
 export interface WebSocketMessage {
-  type: 'connection' | 'mqtt_message' | 'pong' | 'error';
+  type: 'connection' | 'mqtt_message' | 'pong' | 'error' | 'subscribed' | 'unsubscribed';
   message?: string;
   data?: MQTTMessage;
+  topics?: string[];
+  streams?: Record<string, StreamOptions>;
+  epoch?: string;
+  seq?: number;
+}
+
+// Per-subscription delivery options sent with a subscribe message
+export interface StreamOptions {
+  delta?: boolean;
+  max_rate_ms?: number;
+}
+
+// Top-level payload fields changed since the previous message of the topic
+export interface WebSocketDeltaMessage {
+  type: 'mqtt_delta';
+  data: Omit<MQTTMessage, 'payload'> & {
+    changes: Record<string, any>;
+    removed?: string[];
+  };
+}
+
+export interface WebSocketReplayGapMessage {
+  type: 'replay_gap';
+  reason: 'evicted' | 'restart';
+  requested: number;
+  oldest_available: number;
+  epoch: string;
+}
+
+export interface WebSocketSlowConsumerMessage {
+  type: 'slow_consumer';
+  policy: 'conflate' | 'drop_oldest' | 'disconnect';
+  dropped: number;
+  conflated: number;
+  pending: number;
+  lag: number;
+}
+
+export interface WebSocketBatchMessage {
+  type: 'mqtt_batch' | 'snapshot' | 'replay';
+  data: MQTTMessage[];
 }
 
 export type ConnectionStatus = 'connecting' | 'connected' | 'disconnected' | 'error';